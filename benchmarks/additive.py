@@ -0,0 +1,58 @@
+import argparse
+import timeit
+
+import numpy as np
+
+from src.additive import AdditiveBank
+from src.dataclasses import Timbre, ADSRProfile, Harmonic, Tremolo
+from src.voicebank import VoiceBank
+
+
+def organ(partials: int) -> Timbre:
+    """Partials falling off with their number, the upper ones fading out after a shorter sustain time each"""
+    harmonics = tuple(Harmonic(k, 1 / k, None if k <= 8 else .2 + 2 / k) for k in range(1, partials + 1))
+    return Timbre(envelope=ADSRProfile(attack=.02, decay=.1, sustain_amplitude=.8, release=.3,
+                                       sustain_till_close=True),
+                  tremolo=Tremolo(rate=6., depth=.05), harmonics=harmonics)
+
+
+def render(bank: VoiceBank, voices: int, chunks: int) -> np.ndarray:
+    """A cluster of 'voices' semitones up from E1 held for most of the chunks, then released"""
+    for voice in range(voices):
+        bank.note_on(voice, 41.2 * 2 ** (voice / 12), .8 / voices, offset=37 * voice % bank.chunk_size)
+    output = []
+    for chunk in range(chunks):
+        if chunk == chunks * 2 // 3:
+            bank.start_closing()
+        output.append(bank.render())
+    return np.concatenate(output) if output else np.zeros(0, dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the voice bank with inverse FFT additive synthesis')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--chunk_size', type=int, default=512)
+    parser.add_argument('--voices', type=int, default=8)
+    parser.add_argument('--partials', type=int, nargs='+', default=[16, 32, 64, 128, 256])
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    for partials in args.partials:
+        timbre = organ(partials)
+        # Few enough low notes that no partial goes past Nyquist, where the voice bank aliases and additive stops
+        direct = render(VoiceBank(timbre, args.sample_rate, args.chunk_size), 8, 200)
+        additive = render(AdditiveBank(timbre, args.sample_rate, args.chunk_size), 8, 200)
+        error = np.sqrt(np.mean(np.square(additive - direct)) / np.mean(np.square(direct)))
+        assert error < 1e-2, f'{partials} partials: the additive engine is {20 * np.log10(error):.1f} dB off'
+
+        row = f'{partials:4d} partials x {args.voices} voices:'
+        for bank_type in (VoiceBank, AdditiveBank):
+            bank = bank_type(timbre, args.sample_rate, args.chunk_size)
+            render(bank, args.voices, 0)
+            elapsed = timeit.timeit(bank.render, number=args.repeats) / args.repeats
+            row += f'  {bank_type.__name__} {elapsed * 1e6:8.1f} us/chunk'
+        print(f'{row}  (additive error {20 * np.log10(error):.1f} dB)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import os
+import timeit
+
+from mido import Message
+
+from src.dataclasses import Timbre, ADSRProfile, Harmonic, ChannelConfig, Vibrato, Tremolo
+from src.synth import ENGINES, create_multichannel_synthesizer
+
+
+def ensemble(channels: int, harmonics: int) -> tuple[ChannelConfig, ...]:
+    envelope = ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, sustain=None, release=.5,
+                           sustain_till_close=True)
+    return tuple(
+        ChannelConfig(channel=channel, volume=1 / channels, timbre=Timbre(
+            envelope=envelope,
+            vibrato=Vibrato(rate=5.5, depth=.06),
+            tremolo=Tremolo(rate=4., depth=.1),
+            harmonics=tuple(Harmonic(multiple=k, amplitude=1 / k, sustain=None) for k in range(2, harmonics + 2))
+        ))
+        for channel in range(channels)
+    )
+
+
+def chunk_time(channels: tuple[ChannelConfig, ...], notes: int, engine: str, threads: int, sample_rate: int,
+               chunk_size: int, repeats: int) -> float:
+    synth = create_multichannel_synthesizer(channels, sample_rate, chunk_size, engine=engine, workers=threads)
+    for config in channels:
+        for note in range(notes):
+            synth.schedule(Message('note_on', channel=config.channel, note=48 + 3 * note, velocity=100), 0)
+    next(synth)
+    elapsed = timeit.timeit(lambda: next(synth), number=repeats) / repeats
+    synth.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rendering all MIDI channels with a growing thread pool')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--chunk_size', type=int, default=512)
+    parser.add_argument('--engine', choices=ENGINES, default='voicebank')
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--notes', type=int, default=4, help='Notes held on every channel')
+    parser.add_argument('--harmonics', type=int, default=8)
+    parser.add_argument('--repeats', type=int, default=200)
+    args = parser.parse_args()
+
+    channels = ensemble(args.channels, args.harmonics)
+    deadline = args.chunk_size / args.sample_rate
+    single = None
+    threads = 1
+    while threads <= max(1, os.cpu_count()):
+        elapsed = chunk_time(channels, args.notes, args.engine, threads, args.sample_rate, args.chunk_size,
+                             args.repeats)
+        single = single or elapsed
+        print(f'{threads:3d} threads   {elapsed * 1e3:7.2f} ms/chunk   speedup {single / elapsed:5.2f}x   '
+              f'deadline load {elapsed / deadline:6.1%}')
+        threads *= 2
+
+
+if __name__ == '__main__':
+    main()
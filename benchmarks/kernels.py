@@ -0,0 +1,84 @@
+import argparse
+import timeit
+import tracemalloc
+
+import numpy as np
+from mido import Message
+
+from src.dataclasses import Timbre, ADSRProfile, Harmonic, Vibrato, Tremolo
+from src.synth import create_synthesizer
+
+TIMBRES = {
+    'sine': Timbre(envelope=ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3,
+                                        sustain_till_close=True),
+                   vibrato=Vibrato(rate=5.5, depth=.06), tremolo=Tremolo(rate=4., depth=.1)),
+    'harmonics': Timbre(envelope=ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3, sustain=.5),
+                        vibrato=Vibrato(rate=5.5, depth=.06), tremolo=Tremolo(rate=4., depth=.1),
+                        harmonics=(Harmonic(1, 1., None), Harmonic(2, .5, None), Harmonic(3, .3, .8))),
+    'saw': Timbre(envelope=ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3, sustain_till_close=True),
+                  vibrato=Vibrato(rate=5.5, depth=.06), tremolo=Tremolo(rate=4., depth=.1), oscillator='saw'),
+}
+
+
+def synthesizer(engine: str, timbre: Timbre, notes: int, sample_rate: int, chunk_size: int):
+    synth = create_synthesizer(timbre, sample_rate, chunk_size, engine=engine)
+    for note in range(notes):
+        synth.schedule(Message('note_on', note=48 + 3 * note, velocity=100), 37 * note)
+    for note in range(notes):
+        synth.schedule(Message('note_off', note=48 + 3 * note), sample_rate + 101 * note)
+    return synth
+
+
+def render(synth) -> np.ndarray:
+    chunks = []
+    while synth.pending_events or synth.voice_count:
+        chunks.append(next(synth))
+        if not synth.pending_events and not synth.is_closing:
+            synth.start_closing()
+    return np.concatenate(chunks)
+
+
+def allocated_per_chunk(synth, chunks: int) -> float:
+    """Mean of the bytes allocated while rendering each chunk"""
+    next(synth)
+    tracemalloc.start()
+    total = 0
+    for _ in range(chunks):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        next(synth)
+        total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return total / chunks
+
+
+def chunk_time(synth, repeats: int) -> float:
+    next(synth)
+    return timeit.timeit(lambda: next(synth), number=repeats) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the fused note kernel with the decorator stack')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--chunk_size', type=int, default=512)
+    parser.add_argument('--notes', type=int, default=16)
+    parser.add_argument('--repeats', type=int, default=50, help='Chunks to measure, all within the notes sustain')
+    args = parser.parse_args()
+
+    for name, timbre in TIMBRES.items():
+        streams = render(synthesizer('streams', timbre, args.notes, args.sample_rate, args.chunk_size))
+        fused = render(synthesizer('fused', timbre, args.notes, args.sample_rate, args.chunk_size))
+        assert np.array_equal(streams, fused), f'{name}: the fused kernel differs from the decorator stack'
+        print(f'{name}: {len(fused)} identical samples')
+
+        for engine in ('streams', 'fused'):
+            allocated = allocated_per_chunk(
+                synthesizer(engine, timbre, args.notes, args.sample_rate, args.chunk_size), args.repeats
+            )
+            elapsed = chunk_time(synthesizer(engine, timbre, args.notes, args.sample_rate, args.chunk_size),
+                                 args.repeats)
+            print(f'  {engine:8s} {elapsed * 1e6:8.1f} us/chunk   {allocated / 1024:8.1f} KiB allocated/chunk')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import time
+
+import numpy as np
+from mido import Message
+
+from benchmarks.kernels import TIMBRES
+from src.dataclasses import Timbre
+from src.synth import create_synthesizer
+
+
+def first_chunk_latency(engine: str, timbre: Timbre, voice_pool: int, notes: int, sample_rate: int,
+                        chunk_size: int) -> np.ndarray:
+    """Seconds from a note-on to its first chunk: building (or resetting) the note's voice and rendering it"""
+    synth = create_synthesizer(timbre, sample_rate, chunk_size, engine=engine, voice_pool=voice_pool)
+    create_note = synth.voices.acquire if synth.voices else synth.note_factory.create_note
+    latencies = np.empty(notes)
+    for index in range(notes):
+        started = time.perf_counter()
+        voice = create_note(frequency=220. + index % 24 * 10, amplitude=.8, offset=17, modulation=synth.modulation)
+        next(voice)
+        latencies[index] = time.perf_counter() - started
+        voice.close()  # A pooled voice goes back to the pool
+    return latencies
+
+
+def render(engine: str, timbre: Timbre, voice_pool: int, notes: int, sample_rate: int, chunk_size: int) -> np.ndarray:
+    """Overlapping, repeated and released notes, to compare pooled voices with fresh ones"""
+    synth = create_synthesizer(timbre, sample_rate, chunk_size, engine=engine, voice_pool=voice_pool)
+    for index in range(notes):
+        synth.schedule(Message('note_on', note=60 + index % 5, velocity=100), 301 * index)
+        synth.schedule(Message('note_off', note=60 + index % 5), 301 * index + 2000)
+    return np.concatenate([next(synth) for _ in range((301 * notes + sample_rate) // chunk_size)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure note-on to first sample latency with and without a voice '
+                                                 'pool')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--chunk_size', type=int, default=512)
+    parser.add_argument('--timbre', choices=TIMBRES, default='harmonics')
+    parser.add_argument('--notes', type=int, default=1000)
+    parser.add_argument('--voice-pool', type=int, default=16)
+    args = parser.parse_args()
+
+    timbre = TIMBRES[args.timbre]
+    for engine in ('streams', 'fused'):
+        fresh = render(engine, timbre, 0, 50, args.sample_rate, args.chunk_size)
+        pooled = render(engine, timbre, args.voice_pool, 50, args.sample_rate, args.chunk_size)
+        assert np.array_equal(fresh, pooled), f'{engine}: pooled voices sound different from fresh ones'
+
+        print(f'{engine}:')
+        for voice_pool in (0, args.voice_pool):
+            latencies = first_chunk_latency(engine, timbre, voice_pool, args.notes, args.sample_rate, args.chunk_size)
+            label = f'pool of {voice_pool}' if voice_pool else 'no pool'
+            print(f'  {label:12s} note-on to first chunk p50 {np.median(latencies) * 1e6:7.1f} us   '
+                  f'p99 {np.percentile(latencies, 99) * 1e6:7.1f} us')
+
+
+if __name__ == '__main__':
+    main()
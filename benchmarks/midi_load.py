@@ -0,0 +1,84 @@
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.kernels import TIMBRES
+from src.loadgen import random_notes, MidiLoadGenerator, NullAudioSink
+from src.midi import VirtualMidiInput, read_midi_file
+from src.synth import ENGINES, MidiSynthesizerStream, create_synthesizer
+
+
+def record_applied(synth: MidiSynthesizerStream) -> list:
+    """Collects (sample, message) for every message as the synthesizer applies it, at its exact sample"""
+    applied, drain = [], synth.events.drain
+
+    def recording_drain(start: int, frames: int | None = None):
+        due = drain(start, frames)
+        applied.extend((start + offset, message) for offset, message in due)
+        return due
+
+    synth.events.drain = recording_drain
+    return applied
+
+
+def run(args) -> dict:
+    port = VirtualMidiInput()
+    synth = create_synthesizer(TIMBRES[args.timbre], args.sample_rate, args.chunk_size, engine=args.engine,
+                               midi_handler=port, voice_pool=args.polyphony)
+    applied = record_applied(synth)
+    sink = NullAudioSink(synth, buffer_chunks=args.buffer_chunks)
+    if args.midi:
+        messages = read_midi_file(args.midi, args.sample_rate)
+    else:
+        messages = random_notes(args.rate, args.polyphony, args.seconds, args.sample_rate, seed=args.seed)
+    generator = MidiLoadGenerator(port, messages, args.sample_rate, speed=args.speed)
+
+    next(sink)
+    generator.start()
+    voices = []
+    while not generator.is_done or synth.pending_events:
+        next(sink)
+        voices.append(synth.voice_count)
+    sink.close()
+    synth.close()
+
+    # A message's latency runs from when it was sent until its sample starts playing
+    sent = {id(message): at for at, message in generator.sent}
+    duration = args.chunk_size / args.sample_rate
+    starts = np.array(sink.starts)
+    latencies = np.array([starts[sample // args.chunk_size] + sample % args.chunk_size / args.sample_rate
+                          - sent[id(message)] for sample, message in applied if id(message) in sent])
+    return {'messages': len(latencies), 'chunks': len(starts), 'deadline_misses': sink.deadline_misses,
+            'voices_mean': float(np.mean(voices)), 'voices_max': int(np.max(voices)),
+            'latency_p50_ms': np.percentile(latencies, 50) * 1e3, 'latency_p99_ms': np.percentile(latencies, 99) * 1e3,
+            'latency_max_ms': latencies.max() * 1e3, 'chunk_ms': duration * 1e3}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play synthetic or recorded MIDI through a virtual port into a '
+                                                 'synthesizer paced by a null audio device, and measure how late '
+                                                 'events are heard and how many chunks miss their deadline')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--chunk_size', type=int, default=512)
+    parser.add_argument('--engine', choices=ENGINES, default='streams')
+    parser.add_argument('--timbre', choices=TIMBRES, default='harmonics')
+    parser.add_argument('--rate', type=float, default=20., help='Random note-ons per second')
+    parser.add_argument('--polyphony', type=int, default=16, help='Random notes held at once on average, at most')
+    parser.add_argument('--seconds', type=float, default=10., help='Length of the random note stream')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--midi', type=str, help='Replay this MIDI file instead of random notes')
+    parser.add_argument('--speed', type=float, default=1., help='Replay this many times as fast')
+    parser.add_argument('--buffer-chunks', type=int, default=2, help='Chunks the null device queues')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    result = run(args)
+    print(f"{result['messages']} messages over {result['chunks']} chunks of {result['chunk_ms']:.1f} ms in "
+          f"{time.perf_counter() - started:.1f}s, {result['voices_mean']:.1f} voices (max {result['voices_max']})")
+    print(f"event to output latency p50 {result['latency_p50_ms']:.1f} ms   p99 {result['latency_p99_ms']:.1f} ms   "
+          f"max {result['latency_max_ms']:.1f} ms   deadline misses {result['deadline_misses']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import timeit
+from dataclasses import replace
+
+import numpy as np
+from mido import Message
+
+from src.dataclasses import Timbre, ADSRProfile, Harmonic, Vibrato, Tremolo, LFO, Polyphony
+from src.effects import lfo_wave
+from src.modulation import ModulationBus, MODULATION_QUALITIES
+from src.synth import create_synthesizer
+
+ENVELOPE = ADSRProfile(attack=.02, decay=.1, sustain_amplitude=.6, release=.2, sustain_till_close=True)
+MODULATED = Timbre(envelope=ENVELOPE, vibrato=Vibrato(rate=5., depth=.3), tremolo=Tremolo(rate=4., depth=.2),
+                   harmonics=(Harmonic(1, 1., None), Harmonic(2, .5, None), Harmonic(3, .3, .4)),
+                   lfos=(LFO(rate=6., depth=.01, target='pitch'), LFO(rate=2., depth=.3, target='amplitude'),
+                         LFO(rate=3., depth=.5, target='harmonics')))
+UNMODULATED = replace(MODULATED, vibrato=None, tremolo=None, lfos=())
+
+
+def per_voice(voices: int, rate: float, sample_rate: int, chunk_size: int):
+    """Every voice runs its own sine generator, as the decorators do without a bus"""
+    generators = [lfo_wave(rate, 1., sample_rate, chunk_size, offset=37 * voice) for voice in range(voices)]
+    return lambda: [next(generator) for generator in generators]
+
+
+def shared(voices: int, rate: float, sample_rate: int, chunk_size: int):
+    """Every voice reads the bus oscillator, shifted by its key-sync angle"""
+    bus = ModulationBus(sample_rate, chunk_size)
+    lfos = [bus.voice(rate, 37 * voice) for voice in range(voices)]
+    out, scratch = np.empty(chunk_size, dtype=np.float32), np.empty(chunk_size, dtype=np.float32)
+
+    def chunk():
+        bus.start_chunk(bus.position + chunk_size)
+        for lfo in lfos:
+            lfo.wave(out=out, scratch=scratch)
+
+    return chunk
+
+
+def render_phrase(engine: str, control_period: int, sample_rate: int, chunk_size: int) -> np.ndarray:
+    """Overlapping notes that start and end mid-chunk, the oldest stolen once three sound"""
+    synth = create_synthesizer(MODULATED, sample_rate, chunk_size, engine=engine, additive_threshold=0,
+                               polyphony=Polyphony(max_voices=3, fade=.01), control_period=control_period)
+    for index, note in enumerate((60, 64, 67, 71, 72)):
+        synth.schedule(Message('note_on', note=note, velocity=100), 3037 * index)
+        synth.schedule(Message('note_off', note=note), 3037 * index + 20011)
+    return np.concatenate([next(synth) for _ in range(sample_rate // chunk_size)])
+
+
+def voice_cost(timbre: Timbre, engine: str, control_period: int, voices: int, sample_rate: int, chunk_size: int,
+               repeats: int) -> float:
+    """Seconds per chunk to render 'voices' held notes"""
+    synth = create_synthesizer(timbre, sample_rate, chunk_size, engine=engine, voice_pool=voices,
+                               additive_threshold=0, control_period=control_period)
+    for voice in range(voices):
+        synth.schedule(Message('note_on', note=36 + voice % 72, velocity=100), 37 * voice % chunk_size)
+    next(synth)
+    return min(timeit.repeat(lambda: next(synth), number=repeats, repeat=5)) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-voice LFOs with a shared modulation bus, and '
+                                                 'control-rate modulation with full-rate modulation')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--chunk_size', type=int, default=512)
+    parser.add_argument('--voices', type=int, default=30)
+    parser.add_argument('--rate', type=float, default=5.5)
+    parser.add_argument('--repeats', type=int, default=200)
+    args = parser.parse_args()
+
+    for name, setup in (('per-voice', per_voice), ('shared', shared)):
+        chunk = setup(args.voices, args.rate, args.sample_rate, args.chunk_size)
+        elapsed = timeit.timeit(chunk, number=args.repeats) / args.repeats
+        print(f'{name:10s} {elapsed * 1e6:8.1f} us/chunk for {args.voices} voices')
+
+    # The LFOs' cost is a modulated timbre's render time over the same timbre's without LFOs
+    for engine in ('voicebank', 'additive'):
+        reference = render_phrase(engine, 1, args.sample_rate, args.chunk_size)
+        print(f'{engine}:')
+        for quality, period in MODULATION_QUALITIES.items():
+            samples = render_phrase(engine, period, args.sample_rate, args.chunk_size)
+            error = np.sqrt(np.mean((samples - reference) ** 2) / np.mean(reference ** 2))
+            total = voice_cost(MODULATED, engine, period, args.voices, args.sample_rate, args.chunk_size, 20)
+            lfos = total - voice_cost(UNMODULATED, engine, period, args.voices, args.sample_rate, args.chunk_size, 20)
+            print(f'  {quality:6s} every {period:2d} samples: {total / args.voices * 1e6:6.2f} us/voice/chunk, '
+                  f'{lfos / args.voices * 1e6:6.2f} of them LFOs, relative error {error:.1e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import timeit
+
+import numpy as np
+
+from src.services import generate_sine_wave, generate_wavetable_wave
+from src.wavetables import harmonic_table, mipmap
+
+
+def previous_generate_sine_wave(freq: float, chunk_size: int, sample_rate: int, volume: float):
+    """The per-chunk np.sin generator the phase accumulator replaced, kept as the baseline"""
+    t = 0
+    omega = 2 * np.pi * freq
+    while True:
+        samples = np.arange(t, t + chunk_size, dtype=np.float32) / sample_rate
+        chunk = np.sin(omega * samples) * volume
+        yield chunk
+        t += chunk_size
+
+
+def chunk_time(generator, repeats: int) -> float:
+    next(generator)
+    return timeit.timeit(lambda: next(generator), number=repeats) / repeats
+
+
+def sine_partials(harmonics: int, frequency: float, chunk_size: int, sample_rate: int, generator):
+    gens = [generator(frequency * (k + 1), chunk_size, sample_rate, 1 / (k + 1)) for k in range(harmonics)]
+
+    def mix():
+        while True:
+            yield sum(next(g) for g in gens)
+
+    return mix()
+
+
+def drift(generator, frequency: float, seconds: float, chunk_size: int, sample_rate: int) -> float:
+    """Largest deviation from an exact sine over the chunk starting 'seconds' into a note"""
+    gen = generator(frequency, chunk_size, sample_rate, 1.)
+    chunks = int(seconds * sample_rate) // chunk_size
+    for _ in range(chunks):
+        next(gen)
+    t = np.arange(chunks * chunk_size, (chunks + 1) * chunk_size, dtype=np.float64)
+    return float(np.abs(next(gen) - np.sin(2 * np.pi * frequency * t / sample_rate)).max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the per-chunk oscillators')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--chunk_size', type=int, default=512)
+    parser.add_argument('--frequency', type=float, default=440.)
+    parser.add_argument('--repeats', type=int, default=2000)
+    args = parser.parse_args()
+    frequency, chunk_size, sample_rate = args.frequency, args.chunk_size, args.sample_rate
+
+    previous = chunk_time(previous_generate_sine_wave(frequency, chunk_size, sample_rate, 1.), args.repeats)
+    current = chunk_time(generate_sine_wave(frequency, chunk_size, sample_rate, 1.), args.repeats)
+    print(f'sine            previous {previous * 1e6:8.1f} us   current {current * 1e6:8.1f} us   '
+          f'speedup {previous / current:5.2f}x')
+
+    for harmonics in (2, 4, 8, 16, 32):
+        previous = chunk_time(
+            sine_partials(harmonics, frequency, chunk_size, sample_rate, previous_generate_sine_wave), args.repeats
+        )
+        table = harmonic_table(tuple((k + 1, 1 / (k + 1)) for k in range(harmonics)))
+        current = chunk_time(generate_wavetable_wave(table, frequency, chunk_size, sample_rate, 1.), args.repeats)
+        print(f'{harmonics:2d} harmonics    previous {previous * 1e6:8.1f} us   current {current * 1e6:8.1f} us   '
+              f'speedup {previous / current:5.2f}x')
+
+    # A saw up to Nyquist: one sine per partial against one read of the band-limited table for the note's octave
+    partials = int(sample_rate / 2 // frequency)
+    previous = chunk_time(sine_partials(partials, frequency, chunk_size, sample_rate, generate_sine_wave), args.repeats)
+    table = mipmap('saw', ((1, 1.),), sample_rate).table(frequency)
+    current = chunk_time(generate_wavetable_wave(table, frequency, chunk_size, sample_rate, 1.), args.repeats)
+    print(f'saw ({partials} sines)  previous {previous * 1e6:8.1f} us   current {current * 1e6:8.1f} us   '
+          f'speedup {previous / current:5.2f}x')
+
+    for minutes in (1, 10):
+        previous = drift(previous_generate_sine_wave, frequency, minutes * 60, chunk_size, sample_rate)
+        current = drift(generate_sine_wave, frequency, minutes * 60, chunk_size, sample_rate)
+        print(f'error after {minutes:2d} min  previous {previous:.2e}   current {current:.2e}')
+
+
+if __name__ == '__main__':
+    main()
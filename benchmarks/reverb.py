@@ -0,0 +1,48 @@
+import argparse
+import timeit
+
+import numpy as np
+
+from src.convolution import PartitionedImpulseResponse, PartitionedConvolver, decaying_noise
+
+
+def convolve(samples: np.ndarray, impulse_response: PartitionedImpulseResponse) -> np.ndarray:
+    """The whole signal and its tail, convolved block by block"""
+    convolver = PartitionedConvolver(impulse_response)
+    size = impulse_response.block_size
+    blocks = -(-len(samples) // size) + impulse_response.partitions
+    padded = np.zeros(blocks * size, dtype=np.float32)
+    padded[:len(samples)] = samples
+    return np.concatenate([convolver.process(padded[start:start + size]) for start in range(0, len(padded), size)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the cost per chunk of the partitioned convolution reverb')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--ir-seconds', type=float, nargs='+', default=[.5, 1., 2., 4.])
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[128, 256, 512, 1024])
+    parser.add_argument('--repeats', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    samples = rng.standard_normal(5000).astype(np.float32)
+    ir = decaying_noise(.1, args.sample_rate)
+    for chunk_size in args.chunk_sizes:
+        impulse_response = PartitionedImpulseResponse(ir, chunk_size)
+        reference = np.convolve(samples, ir / np.sqrt(np.sum(np.square(ir, dtype=np.float64))))
+        error = np.abs(convolve(samples, impulse_response)[:len(reference)] - reference).max()
+        assert error < 1e-4, f'Convolution in blocks of {chunk_size} is {error} off np.convolve'
+
+    chunk = rng.standard_normal(max(args.chunk_sizes)).astype(np.float32)
+    for seconds in args.ir_seconds:
+        ir = decaying_noise(seconds, args.sample_rate)
+        for chunk_size in args.chunk_sizes:
+            impulse_response = PartitionedImpulseResponse(ir, chunk_size)
+            convolver, block = PartitionedConvolver(impulse_response), chunk[:chunk_size]
+            elapsed = timeit.timeit(lambda: convolver.process(block), number=args.repeats) / args.repeats
+            print(f'{seconds:4.1f}s IR, chunk {chunk_size:5d}: {impulse_response.partitions:5d} partitions '
+                  f'{elapsed * 1e6:8.1f} us/chunk ({elapsed * args.sample_rate / chunk_size:.1%} of its deadline)')
+
+
+if __name__ == '__main__':
+    main()
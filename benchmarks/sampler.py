@@ -0,0 +1,60 @@
+import argparse
+import os
+import tempfile
+import timeit
+
+import numpy as np
+
+from src.dataclasses import Timbre, ADSRProfile, Harmonic
+from src.samplebank import build_sample_bank, SamplePlaybackBank
+from src.voicebank import VoiceBank
+
+
+def render(bank: VoiceBank, voices: int, chunks: int) -> np.ndarray:
+    """Chords of 'voices' notes a fifth apart from C2, held for most of the chunks, then released"""
+    for voice in range(voices):
+        note = 36 + 7 * voice % 60
+        bank.note_on(note, 440 * 2 ** ((note - 69) / 12), .8 / voices, offset=37 * voice % bank.chunk_size)
+    output = []
+    for chunk in range(chunks):
+        if chunk == chunks * 2 // 3:
+            bank.start_closing()
+        output.append(bank.render())
+    return np.concatenate(output) if output else np.zeros(0, dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the voice bank with playback from a sample bank')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--chunk_size', type=int, default=512)
+    parser.add_argument('--partials', type=int, default=16)
+    parser.add_argument('--voices', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    timbre = Timbre(envelope=ADSRProfile(attack=.02, decay=.1, sustain_amplitude=.8, release=.3,
+                                         sustain_till_close=True),
+                    harmonics=tuple(Harmonic(k, 1 / k, None) for k in range(1, args.partials + 1)))
+    with tempfile.TemporaryDirectory() as directory:
+        sample_bank = build_sample_bank(timbre, os.path.join(directory, 'bank.synb'), args.sample_rate,
+                                        workers=args.workers)
+        # Before the sustain loop the samples are the voice bank's, so the attack must match
+        attack = args.sample_rate // 4
+        direct = render(VoiceBank(timbre, args.sample_rate, args.chunk_size), 8, 40)[:attack]
+        sampled = render(SamplePlaybackBank(timbre, sample_bank, args.chunk_size), 8, 40)[:attack]
+        assert np.abs(direct - sampled).max() < 1e-5, 'The sample bank does not replay the voice bank'
+
+        for voices in args.voices:
+            row = f'{voices:4d} voices x {args.partials} partials:'
+            for bank in (VoiceBank(timbre, args.sample_rate, args.chunk_size),
+                         SamplePlaybackBank(timbre, sample_bank, args.chunk_size)):
+                render(bank, voices, 0)
+                elapsed = timeit.timeit(bank.render, number=args.repeats) / args.repeats
+                row += f'  {type(bank).__name__} {elapsed * 1e6:8.1f} us/chunk'
+            print(row)
+        del sample_bank, bank
+
+
+if __name__ == '__main__':
+    main()
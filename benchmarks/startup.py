@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+
+LAZY_MODULES = ('sounddevice', 'multiprocessing', 'mido')  # Only loaded once they're needed
+
+
+def start(synthon_args: list[str]) -> dict:
+    """In a fresh process: imports synthon, builds its render chain without a speaker, and renders the first chunk"""
+    started = time.perf_counter()
+    import synthon
+    from src.midi import VirtualMidiInput
+
+    built = time.perf_counter()
+    sys.argv = ['synthon.py', '--disable-speaker'] + synthon_args
+    synth, stream = synthon.create_render_chain(synthon.parse_args(), VirtualMidiInput())
+    rendered = time.perf_counter()
+    next(stream)
+    done = time.perf_counter()
+    synth.close()
+    return {'imports': built - started, 'build': rendered - built, 'first_chunk': done - rendered,
+            **{module: module in sys.modules for module in LAZY_MODULES}}
+
+
+def run(synthon_args: list[str]) -> dict:
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--child', '--'] + synthon_args,
+                            check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    total = time.perf_counter() - started
+    # Starting the interpreter, and leaving it, is the rest
+    return {**result, 'total': total,
+            'interpreter': total - result['imports'] - result['build'] - result['first_chunk']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time how long synthon takes from launch to its first chunk, with '
+                                                 'the patch cache empty (cold) and filled by an earlier start (warm)')
+    parser.add_argument('--runs', type=int, default=5, help='Starts of each kind, the median of which is shown')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('synthon_args', nargs='*', default=['--template', 'organ.json', '--engine', 'fused'],
+                        help='Arguments for synthon, after --')
+    args = parser.parse_args()
+    if args.child:
+        return print(json.dumps(start(args.synthon_args)))
+
+    rows = {'no cache': [], 'cold': [], 'warm': []}
+    for _ in range(args.runs):
+        rows['no cache'].append(run(args.synthon_args))
+        with tempfile.TemporaryDirectory() as directory:
+            cached = args.synthon_args + ['--patch-cache', directory]
+            rows['cold'].append(run(cached))
+            rows['warm'].append(run(cached))
+            assert os.listdir(directory), 'The cold start did not save its patch'
+
+    print(f'synthon {" ".join(args.synthon_args)}')
+    for name, results in rows.items():
+        ms = {key: median(result[key] for result in results) * 1e3
+              for key in ('total', 'interpreter', 'imports', 'build', 'first_chunk')}
+        print(f'{name:>9}: {ms["total"]:6.1f} ms in all   (interpreter {ms["interpreter"]:5.1f}, imports '
+              f'{ms["imports"]:5.1f}, build {ms["build"]:5.1f}, first chunk {ms["first_chunk"]:5.1f} ms)')
+    loaded = [module for module in LAZY_MODULES if rows['warm'][0][module]]
+    print(f'lazy modules loaded without a speaker or MIDI port: {", ".join(loaded) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
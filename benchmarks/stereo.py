@@ -0,0 +1,56 @@
+import argparse
+import timeit
+
+import numpy as np
+from mido import Message
+
+from src.dataclasses import Timbre, ADSRProfile, Harmonic, Panning
+from src.synth import create_synthesizer
+
+ENGINES = ('streams', 'fused', 'voicebank', 'additive')
+TIMBRE = Timbre(envelope=ADSRProfile(attack=.02, decay=.1, sustain_amplitude=.6, release=.2, sustain_till_close=True),
+                harmonics=tuple(Harmonic(k, 1 / k, None) for k in range(1, 9)))
+
+
+def synthesizer(engine: str, panning: Panning | None, voices: int, sample_rate: int, chunk_size: int):
+    """'voices' held notes a fifth apart from C2"""
+    synth = create_synthesizer(TIMBRE, sample_rate, chunk_size, engine=engine, voice_pool=voices,
+                               additive_threshold=0, panning=panning)
+    for voice in range(voices):
+        synth.schedule(Message('note_on', note=36 + 7 * voice % 60, velocity=100), 37 * voice % chunk_size)
+    return synth
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare mono rendering with stereo rendering of panned voices')
+    parser.add_argument('--sample-rate', type=int, default=44100)
+    parser.add_argument('--chunk_size', type=int, default=512)
+    parser.add_argument('--voices', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    # Centered without width, both channels are the mono signal at constant-power gain
+    for engine in ENGINES:
+        mono = synthesizer(engine, None, 8, args.sample_rate, args.chunk_size)
+        stereo = synthesizer(engine, Panning(), 8, args.sample_rate, args.chunk_size)
+        for _ in range(20):
+            expected, chunk = next(mono) * np.float32(np.sqrt(.5)), next(stereo)
+            assert chunk.shape == (args.chunk_size, 2) and chunk.flags.c_contiguous, \
+                f'{engine} renders {chunk.shape} chunks'
+            error = np.abs(chunk - expected[:, None]).max()
+            assert error < 1e-5, f'{engine} in stereo is {error} off its mono signal'
+
+    for voices in args.voices:
+        row = f'{voices:4d} voices:'
+        for engine in ENGINES:
+            costs = []
+            for panning in (None, Panning(spread=1., width=.5)):
+                synth = synthesizer(engine, panning, voices, args.sample_rate, args.chunk_size)
+                next(synth)
+                costs.append(timeit.timeit(lambda: next(synth), number=args.repeats) / args.repeats)
+            row += f'  {engine} {costs[0] * 1e6:7.1f} / {costs[1] * 1e6:7.1f} us'
+        print(row + '  (mono / stereo per chunk)')
+
+
+if __name__ == '__main__':
+    main()
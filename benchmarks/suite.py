@@ -0,0 +1,170 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from dataclasses import dataclass, asdict
+
+import numpy as np
+from mido import Message
+
+from src.base import AudioStream
+from src.composer import AudioStreamComposer
+from src.dataclasses import Timbre, ADSRProfile, Harmonic, Vibrato, Tremolo
+from src.effects import ADSRStreamDecorator, VibratoDecorator, TremoloDecorator
+from src.inputs import SineWaveStream
+from src.services import generate_sine_wave, buffer_stream
+from src.synth import ENGINES, create_synthesizer
+
+COMPONENTS = ('sine', 'buffer', 'composer', 'effects', 'synth')
+# What each component's cost depends on, of the axes the suite sweeps
+AXES = {
+    'sine': ('chunk_size', 'sample_rate'),
+    'buffer': ('chunk_size', 'sample_rate'),
+    'composer': ('voices', 'chunk_size', 'sample_rate'),
+    'effects': ('chunk_size', 'sample_rate'),
+    'synth': ('voices', 'harmonics', 'chunk_size', 'sample_rate'),
+}
+ENVELOPE = ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3, sustain_till_close=True)
+
+
+@dataclass(frozen=True)
+class Case:
+    component: str
+    engine: str = ''  # For 'synth' only
+    voices: int = 1
+    harmonics: int = 1
+    chunk_size: int = 512
+    sample_rate: int = 44100
+
+    @property
+    def name(self) -> str:
+        engine = f'/{self.engine}' if self.engine else ''
+        return ' '.join([self.component + engine] + [f'{axis}={getattr(self, axis)}' for axis in AXES[self.component]])
+
+
+def _sine_slices(case: Case):
+    """A sine in slices that don't line up with chunks, as buffer_stream gets them from note streams"""
+    sine = generate_sine_wave(440., case.chunk_size * 3 // 4 + 1, case.sample_rate, .5)
+    while True:
+        yield next(sine)
+
+
+def _composer(case: Case) -> AudioStream:
+    composer = AudioStreamComposer(case.sample_rate, case.chunk_size)
+    for voice in range(case.voices):
+        composer.add_stream(SineWaveStream(110. * (voice + 1), 1 / case.voices, case.chunk_size, case.sample_rate),
+                            identifier=voice)
+    return composer
+
+
+def _effects(case: Case) -> AudioStream:
+    stream = SineWaveStream(440., .5, case.chunk_size, case.sample_rate)
+    stream = VibratoDecorator(stream, Vibrato(rate=5.5, depth=.06))
+    stream = TremoloDecorator(stream, Tremolo(rate=4., depth=.1))
+    return ADSRStreamDecorator(stream, ENVELOPE)
+
+
+def _synth(case: Case) -> AudioStream:
+    timbre = Timbre(envelope=ENVELOPE, vibrato=Vibrato(rate=5.5, depth=.06), tremolo=Tremolo(rate=4., depth=.1),
+                    harmonics=tuple(Harmonic(k, 1 / k, None) for k in range(1, case.harmonics + 1)))
+    synth = create_synthesizer(timbre, case.sample_rate, case.chunk_size, engine=case.engine,
+                               voice_pool=max(16, case.voices), additive_threshold=0)
+    for voice in range(case.voices):
+        synth.schedule(Message('note_on', note=36 + voice % 72, velocity=100), 37 * voice % case.chunk_size)
+    return synth
+
+
+def source(case: Case):
+    """An endless iterator of the case's chunks, held notes sustaining so the load stays the same"""
+    if case.component == 'sine':
+        return generate_sine_wave(440., case.chunk_size, case.sample_rate, .5)
+    if case.component == 'buffer':
+        return buffer_stream(_sine_slices(case), case.chunk_size)
+    return {'composer': _composer, 'effects': _effects, 'synth': _synth}[case.component](case)
+
+
+def measure(case: Case, min_time: float, rounds: int) -> dict:
+    """Throughput over the fastest of 'rounds' runs of at least 'min_time' seconds each"""
+    chunks = source(case)
+    next(chunks)
+    best = 0.
+    for _ in range(rounds):
+        count, started = 0, time.perf_counter()
+        while (elapsed := time.perf_counter() - started) < min_time:
+            for _ in range(8):
+                next(chunks)
+            count += 8
+        best = max(best, count / elapsed)
+    return {**asdict(case), 'chunks_per_second': best, 'realtime_factor': best * case.chunk_size / case.sample_rate}
+
+
+def plan(components: tuple[str, ...], engines: tuple[str, ...], sweeps: dict[str, list[int]]) -> list[Case]:
+    """Each of a component's axes swept on its own, the others held at the first of their 'sweeps' values"""
+    cases = []
+    for component in components:
+        axes = AXES[component]
+        center = {axis: sweeps[axis][0] for axis in axes}
+        for engine in engines if component == 'synth' else ('',):
+            cases.append(Case(component, engine, **center))
+            for axis in axes:
+                cases += [Case(component, engine, **{**center, axis: value}) for value in sweeps[axis][1:]]
+    return cases
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """The cases whose throughput fell more than 'threshold' below the baseline's"""
+    regressions = []
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result['chunks_per_second'] / baseline[name]['chunks_per_second']
+            if ratio < 1 - threshold:
+                regressions.append(f'{name}: {ratio:.0%} of the baseline throughput')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the throughput of the synthesis pipeline and compare it '
+                                                 'with a baseline')
+    parser.add_argument('--components', choices=COMPONENTS, nargs='+', default=list(COMPONENTS))
+    parser.add_argument('--engines', choices=ENGINES, nargs='+', default=['streams', 'fused', 'voicebank'])
+    parser.add_argument('--voices', type=int, nargs='+', default=[8, 1, 32])
+    parser.add_argument('--harmonics', type=int, nargs='+', default=[4, 1, 16])
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[512, 128, 2048])
+    parser.add_argument('--sample-rates', type=int, nargs='+', default=[44100, 96000])
+    parser.add_argument('--min-time', type=float, default=.2, help='Seconds each round of a case runs for')
+    parser.add_argument('--rounds', type=int, default=3, help='Rounds per case, the fastest of which counts')
+    parser.add_argument('--output', type=str, help='Save the results to this JSON file')
+    parser.add_argument('--baseline', type=str, help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=.1,
+                        help='Fraction of the baseline throughput a case may lose before it counts as a regression')
+    args = parser.parse_args()
+
+    sweeps = {'voices': args.voices, 'harmonics': args.harmonics, 'chunk_size': args.chunk_sizes,
+              'sample_rate': args.sample_rates}
+    cases = plan(tuple(args.components), tuple(args.engines), sweeps)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+
+    results = {}
+    for case in cases:
+        result = results[case.name] = measure(case, args.min_time, args.rounds)
+        row = f'{case.name:<72}{result["chunks_per_second"]:>10.0f} chunks/s {result["realtime_factor"]:>8.1f}x'
+        if case.name in baseline:
+            row += f'  {result["chunks_per_second"] / baseline[case.name]["chunks_per_second"]:6.0%} of baseline'
+        print(row)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'time': time.time(), 'python': sys.version.split()[0], 'numpy': np.__version__,
+                       'machine': platform.machine(), 'processor': platform.processor(), 'results': results},
+                      file, indent=2)
+    if regressions := compare(results, baseline, args.threshold):
+        print('\nRegressions:\n  ' + '\n  '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
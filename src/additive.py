@@ -0,0 +1,163 @@
+import numpy as np
+
+from src.dataclasses import Timbre, Polyphony, Panning
+from src.modulation import ModulationBus
+from src.patches import compiled_table
+from src.voicebank import VoiceBank, NOT_RELEASED
+
+ADDITIVE_THRESHOLD = 32  # Partials from which a sine timbre is rendered by the additive engine
+HOP = 128  # Most samples between the centers of two frames
+LOBE = 4  # Bins on either side of a partial's frequency that its window main lobe covers
+OVERSAMPLING = 64  # Window spectrum samples per bin
+BLACKMAN_HARRIS = (0.35875, 0.48829, 0.14128, 0.01168)
+
+
+@compiled_table
+def synthesis_window(size: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The 4-term Blackman-Harris window's spectrum over its main lobe, sampled OVERSAMPLING times per bin, and the
+    weights that turn the middle half of a windowed frame into a triangle for overlap-add. The window is centered on
+    the frame's middle sample and symmetric, so its spectrum is real.
+    """
+    centered = np.arange(size) - size // 2
+    window = sum(a * np.cos(2 * np.pi * k * centered / size) for k, a in enumerate(BLACKMAN_HARRIS))
+    window[0] = 0.
+    offsets = np.arange(-LOBE * OVERSAMPLING, LOBE * OVERSAMPLING + 2) / OVERSAMPLING
+    spectrum = np.cos(2 * np.pi * np.outer(offsets, centered) / size) @ window
+    hop = size // 4
+    middle = centered[size // 2 - hop:size // 2 + hop]
+    weights = (1 - np.abs(middle) / hop) / window[size // 2 - hop:size // 2 + hop]
+    spectrum.setflags(write=False)
+    weights.setflags(write=False)
+    return spectrum, weights
+
+
+class AdditiveBank(VoiceBank):
+    """
+    Renders the sine partials of all voices by inverse FFT. Every frame, each partial adds the main lobe of the
+    window's spectrum at its frequency, amplitude and phase to one spectrum shared by all voices, which a single
+    inverse FFT turns into the sum of windowed sines. The window is divided out of the middle half of each frame and
+    frames 'hop' samples apart are crossfaded by overlap-add, so each partial's amplitude, from the envelope, its
+    sustain time and the LFOs, and its frequency are interpolated between frames. The cost grows with voices x
+    partials per frame rather than per sample, which pays off from a few dozen partials. In stereo every channel has
+    a spectrum of its own, added to by each partial at its gain in that channel.
+    """
+    variable_blocks = False  # Frames are laid out over whole chunks
+
+    def __init__(self, timbre: Timbre, sample_rate: int, chunk_size: int, capacity: int = 32,
+                 polyphony: Polyphony | None = None, modulation: ModulationBus | None = None,
+                 panning: Panning | None = None, hop: int = HOP):
+        if timbre.oscillator != 'sine':
+            raise ValueError('The additive engine renders sine partials; use another engine for other oscillators')
+        super().__init__(timbre, sample_rate, chunk_size, capacity=capacity, polyphony=polyphony,
+                         modulation=modulation, panning=panning)
+        frames = -(-chunk_size // hop)
+        while chunk_size % frames:
+            frames += 1
+        self.hop = chunk_size // frames
+        self.fft_size = 4 * self.hop
+        self._bins = self.fft_size // 2 + 1
+        self._window_spectrum, self._weights = synthesis_window(self.fft_size)
+        self._centers = np.arange(1, frames + 1) * self.hop  # Relative to the chunk, the last one starts the next
+        self._lobe = np.arange(1 - LOBE, LOBE + 1)
+        # Where each (frame, channel) spectrum starts in the spectra, laid out channel by channel
+        self._frame_bins = (np.arange(frames)[:, None, None, None, None]
+                            + np.arange(self.channels)[:, None] * frames) * self._bins
+        self._carry = np.zeros((self.channels, self.hop), dtype=np.float32)  # The falling half of the last frame
+
+    def _frame_pitch(self, count: int, partials: int, samples: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Phase offsets in cycles from the pitch LFOs, and increments, per voice x partial x frame at 'samples'"""
+        increments, at = self._increment[:count, :partials, None], self.modulation.at
+        offsets, factor = np.zeros((count, partials, len(samples))), np.ones((count, 1, len(samples)))
+        for column, (target, lfo) in enumerate(self._lfos):
+            if target == 'pitch':
+                swing = self._lfo_start_cos[:count, column, None] - self._lfo_wave(column, count, cosine=True)
+                scale = self.sample_rate * lfo.depth / (2 * np.pi * lfo.rate)
+                offsets += increments * scale * at(swing, samples)[:, None]
+                factor += lfo.depth * at(self._lfo_wave(column, count), samples)[:, None]
+        return offsets, increments * factor
+
+    def _frame_amplitudes(self, count: int, partials: int, positions: np.ndarray, samples: np.ndarray) -> np.ndarray:
+        """Each partial's amplitude per voice x partial x frame, at frame centers 'positions' and LFO 'samples'"""
+        amplitudes = np.repeat(self._amplitude[:count, :partials, None], len(samples), axis=2)
+        if (overtone_gain := self._lfo_gain(count, ('harmonics',))) is not None:
+            amplitudes[:, self._overtones[:partials]] *= self.modulation.at(overtone_gain, samples)[:, None]
+        if np.isfinite(self._gate_end[:partials]).any():
+            amplitudes *= self._gates(positions, partials)
+        if self._partial_ramp is not None:
+            amplitudes[:, -1] *= self._partial_ramp[samples]
+            if self._partial_ramp[-1] == 0:
+                self._partials -= 1
+            self._partial_ramp = None
+
+        envelope = self._envelope(positions, self._release_start[:count])
+        if self.polyphony:
+            self._level[:count] = self._amplitude[:count, :self._partials].sum(axis=1) * envelope[:, -1]
+        if (modulation := self._lfo_gain(count, ('vibrato', 'tremolo', 'amplitude'))) is not None:
+            envelope *= self.modulation.at(modulation, samples)
+        if (self._fade_start[:count] != NOT_RELEASED).any():
+            envelope *= self._fade(positions, self._fade_start[:count])
+        return amplitudes * envelope[:, None, :]
+
+    def _spectra(self, amplitudes: np.ndarray, phases: np.ndarray, increments: np.ndarray) -> np.ndarray:
+        """
+        The (channel x frame x bin) spectra of all voices' partials, given per voice x partial x frame, the
+        amplitudes per channel x voice x partial x frame
+        """
+        bins = increments * self.fft_size
+        audible = bins < self.fft_size // 2 - LOBE
+        amplitudes, bins = np.where(audible, amplitudes, 0.).T, np.where(audible, bins, 0.).T
+        phases = 2 * np.pi * phases.T
+        lobe = np.floor(bins)[..., None].astype(np.int64) + self._lobe
+        offsets = (lobe - bins[..., None] + LOBE) * OVERSAMPLING
+        indices = offsets.astype(np.int64)
+        fractions = offsets - indices
+        spectrum = self._window_spectrum[indices] * (1 - fractions) + self._window_spectrum[indices + 1] * fractions
+        # A sine of amplitude A and phase p adds A/2i e^ip W(bin - frequency) (-1)^bin, mirrored below bin 0
+        weights = (spectrum * np.where(lobe % 2, -.5, .5))[..., None, :] * amplitudes[..., None]
+        real = weights * (np.sin(phases)[..., None] * (1 + (lobe == 0)))[..., None, :]
+        imag = weights * (-np.cos(phases)[..., None] * np.sign(lobe))[..., None, :]
+        index = (np.abs(lobe)[..., None, :] + self._frame_bins).ravel()
+        shape = (self.channels, len(self._centers), self._bins)
+        size = np.prod(shape)
+        return (np.bincount(index, real.ravel(), minlength=size)
+                + 1j * np.bincount(index, imag.ravel(), minlength=size)).reshape(shape)
+
+    def render(self, frames: int | None = None) -> np.ndarray:
+        if frames not in (None, self.chunk_size):
+            raise ValueError('The additive engine renders whole chunks')
+        count, hop = self._count, self.hop
+        self.modulation.start_chunk(self._clock)
+        self._clock += self.chunk_size
+        self.silent = not count and not self._carry.any()
+        if self.silent:
+            return self._silence
+        out = np.zeros((self.channels, self.chunk_size), dtype=np.float32)
+        out[:, :hop] = self._carry
+        if not count:
+            self._carry[:] = 0
+            return self._interleave(out)
+
+        # LFOs are read one sample before each frame center, the last of which is the next chunk's first sample
+        partials, samples = self._partials, self._centers - 1
+        positions = self._position[:count, None] + self._centers
+        offsets, increments = self._frame_pitch(count, partials, samples)
+        phases = self._phase[:count, :partials, None] + self._increment[:count, :partials, None] * self._centers
+        phases += offsets
+        amplitudes = self._frame_amplitudes(count, partials, positions, samples)
+        if self.panning:
+            amplitudes = amplitudes * self._pan[:count, :, :partials, None].transpose(1, 0, 2, 3)
+        else:
+            amplitudes = amplitudes[None]
+
+        frames = np.fft.irfft(self._spectra(amplitudes, phases, increments), n=self.fft_size, axis=2)
+        middle = frames[..., self.fft_size // 2 - hop:self.fft_size // 2 + hop] * self._weights
+        rising, falling = middle[..., :hop], middle[..., hop:]
+        out += rising.reshape(self.channels, -1)
+        out[:, hop:] += falling[:, :-1].reshape(self.channels, -1)
+        self._carry[:] = falling[:, -1]
+
+        self._phase[:count] = (self._phase[:count] + self._increment[:count] * self.chunk_size) % 1.
+        self._position[:count] += self.chunk_size
+        self._drop_finished()
+        return self._interleave(out)
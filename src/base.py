@@ -2,14 +2,26 @@ from abc import ABC, abstractmethod
 from typing import Iterator
 
 
+def chunk_shape(frames: int, channels: int = 1) -> tuple[int, ...]:
+    """Mono chunks are flat, others frames x channels and C-contiguous, so their samples are interleaved"""
+    return (frames,) if channels == 1 else (frames, channels)
+
+
 class AudioStream(Iterator, ABC):
-    def __init__(self, sample_rate: int, chunk_size: int):
+    """
+    An endless iterator of chunks shaped chunk_shape(chunk_size, channels). 'silent' tells whether the chunk it last
+    yielded is all zeros, so whatever consumes it may skip work; a stream that doesn't know leaves it False.
+    """
+
+    def __init__(self, sample_rate: int, chunk_size: int, channels: int = 1):
         super().__init__()
         self.sample_rate = sample_rate
         self.chunk_size = chunk_size
+        self.channels = channels
         self.is_closed = False
         self.is_closing = False
         self.current = None
+        self.silent = False
         self._cached_iterable = None
 
     @abstractmethod
@@ -19,7 +31,16 @@ class AudioStream(Iterator, ABC):
     def close(self):
         self.is_closed = True
 
-    def start_closing(self):
+    def reset(self):
+        """Makes a stream that may have closed start afresh; subclasses reset their own state first"""
+        self.is_closed = False
+        self.is_closing = False
+        self.current = None
+        self.silent = False
+        self._cached_iterable = None
+
+    def start_closing(self, offset: int = 0):
+        """Starts closing 'offset' samples into the next chunk"""
         self.is_closing = True
 
     def __next__(self):
@@ -40,6 +61,8 @@ class AudioStream(Iterator, ABC):
         try:
             while True:
                 next(self)
+        except StopIteration:
+            pass
         except KeyboardInterrupt:
             self.close()
             raise
@@ -49,17 +72,21 @@ class AudioStream(Iterator, ABC):
 
 
 class AudioStreamDecorator(AudioStream, ABC):
+    # Whether a silent chunk comes out silent and unchanged, so it can skip transform
+    keeps_silence = False
+
     def __init__(self, stream: AudioStream):
-        super().__init__(sample_rate=stream.sample_rate, chunk_size=stream.chunk_size)
+        super().__init__(sample_rate=stream.sample_rate, chunk_size=stream.chunk_size, channels=stream.channels)
         self.stream = stream
 
     def __next__(self):
         current = super().__next__()
-        return self.transform(current)
+        self.silent = self.keeps_silence and self.stream.silent
+        return current if self.silent else self.transform(current)
 
-    def start_closing(self):
-        self.stream.start_closing()
-        super().start_closing()
+    def start_closing(self, offset: int = 0):
+        self.stream.start_closing(offset)
+        super().start_closing(offset)
 
     @abstractmethod
     def transform(self, stream_item):
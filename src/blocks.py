@@ -0,0 +1,114 @@
+import time
+from collections import Counter
+from typing import TextIO
+
+from src.base import AudioStream
+
+
+def block_sizes(chunk_size: int, sample_rate: int, min_latency: float, max_latency: float) -> tuple[int, ...]:
+    """Doublings of chunk_size that add between 'min_latency' and 'max_latency' seconds, or the one closest to them"""
+    sizes = [chunk_size]
+    while sizes[-1] * 2 <= max_latency * sample_rate:
+        sizes.append(sizes[-1] * 2)
+    return tuple(size for size in sizes if size >= min_latency * sample_rate) or (sizes[-1],)
+
+
+class BlockSizer:
+    """
+    Picks the render block size from the smoothed render time per block as a fraction of its real-time deadline:
+    the next size up once it exceeds 'budget', the next size down once it has stayed low for 'settle' blocks.
+    Halving a block at most doubles its load, so stepping down waits until that would still be within budget.
+    """
+
+    def __init__(self, sizes: tuple[int, ...], sample_rate: int, budget: float = .5, smoothing: float = .3,
+                 settle: int = 16):
+        self.sizes = sizes
+        self.sample_rate = sample_rate
+        self.budget = budget
+        self.smoothing = smoothing
+        self.settle = settle
+        self.index = 0
+        self.load = None
+        self._blocks = 0  # Rendered at the current size
+
+    @property
+    def size(self) -> int:
+        return self.sizes[self.index]
+
+    def update(self, elapsed: float):
+        load = elapsed * self.sample_rate / self.size
+        self.load = load if self.load is None else self.load + self.smoothing * (load - self.load)
+        self._blocks += 1
+        if self.load > self.budget and self.index < len(self.sizes) - 1:
+            self._step(1)
+        elif self.load < self.budget / 2.5 and self.index > 0 and self._blocks >= self.settle:
+            self._step(-1)
+
+    def _step(self, direction: int):
+        self.index += direction
+        self.load = None
+        self._blocks = 0
+
+
+class AdaptiveBlockStream(AudioStream):
+    """
+    Renders a synthesizer in blocks sized to its load and hands them on in chunks of a fixed chunk_size, so the
+    outputs keep their blocksize. Blocks are doublings of chunk_size that add between 'min_latency' and
+    'max_latency' seconds: small ones while rendering is light, larger ones amortizing the cost per block while it
+    is heavy. The synthesizer must take blocks of up to the largest size. 'blocks' counts the blocks rendered per
+    size, reported to 'output' when the stream closes.
+    """
+
+    def __init__(self, synth: AudioStream, chunk_size: int, min_latency: float = 0., max_latency: float = .05,
+                 budget: float = .5, output: TextIO | None = None):
+        super().__init__(sample_rate=synth.sample_rate, chunk_size=chunk_size, channels=synth.channels)
+        self.synth = synth
+        self.output = output
+        self.blocks: Counter[int] = Counter()
+        if not getattr(synth, 'variable_blocks', False):
+            raise ValueError('Adaptive block sizes need an engine that renders blocks of any length')
+        sizes = block_sizes(chunk_size, synth.sample_rate, min_latency, max_latency)
+        if sizes[-1] > synth.chunk_size:
+            raise ValueError(f'The synthesizer renders at most {synth.chunk_size} samples, not {sizes[-1]}')
+        self.sizer = BlockSizer(sizes, synth.sample_rate, budget=budget)
+
+    @property
+    def voice_count(self) -> int:
+        return self.synth.voice_count
+
+    def start_closing(self, offset: int = 0):
+        self.synth.start_closing(offset)
+        super().start_closing(offset)
+
+    def iterable(self):
+        while True:
+            frames = self.sizer.size
+            started = time.perf_counter()
+            block = self.synth.render_block(frames)
+            self.sizer.update(time.perf_counter() - started)
+            self.blocks[frames] += 1
+            self.silent = self.synth.silent
+            for start in range(0, frames, self.chunk_size):
+                yield block[start:start + self.chunk_size]
+
+    def report(self) -> dict[int, dict]:
+        """Per block size: blocks rendered, and the seconds and share of the audio rendered in them"""
+        total = sum(size * count for size, count in self.blocks.items()) or 1
+        return {size: {'blocks': count, 'seconds': size * count / self.sample_rate, 'share': size * count / total}
+                for size, count in sorted(self.blocks.items())}
+
+    def close(self):
+        if not self.is_closed:
+            self.synth.close()
+            if self.output and self.blocks:
+                self.output.write(format_block_report(self.report(), self.sample_rate))
+                self.output.flush()
+        super().close()
+
+
+def format_block_report(report: dict[int, dict], sample_rate: int) -> str:
+    lines = ['Render block sizes:']
+    for size, entry in report.items():
+        lines.append(f"  {size:6d} samples ({size / sample_rate * 1e3:6.1f} ms)  {entry['blocks']:8d} blocks  "
+                     f"{entry['seconds']:8.1f}s  {entry['share']:6.1%}")
+    return '\n'.join(lines) + '\n'
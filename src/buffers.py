@@ -0,0 +1,97 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from src.base import chunk_shape
+
+
+class RingBuffer:
+    """
+    Preallocated single-producer/single-consumer float32 ring of frames, interleaved when there are several channels.
+    The producer only advances the write count and the consumer only advances the read count, each after its copy is
+    done, so neither side needs a lock.
+    """
+
+    def __init__(self, capacity: int, data: np.ndarray | None = None, counters: np.ndarray | None = None,
+                 channels: int = 1):
+        self.data = np.zeros(chunk_shape(capacity, channels), dtype=np.float32) if data is None else data
+        self.capacity = len(self.data)
+        self._counters = np.zeros(2, dtype=np.int64) if counters is None else counters  # [written, read]
+
+    @property
+    def available(self) -> int:
+        return int(self._counters[0] - self._counters[1])
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.available
+
+    def write(self, samples: np.ndarray) -> bool:
+        """Copies all 'samples' in, or nothing when they don't fit"""
+        count = len(samples)
+        if count > self.free:
+            return False
+        start = int(self._counters[0] % self.capacity)
+        first = min(count, self.capacity - start)
+        self.data[start:start + first] = samples[:first]
+        self.data[:count - first] = samples[first:]
+        self._counters[0] += count
+        return True
+
+    def read_into(self, out: np.ndarray) -> int:
+        """Fills 'out' with as many samples as are available and returns how many were read"""
+        count = min(len(out), self.available)
+        start = int(self._counters[1] % self.capacity)
+        first = min(count, self.capacity - start)
+        out[:first] = self.data[start:start + first]
+        out[first:count] = self.data[:count - first]
+        self._counters[1] += count
+        return count
+
+    def peek(self, count: int, skip: int = 0) -> np.ndarray | None:
+        """
+        A view of 'count' samples, 'skip' samples past the next one, without reading them; None unless they are
+        available in one piece
+        """
+        start = int((self._counters[1] + skip) % self.capacity)
+        if self.available < skip + count or start + count > self.capacity:
+            return None
+        return self.data[start:start + count]
+
+    def consume(self, count: int):
+        """Reads 'count' samples that were peeked at"""
+        self._counters[1] += count
+
+
+class SharedRingBuffer(RingBuffer):
+    """
+    A RingBuffer in shared memory, for a producer and a consumer in different processes. The creator owns and
+    unlinks the memory; the other side attaches to it by name. Next to the ring's own counters it keeps a few that
+    either side may set, such as the producer's state.
+    """
+    SLOTS = 8  # int64 counters in front of the samples: written, read, then the extra ones
+
+    def __init__(self, capacity: int, name: str | None = None, channels: int = 1):
+        size = self.SLOTS * 8 + capacity * channels * 4
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.counters = np.ndarray(self.SLOTS, dtype=np.int64, buffer=self.memory.buf)
+        if self.owner:
+            self.counters[:] = 0
+        data = np.ndarray(chunk_shape(capacity, channels), dtype=np.float32, buffer=self.memory.buf,
+                          offset=self.SLOTS * 8)
+        super().__init__(capacity, data=data, counters=self.counters)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def close(self):
+        """Detaches from the memory, and frees it when this side created it"""
+        self.data = self._counters = self.counters = None
+        try:
+            self.memory.close()
+        except BufferError:
+            pass  # A chunk handed out is still referenced; the mapping goes once it is collected
+        if self.owner:
+            self.memory.unlink()
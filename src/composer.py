@@ -1,40 +1,165 @@
+import math
 from typing import Hashable
 
 import numpy as np
 
-from src.base import AudioStream
+from src.base import AudioStream, chunk_shape
+from src.dataclasses import Polyphony
+from src.effects import FadeOutStreamDecorator
+from src.polyphony import steal_order, shed_order
 
 
 class AudioStreamComposer(AudioStream):
-    def __init__(self, sample_rate: int, chunk_size: int):
-        super().__init__(sample_rate, chunk_size)
+    """
+    Mixes mono streams. With more than one output channel, each stream is added with its row of per-channel gains,
+    and a chunk's streams are mixed by one (stream x channel) gain matrix product into interleaved frames.
+    """
+
+    def __init__(self, sample_rate: int, chunk_size: int, polyphony: Polyphony | None = None, channels: int = 1):
+        super().__init__(sample_rate, chunk_size, channels)
+        self.polyphony = polyphony
         self._active_streams = {}
         self._closing_streams = []
+        self._fading_streams = []
+
+        # Per stream bookkeeping for voice stealing
+        self._identifiers: dict[AudioStream, Hashable] = {}
+        self._started: dict[AudioStream, int] = {}
+        self._levels: dict[AudioStream, float] = {}
+        self._gains: dict[AudioStream, np.ndarray] = {}
+        self._started_count = 0
+        self._silence = np.zeros(chunk_shape(chunk_size, channels), dtype=np.float32)
+        self._silence.setflags(write=False)
+
+    @property
+    def stream_count(self) -> int:
+        return len(self._active_streams) + len(self._closing_streams) + len(self._fading_streams)
+
+    def reset(self):
+        """Drops every stream, to mix others from the start"""
+        self._active_streams.clear()
+        self._closing_streams.clear()
+        self._fading_streams.clear()
+        for bookkeeping in (self._identifiers, self._started, self._levels, self._gains):
+            bookkeeping.clear()
+        self._started_count = 0
+        super().reset()
 
-    def add_stream(self, stream: AudioStream, identifier: Hashable):
-        if identifier not in self._active_streams:
-            self._active_streams[identifier] = stream
+    def is_held(self, identifier: Hashable) -> bool:
+        """Whether a stream of 'identifier' plays and hasn't been closed, so that another one would be dropped"""
+        return identifier in self._active_streams
 
-    def close_stream(self, identifier: Hashable):
+    def add_stream(self, stream: AudioStream, identifier: Hashable, offset: int = 0, gains: np.ndarray | None = None):
+        """'gains' has one per output channel; the stream plays in all of them at full level without it"""
+        if identifier in self._active_streams:
+            stream.close()  # Already playing, so the new stream is dropped
+            return
+        if self.polyphony:
+            self._make_room(identifier, offset)
+        if self.channels > 1:
+            self._gains[stream] = np.ones(self.channels, dtype=np.float32) if gains is None else gains
+        self._active_streams[identifier] = stream
+        self._identifiers[stream] = identifier
+        self._started[stream] = self._started_count
+        self._started_count += 1
+
+    def close_stream(self, identifier: Hashable, offset: int = 0):
         if stream := self._active_streams.get(identifier):
             del self._active_streams[identifier]
-            stream.start_closing()
+            stream.start_closing(offset)
             self._closing_streams.append(stream)
 
-    def start_closing(self):
+    def start_closing(self, offset: int = 0):
         for key in list(self._active_streams.keys()):
-            self.close_stream(key)
-        super().start_closing()
+            self.close_stream(key, offset)
+        super().start_closing(offset)
+
+    def _voices(self) -> tuple[list[AudioStream], np.ndarray, np.ndarray, np.ndarray]:
+        """The streams that may be stolen, with when they started, how loud they last were and whether released"""
+        streams = list(self._active_streams.values()) + self._closing_streams
+        started = np.array([self._started[s] for s in streams])
+        levels = np.array([self._levels.get(s, math.inf) for s in streams])
+        released = np.arange(len(streams)) >= len(self._active_streams)
+        return streams, started, levels, released
+
+    def _make_room(self, identifier: Hashable, offset: int):
+        if self.polyphony.steal == 'same-note':
+            for stream in [s for s in self._closing_streams if self._identifiers[s] == identifier]:
+                self._fade_out(stream, offset)
+
+        excess = len(self._active_streams) + len(self._closing_streams) + 1 - (self.polyphony.max_voices or math.inf)
+        if excess > 0:
+            streams, *order_by = self._voices()
+            for index in steal_order(self.polyphony.steal, *order_by)[:excess]:
+                self._fade_out(streams[index], offset)
+
+    def shed(self, count: int, offset: int = 0):
+        """Fades out the 'count' least audible streams"""
+        streams, _, levels, released = self._voices()
+        for index in shed_order(levels, released)[:count]:
+            self._fade_out(streams[index], offset)
+
+    def _fade_out(self, stream: AudioStream, offset: int):
+        identifier = self._identifiers.pop(stream)
+        if self._active_streams.get(identifier) is stream:
+            del self._active_streams[identifier]
+        else:
+            self._closing_streams.remove(stream)
+        self._started.pop(stream)
+        self._levels.pop(stream, None)
+        fade = round(self.polyphony.fade * self.sample_rate) if self.polyphony else 0
+        fading = FadeOutStreamDecorator(stream, fade, offset)
+        if stream in self._gains:
+            self._gains[fading] = self._gains.pop(stream)
+        self._fading_streams.append(fading)
+
+    def _forget(self, streams: list[AudioStream]):
+        for stream in streams:
+            self._identifiers.pop(stream, None)
+            self._started.pop(stream, None)
+            self._levels.pop(stream, None)
+            self._gains.pop(stream, None)
+
+    def _mix(self, chunks: list[np.ndarray], streams: list[AudioStream]) -> np.ndarray:
+        if self.channels == 1:
+            agg = np.zeros(self.chunk_size, dtype=np.float32)
+            for chunk in chunks:
+                agg += chunk
+            return agg
+        if not chunks:
+            return np.zeros(chunk_shape(self.chunk_size, self.channels), dtype=np.float32)
+        return np.matmul(np.array(chunks).T, np.array([self._gains[s] for s in streams]))
 
     def iterable(self):
         while True:
-            agg = np.zeros(self.chunk_size, dtype=np.float32)
-            for s in list(self._active_streams.values()) + self._closing_streams:
+            streams = list(self._active_streams.values()) + self._closing_streams + self._fading_streams
+            # With nothing playing, the same read-only silent chunk is yielded without mixing anything
+            self.silent = not streams
+            if self.silent:
+                yield self._silence
+                continue
+
+            chunks, playing = [], []
+            finished = False
+            for s in streams:
                 try:
-                    agg += next(s)
+                    chunk = next(s)
                 except StopIteration:
                     s.close()
+                    finished = True
+                    continue
+                chunks.append(chunk)
+                playing.append(s)
+                if self.polyphony and s in self._identifiers:
+                    self._levels[s] = float(np.abs(chunk).max())
+            agg = self._mix(chunks, playing)
 
-            self._closing_streams = [s for s in self._closing_streams if not s.is_closed]
+            if finished:
+                self._forget([s for s in self._active_streams.values() if s.is_closed])
+                self._forget([s for s in self._closing_streams if s.is_closed])
+                self._forget([s for s in self._fading_streams if s.is_closed])
+                self._active_streams = {k: s for k, s in self._active_streams.items() if not s.is_closed}
+                self._closing_streams = [s for s in self._closing_streams if not s.is_closed]
+                self._fading_streams = [s for s in self._fading_streams if not s.is_closed]
 
             yield agg
@@ -0,0 +1,83 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from src.base import chunk_shape
+from src.files import read_wav
+
+
+def decaying_noise(seconds: float, sample_rate: int, seed: int = 0) -> np.ndarray:
+    """A synthetic impulse response: white noise decaying by 60 dB over 'seconds'"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (rng.standard_normal(len(t)) * 10 ** (-3 * t / seconds)).astype(np.float32)
+
+
+def resample(samples: np.ndarray, from_rate: int, to_rate: int) -> np.ndarray:
+    """Linear interpolation, which is good enough for the diffuse tail of an impulse response"""
+    if from_rate == to_rate:
+        return samples
+    positions = np.arange(int(len(samples) * to_rate / from_rate)) * (from_rate / to_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+class PartitionedImpulseResponse:
+    """
+    An impulse response cut into 'block_size' partitions, each zero-padded to two blocks and transformed once, for
+    uniformly partitioned convolution. It is scaled to unit energy so that the wet level is comparable across files.
+    """
+
+    def __init__(self, samples: np.ndarray, block_size: int):
+        self.block_size = block_size
+        self.length = len(samples)
+        energy = np.sqrt(np.sum(np.square(samples, dtype=np.float64)))
+        partitions = max(1, -(-len(samples) // block_size))
+        padded = np.zeros((partitions, 2 * block_size))
+        padded[:, :block_size].flat[:len(samples)] = samples / energy if energy else samples
+        self.spectra = np.fft.rfft(padded, axis=1).astype(np.complex64)
+        self.spectra.setflags(write=False)
+
+    @property
+    def partitions(self) -> int:
+        return len(self.spectra)
+
+
+@lru_cache(maxsize=16)
+def _partitioned_file(path: str, modified: float, sample_rate: int, block_size: int) -> PartitionedImpulseResponse:
+    samples, file_rate = read_wav(path)
+    return PartitionedImpulseResponse(resample(samples, file_rate, sample_rate), block_size)
+
+
+def load_impulse_response(filename: str, sample_rate: int, block_size: int) -> PartitionedImpulseResponse:
+    """The partitioned spectra of a WAV impulse response, computed once per file version, sample rate and block size"""
+    path = os.path.abspath(filename)
+    return _partitioned_file(path, os.path.getmtime(path), sample_rate, block_size)
+
+
+class PartitionedConvolver:
+    """
+    Streaming convolution by uniformly partitioned overlap-save. Each block costs two FFTs of two blocks and one
+    multiply-add per partition and frequency bin, however far into the impulse response the tail reaches. The
+    spectra of past input blocks are kept twice in a row, so the newest to oldest are always one contiguous slice.
+    Blocks of several channels (frames x channels) are convolved together, each channel by the same response.
+    """
+
+    def __init__(self, impulse_response: PartitionedImpulseResponse, channels: int = 1):
+        self.impulse_response = impulse_response
+        self.block_size = impulse_response.block_size
+        partitions, bins = impulse_response.spectra.shape
+        self._input = np.zeros(chunk_shape(2 * self.block_size, channels), dtype=np.float32)
+        self._delay_line = np.zeros((2 * partitions,) + chunk_shape(bins, channels), dtype=np.complex64)
+        self._head = 0
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        size, partitions = self.block_size, self.impulse_response.partitions
+        self._input[:size] = self._input[size:]
+        self._input[size:] = block
+        spectrum = np.fft.rfft(self._input, axis=0)
+        self._head = (self._head - 1) % partitions
+        self._delay_line[self._head] = self._delay_line[self._head + partitions] = spectrum
+        mixed = np.einsum('pk...,pk->k...', self._delay_line[self._head:self._head + partitions],
+                          self.impulse_response.spectra)
+        return np.fft.irfft(mixed, n=2 * size, axis=0)[size:].astype(np.float32)
@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from typing import Optional
 
 
-@dataclass
+@dataclass(frozen=True)
 class ADSRProfile:
     attack: float
     decay: float
@@ -10,33 +10,71 @@ class ADSRProfile:
     release: float
     sustain: Optional[float] = None
     sustain_till_close: bool = False
+    floor: Optional[float] = None  # dB below which a note ends once its envelope can't rise again; None plays it out
 
 
-@dataclass
+@dataclass(frozen=True)
 class Harmonic:
     multiple: int
     amplitude: float
     sustain: float | None
 
 
-@dataclass
+@dataclass(frozen=True)
 class Vibrato:
     rate: float  # Frequency of vibrato modulation (in Hz)
     depth: float  # Depth of vibrato modulation (usually in cents or a fraction of a semitone)
 
 
-@dataclass
+@dataclass(frozen=True)
 class Tremolo:
     rate: float  # Frequency of tremolo modulation (in Hz)
     depth: float  # Depth of tremolo modulation (amplitude variation, usually a percentage)
 
 
-@dataclass
+@dataclass(frozen=True)
+class LFO:
+    rate: float  # Hz
+    depth: float  # Fraction of the frequency for 'pitch', of the amplitude for 'amplitude' and 'harmonics'
+    target: str = 'amplitude'  # One of LFO_TARGETS in src.modulation
+    sync: str = 'key'  # 'key' restarts the LFO with every note, 'free' runs one LFO for all notes
+    phase: float = 0.  # Starting phase in cycles
+    spread: float = 0.  # Cycles each successive note's phase is shifted by
+
+
+@dataclass(frozen=True)
 class Timbre:
     envelope: ADSRProfile
     vibrato: Optional[Vibrato] = None
     tremolo: Optional[Tremolo] = None
     harmonics: Optional[tuple[Harmonic, ...]] = None
+    lfos: tuple[LFO, ...] = ()
+    oscillator: str = 'sine'  # One of OSCILLATORS in src.wavetables, played by the note and each harmonic
+    spectrum: tuple[float, ...] = ()  # Amplitudes of harmonics 1, 2, ... of the 'custom' oscillator
+
+
+@dataclass(frozen=True)
+class Panning:
+    position: float = 0.  # Where notes sit, from -1 (left) through 0 (center) to 1 (right)
+    spread: float = 0.  # Added to the position, from -spread at the lowest MIDI note to +spread at the highest
+    width: float = 0.  # How far a note's harmonics fan out to alternate sides of it, up to 1
+
+
+@dataclass(frozen=True)
+class ChannelConfig:
+    channel: int
+    timbre: Timbre
+    volume: float = 1.
+    panning: Panning | None = None  # The synthesizer's panning when None
+
+
+@dataclass(frozen=True)
+class Polyphony:
+    max_voices: int | None = None  # Unlimited when None
+    steal: str = 'released-first'  # One of STEAL_POLICIES in src.polyphony
+    fade: float = .005  # Seconds a stolen or shed voice fades out over
+    adaptive: bool = False  # Shed the least audible voices while rendering approaches the chunk deadline
+    budget: float = .75  # Fraction of the chunk deadline adaptive mode keeps the render time under
 
 
 guitar_envelope = ADSRProfile(attack=.1, decay=.1, sustain_amplitude=.7, release=.1)
@@ -1,56 +1,80 @@
-import itertools
-
 import numpy as np
 
-from src.base import AudioStream, AudioStreamDecorator
+from src.base import AudioStream, AudioStreamDecorator, chunk_shape
+from src.convolution import PartitionedImpulseResponse, PartitionedConvolver
 from src.dataclasses import Vibrato, Tremolo, ADSRProfile
-from src.services import buffer_stream, generate_sine_wave
+from src.envelopes import envelope_table, HarmonicGate
+from src.modulation import ModulationBus, LFOGain
+from src.services import generate_sine_wave, start_phase
+
+
+def lfo_wave(rate: float, depth: float, sample_rate: int, chunk_size: int, offset: int = 0,
+             modulation: ModulationBus | None = None):
+    """A key-synced sine of amplitude 'depth', read from the shared modulation bus when there is one"""
+    if modulation:
+        return modulation.generate(rate, depth, offset)
+    return generate_sine_wave(freq=rate, volume=depth, sample_rate=sample_rate, chunk_size=chunk_size,
+                              phase=start_phase(rate, sample_rate, offset))
 
 
 class ADSRStreamDecorator(AudioStreamDecorator):
-    def __init__(self, stream: AudioStream, profile: ADSRProfile):
+    def __init__(self, stream: AudioStream, profile: ADSRProfile, offset: int = 0):
         super().__init__(stream)
         self.profile = profile
+        self.table = envelope_table(profile, self.sample_rate, self.chunk_size)
+        self.position = -offset
+        self.release_start = self.table.initial_release_start()
+
+    def reset(self, offset: int = 0):
+        self.position = -offset
+        self.release_start = self.table.initial_release_start()
+        super().reset()
 
-        self._gen = buffer_stream(
-            itertools.chain(
-                self._gradient_generator(profile.attack, start=0, end=1),
-                self._gradient_generator(profile.decay, start=1, end=profile.sustain_amplitude),
-                self._generate_sustain_phase(),
-                self._gradient_generator(profile.decay, start=profile.sustain_amplitude, end=0),
-                [np.zeros(self.chunk_size, dtype=np.float32)]
-            ), self.chunk_size
-        )
-
-    def _gradient_generator(self, time: float, start: float = 0, end: float = 1):
-        duration = int(time * self.sample_rate)
-        phase_gradient = np.linspace(start, end, duration)
-        for t in range(0, duration, self.chunk_size):
-            yield phase_gradient[t:t + self.chunk_size]
-
-    def _generate_sustain_phase(self):
-        if self.profile.sustain_till_close:
-            while not self.is_closing:
-                yield np.ones(self.chunk_size, dtype=np.float32) * self.profile.sustain_amplitude
-        else:
-            sustain_duration = int(self.profile.sustain * self.sample_rate)
-            for _ in range(0, sustain_duration, self.chunk_size):
-                yield np.ones(self.chunk_size, dtype=np.float32) * self.profile.sustain_amplitude
+    def start_closing(self, offset: int = 0):
+        if self.release_start is None:
+            self.release_start = self.table.release_start(self.position + offset)
+        super().start_closing(offset)
 
     def transform(self, stream_item):
-        return stream_item * next(self._gen)
+        if self.table.is_finished(self.position, self.release_start):
+            raise StopIteration
+        envelope = self.table.chunk(self.position, self.release_start)
+        self.position += self.chunk_size
+        return stream_item * envelope
+
+
+class HarmonicGateDecorator(AudioStreamDecorator):
+    """Fades harmonics out once their sustain time has passed, then ends them"""
+
+    def __init__(self, stream: AudioStream, gate: HarmonicGate, offset: int = 0):
+        super().__init__(stream)
+        self.gate = gate
+        self.position = -offset
+        self._ramp = np.arange(self.chunk_size)
+
+    def reset(self, offset: int = 0):
+        self.position = -offset
+        super().reset()
+
+    def transform(self, stream_item):
+        if self.position >= self.gate.end:
+            raise StopIteration
+        gain = self.gate.gain(self.position + self._ramp)
+        self.position += self.chunk_size
+        return stream_item * gain
 
 
 class VibratoDecorator(AudioStreamDecorator):
-    def __init__(self, stream: AudioStream, profile: Vibrato):
+    def __init__(self, stream: AudioStream, profile: Vibrato, offset: int = 0,
+                 modulation: ModulationBus | None = None):
         super().__init__(stream)
         self.profile = profile
-        self.sine_gen = generate_sine_wave(
-            freq=self.profile.rate,
-            volume=self.profile.depth,
-            sample_rate=self.sample_rate,
-            chunk_size=self.chunk_size,
-        )
+        self.sine_gen = lfo_wave(profile.rate, profile.depth, self.sample_rate, self.chunk_size, offset, modulation)
+
+    def reset(self, offset: int = 0, modulation: ModulationBus | None = None):
+        self.sine_gen = lfo_wave(self.profile.rate, self.profile.depth, self.sample_rate, self.chunk_size, offset,
+                                 modulation)
+        super().reset()
 
     def transform(self, stream_item):
         vibrato_effect = 1 + self.profile.depth * next(self.sine_gen)
@@ -58,25 +82,107 @@ class VibratoDecorator(AudioStreamDecorator):
 
 
 class TremoloDecorator(AudioStreamDecorator):
-    def __init__(self, stream: AudioStream, profile: Tremolo):
+    def __init__(self, stream: AudioStream, profile: Tremolo, offset: int = 0,
+                 modulation: ModulationBus | None = None):
         super().__init__(stream)
         self.profile = profile
-        self.sine_gen = generate_sine_wave(
-            freq=self.profile.rate,
-            volume=self.profile.depth,
-            sample_rate=self.sample_rate,
-            chunk_size=self.chunk_size,
-        )
+        self.sine_gen = lfo_wave(profile.rate, profile.depth, self.sample_rate, self.chunk_size, offset, modulation)
+
+    def reset(self, offset: int = 0, modulation: ModulationBus | None = None):
+        self.sine_gen = lfo_wave(self.profile.rate, self.profile.depth, self.sample_rate, self.chunk_size, offset,
+                                 modulation)
+        super().reset()
 
     def transform(self, stream_item):
         tremolo_effect = 1 - self.profile.depth + self.profile.depth * next(self.sine_gen)
         return stream_item * tremolo_effect
 
 
+class LFOGainDecorator(AudioStreamDecorator):
+    def __init__(self, stream: AudioStream, gain: LFOGain):
+        super().__init__(stream)
+        self.gain = gain
+
+    def reset(self, gain: LFOGain):
+        self.gain = gain
+        super().reset()
+
+    def transform(self, stream_item):
+        return stream_item * self.gain()
+
+
 class MultiplyAudioStreamDecorator(AudioStreamDecorator):
+    keeps_silence = True
+
     def __init__(self, stream: AudioStream, multiplier: float):
         super().__init__(stream)
         self.multiplier = multiplier
 
     def transform(self, stream_item):
         return stream_item * self.multiplier
+
+
+class FadeOutStreamDecorator(AudioStreamDecorator):
+    """Fades a stream out linearly over 'samples', starting 'offset' samples into the next chunk, then ends it"""
+
+    def __init__(self, stream: AudioStream, samples: int, offset: int = 0):
+        super().__init__(stream)
+        self.samples = max(1, samples)
+        self.position = -offset
+        self._gain = np.concatenate((
+            np.ones(self.chunk_size, dtype=np.float32),
+            np.linspace(1, 0, self.samples, endpoint=False, dtype=np.float32),
+            np.zeros(self.chunk_size, dtype=np.float32)
+        ))
+
+    def close(self):
+        # The faded stream ends with the fade, e.g. returning a pooled voice
+        if not self.is_closed:
+            self.stream.close()
+        super().close()
+
+    def transform(self, stream_item):
+        if self.position >= self.samples:
+            raise StopIteration
+        start = self.chunk_size + self.position
+        self.position += self.chunk_size
+        return stream_item * self._gain[start:start + self.chunk_size]
+
+
+class ConvolutionReverbDecorator(AudioStreamDecorator):
+    """
+    Mixes a stream ('dry') with its convolution by an impulse response ('wet'), partitioned into chunk_size blocks.
+    Once the stream ends, the reverb's tail plays out over as many chunks as there are partitions. Once the convolver
+    has taken in a whole impulse response's length of silence its output is silent too, so further silent chunks
+    pass through without convolving them.
+    """
+
+    def __init__(self, stream: AudioStream, impulse_response: PartitionedImpulseResponse, wet: float = .3,
+                 dry: float = 1.):
+        super().__init__(stream)
+        if impulse_response.block_size != self.chunk_size:
+            raise ValueError('The impulse response must be partitioned into chunk_size blocks')
+        self.convolver = PartitionedConvolver(impulse_response, self.channels)
+        self.wet = np.float32(wet)
+        self.dry = np.float32(dry)
+        self._input_silent = False
+        self._silent_blocks = 0  # Silent blocks the convolver has taken in since the last sound
+
+    def iterable(self):
+        for chunk in self.stream:
+            self._input_silent = self.stream.silent
+            yield chunk
+        self._input_silent = True
+        silence = np.zeros(chunk_shape(self.chunk_size, self.channels), dtype=np.float32)
+        for _ in range(self.convolver.impulse_response.partitions):
+            yield silence
+
+    def transform(self, stream_item):
+        # The first silent block still carries the previous one in its overlap, hence one more than the partitions
+        if self._input_silent and self._silent_blocks > self.convolver.impulse_response.partitions:
+            self.silent = True
+            return stream_item
+        self._silent_blocks = self._silent_blocks + 1 if self._input_silent else 0
+        wet = self.convolver.process(stream_item)
+        wet *= self.wet
+        return stream_item * self.dry + wet
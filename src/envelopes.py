@@ -0,0 +1,122 @@
+from functools import lru_cache
+
+import numpy as np
+
+from src.dataclasses import ADSRProfile, Harmonic
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+class EnvelopeTable:
+    """
+    Precomputed ADSR segments for one profile, sample rate and chunk size. A voice only keeps its position, which is
+    negative before a note starts mid-chunk, and the position its release starts at; release starts once the decay
+    has finished. With a floor, a note ends as soon as its envelope can no longer rise above it.
+    """
+
+    def __init__(self, profile: ADSRProfile, sample_rate: int, chunk_size: int):
+        self.profile = profile
+        self.chunk_size = chunk_size
+        self.sustain_amplitude = np.float32(profile.sustain_amplitude)
+
+        self.head = _read_only(np.concatenate((
+            np.linspace(0, 1, int(profile.attack * sample_rate)),
+            np.linspace(1, profile.sustain_amplitude, int(profile.decay * sample_rate)),
+        )).astype(np.float32))
+        self.release = _read_only(np.linspace(profile.sustain_amplitude, 0, int(profile.release * sample_rate),
+                                              dtype=np.float32))
+        self.head_length = len(self.head)
+        self.release_length = len(self.release)
+        self.sustain_length = None if profile.sustain_till_close else int(profile.sustain * sample_rate)
+
+        sustain = np.full(chunk_size, self.sustain_amplitude, dtype=np.float32)
+        silence = np.zeros(chunk_size, dtype=np.float32)
+        self._onset = _read_only(np.concatenate((silence, self.head, sustain)))
+        self._ending = _read_only(np.concatenate((sustain, self.release, silence)))
+
+        # The loudest the envelope gets from each position on: in the head with the sustain after it, and in release
+        self.floor = 0. if profile.floor is None else 10 ** (profile.floor / 20)
+        self._head_peak = _read_only(np.maximum.accumulate(np.append(self.head, self.sustain_amplitude)[::-1])[::-1])
+        self._release_peak = _read_only(np.append(self.release, np.float32(0)))
+
+    def release_start(self, position: int) -> int:
+        return max(position, self.head_length)
+
+    def initial_release_start(self) -> int | None:
+        return None if self.sustain_length is None else self.head_length + self.sustain_length
+
+    def is_finished(self, position: int, release_start: int | None) -> bool:
+        if release_start is not None and position >= release_start + self.release_length:
+            return True
+        if not self.floor:
+            return False
+        if release_start is not None and position >= release_start:
+            return self._release_peak[position - release_start] < self.floor
+        return self._head_peak[min(max(position, 0), self.head_length)] < self.floor
+
+    def peak_ahead(self, positions: np.ndarray, release_starts: np.ndarray) -> np.ndarray:
+        """The loudest the envelope of each voice gets from its position on, where release starts lie past the
+        position of voices that haven't released"""
+        release = self._release_peak[np.clip(positions - release_starts, 0, self.release_length)]
+        head = self._head_peak[np.clip(positions, 0, self.head_length)]
+        return np.where(positions >= release_starts, release, head)
+
+    def chunk(self, position: int, release_start: int | None) -> np.ndarray:
+        """The envelope for the chunk starting at 'position'; a read-only view except when a chunk spans the
+        attack/decay and the release"""
+        end = position + self.chunk_size
+        if release_start is None or end <= release_start:
+            if position < self.head_length:
+                return self._onset[self.chunk_size + position:self.chunk_size + end]
+            return self._ending[:self.chunk_size]
+
+        offset = min(position - release_start, self.release_length)
+        if offset >= 0 or position >= self.head_length:
+            start = self.chunk_size + offset
+            return self._ending[start:start + self.chunk_size]
+        return np.concatenate((
+            self._onset[self.chunk_size + position:self.chunk_size + release_start],
+            self._ending[self.chunk_size:self.chunk_size + end - release_start]
+        ))
+
+
+@lru_cache(maxsize=64)
+def envelope_table(profile: ADSRProfile, sample_rate: int, chunk_size: int) -> EnvelopeTable:
+    return EnvelopeTable(profile, sample_rate, chunk_size)
+
+
+class HarmonicGate:
+    """
+    A harmonic's gain over its note: 1 for the harmonic's sustain time from the start of the note, then a linear fall
+    to 0 over the envelope's release time, after which the harmonic is silent
+    """
+
+    def __init__(self, sustain: float, release: float, sample_rate: int):
+        self.length = max(1, int(release * sample_rate))
+        self.end = int(sustain * sample_rate) + self.length
+
+    def gain(self, positions: np.ndarray) -> np.ndarray:
+        return np.clip((self.end - positions) / self.length, 0, 1).astype(np.float32)
+
+
+def harmonic_gate(sustain: float | None, envelope: ADSRProfile, sample_rate: int) -> HarmonicGate | None:
+    return None if sustain is None else HarmonicGate(sustain, envelope.release, sample_rate)
+
+
+def sustain_groups(harmonics: tuple[Harmonic, ...], split_overtones: bool = False
+                   ) -> list[tuple[str, tuple[Harmonic, ...], float | None]]:
+    """
+    Harmonics that can be mixed into one table, as (identifier, harmonics, sustain): those with the same sustain time,
+    and, when 'split_overtones', the fundamental apart from the overtones
+    """
+    groups: dict[tuple[bool, float | None], list[Harmonic]] = {}
+    for harmonic in harmonics:
+        groups.setdefault((split_overtones and harmonic.multiple != 1, harmonic.sustain), []).append(harmonic)
+    named = []
+    for (overtones, sustain), group in groups.items():
+        name = ('overtones' if overtones else 'fundamental') if split_overtones else 'harmonics'
+        named.append((name if sustain is None else f'{name} {sustain:g}s', tuple(group), sustain))
+    return named
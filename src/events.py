@@ -0,0 +1,43 @@
+import time
+from collections import deque
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from mido import Message
+
+
+class MidiEventQueue:
+    """
+    Thread-safe queue of messages timed in samples, drained by the render loop once per chunk. Live messages are
+    timed from their arrival relative to the start of the chunk being rendered, and land at the same offset in the
+    next chunk, so they are applied with one chunk of fixed latency instead of chunk-sized jitter. Chunks shorter
+    than chunk_size pass their length to drain.
+    """
+
+    def __init__(self, sample_rate: int, chunk_size: int):
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self._messages: deque[tuple[int, 'Message']] = deque()
+        self._chunk_start = (time.perf_counter(), 0, chunk_size)
+
+    @property
+    def pending(self) -> int:
+        return len(self._messages)
+
+    def put(self, message: 'Message', sample: int | None = None):
+        """Queues a message at an absolute 'sample', or timed from now when no sample is given"""
+        if sample is None:
+            started_at, start, frames = self._chunk_start
+            elapsed = int((time.perf_counter() - started_at) * self.sample_rate)
+            sample = start + frames + min(elapsed, frames - 1)
+        self._messages.append((sample, message))
+
+    def drain(self, start: int, frames: int | None = None) -> list[tuple[int, 'Message']]:
+        """Takes the messages due in the chunk starting at sample 'start', with their offset into the chunk"""
+        frames = frames or self.chunk_size
+        self._chunk_start = (time.perf_counter(), start, frames)
+        end, due = start + frames, []
+        while self._messages and self._messages[0][0] < end:
+            sample, message = self._messages.popleft()
+            due.append((max(0, sample - start), message))
+        return due
@@ -0,0 +1,216 @@
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from src.base import chunk_shape
+from src.services import array_to_wav_format
+
+FILE_FORMATS = ('int16', 'float32', 'raw')
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+
+def wav_header(sample_rate: int, channels: int, file_format: str, frames: int) -> bytes:
+    """RIFF header for 16-bit PCM or 32-bit float samples, 44 or 56 bytes long so the samples stay aligned"""
+    is_float = file_format == 'float32'
+    sample_width = 4 if is_float else 2
+    data_size = frames * channels * sample_width
+    fmt = struct.pack('<HHIIHH', WAVE_FORMAT_IEEE_FLOAT if is_float else WAVE_FORMAT_PCM, channels, sample_rate,
+                      sample_rate * channels * sample_width, channels * sample_width, sample_width * 8)
+    chunks = b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+    if is_float:
+        chunks += b'fact' + struct.pack('<II', 4, frames)
+    chunks += b'data' + struct.pack('<I', data_size)
+    return b'RIFF' + struct.pack('<I', 4 + len(chunks) + data_size) + b'WAVE' + chunks
+
+
+def read_wav(filename: str) -> tuple[np.ndarray, int]:
+    """Float32 samples of a 16/24/32-bit PCM or 32-bit float WAV file, channels mixed down, and its sample rate"""
+    with open(filename, 'rb') as file:
+        data = file.read()
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError(f"'{filename}' is not a WAV file")
+    chunks, position = {}, 12
+    while position + 8 <= len(data):
+        name, size = data[position:position + 4], struct.unpack('<I', data[position + 4:position + 8])[0]
+        chunks.setdefault(name, data[position + 8:position + 8 + size])
+        position += 8 + size + size % 2
+    if b'fmt ' not in chunks or b'data' not in chunks:
+        raise ValueError(f"'{filename}' has no format or data chunk")
+
+    tag, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', chunks[b'fmt '][:16])
+    if tag == 0xFFFE:  # WAVE_FORMAT_EXTENSIBLE keeps the actual format in its sub-format GUID
+        tag = struct.unpack('<H', chunks[b'fmt '][24:26])[0]
+    raw = chunks[b'data']
+    if tag == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        samples = np.frombuffer(raw, dtype='<f4', count=len(raw) // 4)
+    elif tag == WAVE_FORMAT_PCM and bits in (16, 32):
+        dtype = np.dtype(f'<i{bits // 8}')
+        samples = np.frombuffer(raw, dtype=dtype, count=len(raw) // dtype.itemsize) / float(1 << (bits - 1))
+    elif tag == WAVE_FORMAT_PCM and bits == 24:
+        triplets = np.frombuffer(raw, dtype=np.uint8, count=len(raw) // 3 * 3).reshape(-1, 3).astype(np.int32)
+        samples = (triplets[:, 0] | triplets[:, 1] << 8 | triplets[:, 2] << 16) << 8 >> 8
+        samples = samples / float(1 << 23)
+    else:
+        raise ValueError(f"'{filename}' has unsupported samples (format {tag}, {bits} bits)")
+    samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    return samples.astype(np.float32), sample_rate
+
+
+def encode_samples(samples: np.ndarray, file_format: str):
+    if file_format == 'int16':
+        return array_to_wav_format(samples)
+    return memoryview(np.ascontiguousarray(samples, dtype=np.float32)).cast('B')
+
+
+class AudioFileWriter:
+    """
+    Writes to a WAV ('int16', 'float32') or headerless 'raw' float32 file from one long-lived thread. Chunks are
+    copied into preallocated batches of 'batch_frames', and the thread converts and writes a whole batch at a time;
+    the frames of several channels are interleaved in the chunks, batches and file alike. At most 'queue_batches'
+    batches wait for the thread before 'write' blocks. Skipped frames become a hole the thread seeks over. When the
+    thread fails, a later 'write' or 'close' raises its error.
+    """
+
+    def __init__(self, filename: str, sample_rate: int, file_format: str = 'int16', batch_frames: int = 1 << 16,
+                 queue_batches: int = 8, channels: int = 1):
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unknown file format '{file_format}', expected one of {FILE_FORMATS}")
+        self.filename = filename
+        self.sample_rate = sample_rate
+        self.file_format = file_format
+        self.channels = channels
+        self.frames = 0
+        self.file = open(filename, 'wb')
+        if file_format != 'raw':
+            self.file.write(wav_header(sample_rate, channels, file_format, 0))
+        self._frame_width = (2 if file_format == 'int16' else 4) * channels
+        self._skipped = 0  # Frames skipped since the last batch
+
+        self._batches = queue.Queue(maxsize=queue_batches)
+        self._recycled = queue.SimpleQueue()
+        self._batch = np.empty(chunk_shape(batch_frames, channels), dtype=np.float32)
+        self._filled = 0
+        self._error: BaseException | None = None
+        self._thread = threading.Thread(target=self._write_batches, daemon=True)
+        self._thread.start()
+
+    def write(self, samples: np.ndarray):
+        if self._skipped:
+            self._batches.put((None, self._skipped))
+            self._skipped = 0
+        self.frames += len(samples)
+        while len(samples):
+            count = min(len(samples), len(self._batch) - self._filled)
+            self._batch[self._filled:self._filled + count] = samples[:count]
+            self._filled += count
+            samples = samples[count:]
+            if self._filled == len(self._batch):
+                self._submit()
+
+    def skip(self, frames: int):
+        """Leaves 'frames' of silence without writing them"""
+        if self._filled:
+            self._submit()
+        self._skipped += frames
+        self.frames += frames
+
+    def _submit(self):
+        if self._error is not None:
+            raise self._error
+        self._batches.put((self._batch, self._filled))
+        try:
+            self._batch = self._recycled.get_nowait()
+        except queue.Empty:
+            self._batch = np.empty_like(self._batch)
+        self._filled = 0
+
+    def _write_batches(self):
+        while (item := self._batches.get()) is not None:
+            if self._error is not None:
+                continue  # Drains the queue, so 'write' never blocks on a thread that has failed
+            batch, filled = item
+            try:
+                if batch is None:
+                    self.file.seek(filled * self._frame_width, os.SEEK_CUR)
+                    continue
+                self.file.write(encode_samples(batch[:filled], self.file_format))
+            except BaseException as error:
+                self._error = error
+                continue
+            self._recycled.put(batch)
+
+    def close(self, timeout: float | None = None):
+        """Waits up to 'timeout' seconds for the thread to write what is queued, and raises the error it failed on"""
+        if self.file.closed:
+            return
+        if self._filled and self._error is None:
+            self._submit()
+        if self._skipped:
+            self._batches.put((None, self._skipped))
+        self._batches.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise TimeoutError(f"Writing '{self.filename}' did not finish within {timeout} s")
+        if self._error is not None:
+            self.file.close()
+            raise self._error
+        self.file.truncate()  # Extends the file over trailing skipped frames
+        if self.file_format != 'raw':
+            self.file.seek(0)
+            self.file.write(wav_header(self.sample_rate, self.channels, self.file_format, self.frames))
+        self.file.close()
+
+
+class MemoryMappedAudioFile:
+    """
+    Float32 WAV ('float32') or 'raw' file whose samples are assigned straight into a preallocated memory map, for
+    offline renders. The map starts at 'frames' and doubles when it runs out; the file is trimmed on close. It maps
+    frames x channels, so interleaved chunks are assigned as they are.
+    """
+
+    def __init__(self, filename: str, sample_rate: int, frames: int, file_format: str = 'float32', channels: int = 1):
+        if file_format not in ('float32', 'raw'):
+            raise ValueError("Memory-mapped output supports the 'float32' and 'raw' formats only")
+        self.filename = filename
+        self.sample_rate = sample_rate
+        self.file_format = file_format
+        self.channels = channels
+        self.frames = 0
+        self.file = open(filename, 'w+b')
+        self._offset = 0 if file_format == 'raw' else len(wav_header(sample_rate, channels, file_format, 0))
+        self._map(frames)
+
+    def _map(self, frames: int):
+        self.file.truncate(self._offset + frames * self.channels * 4)
+        self.data = np.memmap(self.file, dtype=np.float32, mode='r+', offset=self._offset,
+                              shape=chunk_shape(frames, self.channels))
+
+    def write(self, samples: np.ndarray):
+        end = self.frames + len(samples)
+        if end > len(self.data):
+            self.data.flush()
+            self._map(max(end, 2 * len(self.data)))
+        self.data[self.frames:end] = samples
+        self.frames = end
+
+    def skip(self, frames: int):
+        """Leaves 'frames' of silence; the map's pages that are never written take no space on disk"""
+        if self.frames + frames > len(self.data):
+            self.data.flush()
+            self._map(max(self.frames + frames, 2 * len(self.data)))
+        self.frames += frames
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.data.flush()
+        self.data = None
+        self.file.truncate(self._offset + self.frames * self.channels * 4)
+        if self.file_format != 'raw':
+            self.file.seek(0)
+            self.file.write(wav_header(self.sample_rate, self.channels, self.file_format, self.frames))
+        self.file.close()
@@ -1,18 +1,80 @@
+from typing import Callable
+
+import numpy as np
+
 from src.base import AudioStream
 from src.composer import AudioStreamComposer
 from src.dataclasses import Harmonic, ADSRProfile, Timbre
-from src.effects import ADSRStreamDecorator, VibratoDecorator, TremoloDecorator
-from src.services import generate_sine_wave
+from src.effects import ADSRStreamDecorator, VibratoDecorator, TremoloDecorator, LFOGainDecorator, \
+    HarmonicGateDecorator
+from src.envelopes import harmonic_gate, sustain_groups
+from src.modulation import ModulationBus, PitchModulation, LFOGain, voice_lfos
+from src.services import generate_sine_wave, generate_wavetable_wave, start_phase
+from src.wavetables import oscillator_table
+
+
+class ArrayStream(AudioStream):
+    """Chunks of 'samples', which are frames x channels when there are several"""
+
+    def __init__(self, samples: np.ndarray, chunk_size: int, sample_rate: int):
+        super().__init__(sample_rate=sample_rate, chunk_size=chunk_size,
+                         channels=samples.shape[1] if samples.ndim > 1 else 1)
+        self.samples = samples
+
+    def iterable(self):
+        for start in range(0, len(self.samples), self.chunk_size):
+            chunk = self.samples[start:start + self.chunk_size]
+            if len(chunk) < self.chunk_size:
+                chunk = np.pad(chunk, [(0, self.chunk_size - len(chunk))] + [(0, 0)] * (chunk.ndim - 1))
+            self.silent = not chunk.any()
+            yield chunk
 
 
 class SineWaveStream(AudioStream):
-    def __init__(self, frequency: float, amplitude: float, chunk_size: int, sample_rate: int):
+    def __init__(self, frequency: float, amplitude: float, chunk_size: int, sample_rate: int, offset: int = 0,
+                 pitch: Callable[[], np.ndarray] | None = None):
         super().__init__(sample_rate=sample_rate, chunk_size=chunk_size)
         self.amplitude = amplitude
         self.frequency = frequency
+        self.offset = offset
+        self.pitch = pitch
+
+    def reset(self, frequency: float, amplitude: float, offset: int = 0, pitch: Callable[[], np.ndarray] | None = None):
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.offset = offset
+        self.pitch = pitch
+        super().reset()
 
     def iterable(self):
-        return generate_sine_wave(self.frequency, self.chunk_size, self.sample_rate, self.amplitude)
+        return generate_sine_wave(self.frequency, self.chunk_size, self.sample_rate, self.amplitude,
+                                  phase=start_phase(self.frequency, self.sample_rate, self.offset), pitch=self.pitch)
+
+
+class WavetableStream(AudioStream):
+    def __init__(self, frequency: float, amplitude: float, table, chunk_size: int, sample_rate: int, offset: int = 0,
+                 pitch: Callable[[], np.ndarray] | None = None):
+        super().__init__(sample_rate=sample_rate, chunk_size=chunk_size)
+        self.amplitude = amplitude
+        self.frequency = frequency
+        self.table = table
+        self.offset = offset
+        self.pitch = pitch
+
+    def reset(self, frequency: float, amplitude: float, offset: int = 0, pitch: Callable[[], np.ndarray] | None = None,
+              table=None):
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.offset = offset
+        self.pitch = pitch
+        if table is not None:
+            self.table = table
+        super().reset()
+
+    def iterable(self):
+        return generate_wavetable_wave(self.table, self.frequency, self.chunk_size, self.sample_rate, self.amplitude,
+                                       phase=start_phase(self.frequency, self.sample_rate, self.offset),
+                                       pitch=self.pitch)
 
 
 class HarmonicStream(AudioStream):
@@ -22,66 +84,180 @@ class HarmonicStream(AudioStream):
                  harmonics: tuple[Harmonic],
                  envelope: ADSRProfile,
                  chunk_size: int,
-                 sample_rate: int
+                 sample_rate: int,
+                 offset: int = 0,
+                 pitch: Callable[[], np.ndarray] | None = None,
+                 overtone_gain: LFOGain | None = None,
+                 oscillator: str = 'sine',
+                 spectrum: tuple[float, ...] = ()
                  ):
         super().__init__(sample_rate=sample_rate, chunk_size=chunk_size)
         self.volume = volume
         self.frequency = frequency
         self.harmonics = harmonics
         self.envelope = envelope
+        self.offset = offset
+        self.pitch = pitch
+        self.overtone_gain = overtone_gain
+        self.oscillator = oscillator
+        self.spectrum = spectrum
         self.composer = AudioStreamComposer(sample_rate, chunk_size)
+        # Each mixed wavetable with its harmonics and decorators, kept so that the stream can be reset
+        self._parts: list[tuple[str, tuple, WavetableStream, LFOGainDecorator | None, HarmonicGateDecorator | None,
+                                ADSRStreamDecorator]] = []
         self._prime_composer()
 
+    def _table(self, partials: tuple[tuple[int, float], ...]) -> np.ndarray:
+        return oscillator_table(partials, self.frequency, self.sample_rate, self.oscillator, self.spectrum)
+
+    def _add_wavetable(self, harmonics: tuple[Harmonic, ...], identifier: str, sustain: float | None,
+                       gain: LFOGain | None = None):
+        partials = tuple((h.multiple, h.amplitude) for h in harmonics)
+        wavetable = WavetableStream(
+            frequency=self.frequency,
+            amplitude=self.volume,
+            table=self._table(partials),
+            chunk_size=self.chunk_size,
+            sample_rate=self.sample_rate,
+            offset=self.offset,
+            pitch=self.pitch
+        )
+        gain_decorator = LFOGainDecorator(wavetable, gain) if gain else None
+        gate = harmonic_gate(sustain, self.envelope, self.sample_rate)
+        gate_decorator = HarmonicGateDecorator(gain_decorator or wavetable, gate, self.offset) if gate else None
+        stream = ADSRStreamDecorator(gate_decorator or gain_decorator or wavetable, profile=self.envelope,
+                                     offset=self.offset)
+        self._parts.append((identifier, partials, wavetable, gain_decorator, gate_decorator, stream))
+        self.composer.add_stream(stream, identifier=identifier)
+
     def _prime_composer(self):
-        for harmonic in self.harmonics:
-            stream = SineWaveStream(
-                frequency=self.frequency * harmonic.multiple,
-                amplitude=harmonic.amplitude * self.volume,
-                chunk_size=self.chunk_size,
-                sample_rate=self.sample_rate
-            )
-            stream = ADSRStreamDecorator(stream, profile=self.envelope)
-            self.composer.add_stream(stream, identifier=harmonic.multiple)
+        # Harmonics that share their gain over the note are read together from a single mixed wavetable: those with
+        # the same sustain time, and the overtones apart from the fundamental when they are modulated
+        split = self.overtone_gain is not None and any(h.multiple != 1 for h in self.harmonics)
+        for identifier, harmonics, sustain in sustain_groups(self.harmonics, split_overtones=split):
+            overtones = split and harmonics[0].multiple != 1
+            self._add_wavetable(harmonics, identifier, sustain, gain=self.overtone_gain if overtones else None)
+
+    def reset(self, frequency: float, volume: float, offset: int = 0, pitch: Callable[[], np.ndarray] | None = None,
+              overtone_gain: LFOGain | None = None):
+        """Starts a new note on the same wavetables; the overtones must be modulated like those it was built for"""
+        self.frequency = frequency
+        self.volume = volume
+        self.offset = offset
+        self.pitch = pitch
+        self.overtone_gain = overtone_gain
+        self.composer.reset()
+        for identifier, partials, wavetable, gain_decorator, gate_decorator, stream in self._parts:
+            # The band-limited level depends on the frequency
+            wavetable.reset(frequency, volume, offset, pitch, table=self._table(partials))
+            if gain_decorator:
+                gain_decorator.reset(overtone_gain)
+            if gate_decorator:
+                gate_decorator.reset(offset)
+            stream.reset(offset)
+            self.composer.add_stream(stream, identifier=identifier)
+        super().reset()
 
     def iterable(self):
-        return self.composer
+        while self.composer.stream_count:
+            yield next(self.composer)
 
-    def start_closing(self):
-        self.composer.start_closing()
-        super().start_closing()
+    def start_closing(self, offset: int = 0):
+        self.composer.start_closing(offset)
+        super().start_closing(offset)
 
 
 class TimbredNoteStream(AudioStream):
-    def __init__(self, frequency: float, amplitude: float, timbre_profile: Timbre, chunk_size: int, sample_rate: int):
+    """
+    A note's stream tree for a timbre. The tree only depends on the timbre, so reset starts another note on it
+    without building a new one.
+    """
+
+    def __init__(self,
+                 frequency: float,
+                 amplitude: float,
+                 timbre_profile: Timbre,
+                 chunk_size: int,
+                 sample_rate: int,
+                 offset: int = 0,
+                 modulation: ModulationBus | None = None
+                 ):
         super().__init__(sample_rate=sample_rate, chunk_size=chunk_size)
-        self.stream = SineWaveStream(
-            frequency=frequency,
-            amplitude=amplitude,
-            chunk_size=chunk_size,
-            sample_rate=sample_rate
-        )
+        self.timbre_profile = timbre_profile
+        pitch, amplitude_gain, overtone_gain = self._lfo_modulation(frequency, offset, modulation)
+        self._vibrato, self._tremolo, self._amplitude_gain = None, None, None
 
-        if timbre_profile.harmonics:
-            self.stream = HarmonicStream(
+        if timbre_profile.harmonics or timbre_profile.oscillator != 'sine':
+            self._source = self.stream = HarmonicStream(
                 frequency=frequency,
                 volume=amplitude,
-                harmonics=timbre_profile.harmonics,
+                harmonics=timbre_profile.harmonics or (Harmonic(multiple=1, amplitude=1., sustain=None),),
                 envelope=timbre_profile.envelope,
                 sample_rate=self.sample_rate,
-                chunk_size=self.chunk_size
+                chunk_size=self.chunk_size,
+                offset=offset,
+                pitch=pitch,
+                overtone_gain=overtone_gain,
+                oscillator=timbre_profile.oscillator,
+                spectrum=timbre_profile.spectrum
             )
+            self._envelope = None
         else:
-            self.stream = ADSRStreamDecorator(self.stream, timbre_profile.envelope)
+            self._source = SineWaveStream(
+                frequency=frequency,
+                amplitude=amplitude,
+                chunk_size=chunk_size,
+                sample_rate=sample_rate,
+                offset=offset,
+                pitch=pitch
+            )
+            self._envelope = self.stream = ADSRStreamDecorator(self._source, timbre_profile.envelope, offset=offset)
 
         if timbre_profile.vibrato and timbre_profile.vibrato.rate and timbre_profile.vibrato.depth:
-            self.stream = VibratoDecorator(self.stream, profile=timbre_profile.vibrato)
+            self._vibrato = self.stream = VibratoDecorator(self.stream, profile=timbre_profile.vibrato, offset=offset,
+                                                           modulation=modulation)
 
         if timbre_profile.tremolo and timbre_profile.tremolo.rate and timbre_profile.tremolo.depth:
-            self.stream = TremoloDecorator(self.stream, profile=timbre_profile.tremolo)
+            self._tremolo = self.stream = TremoloDecorator(self.stream, profile=timbre_profile.tremolo, offset=offset,
+                                                           modulation=modulation)
+
+        if amplitude_gain:
+            self._amplitude_gain = self.stream = LFOGainDecorator(self.stream, amplitude_gain)
+
+    def _lfo_modulation(self, frequency: float, offset: int, modulation: ModulationBus | None
+                        ) -> tuple[PitchModulation | None, LFOGain | None, LFOGain | None]:
+        """The note's pitch modulation, amplitude gain and overtone gain from the timbre's LFOs"""
+        pitch, amplitude_gain, overtone_gain = None, None, None
+        if lfos := self.timbre_profile.lfos:
+            if modulation is None:
+                raise ValueError('LFOs are read from a modulation bus, which the note was not given')
+            start, index = modulation.position + offset, modulation.next_voice()
+            if voices := voice_lfos(modulation, lfos, 'pitch', start, index):
+                pitch = PitchModulation(voices, frequency)
+            if voices := voice_lfos(modulation, lfos, 'amplitude', start, index):
+                amplitude_gain = LFOGain(voices)
+            if voices := voice_lfos(modulation, lfos, 'harmonics', start, index):
+                overtone_gain = LFOGain(voices)
+        return pitch, amplitude_gain, overtone_gain
+
+    def reset(self, frequency: float, amplitude: float, offset: int = 0, modulation: ModulationBus | None = None):
+        pitch, amplitude_gain, overtone_gain = self._lfo_modulation(frequency, offset, modulation)
+        if self._envelope:
+            self._source.reset(frequency, amplitude, offset, pitch)
+            self._envelope.reset(offset)
+        else:
+            self._source.reset(frequency, amplitude, offset, pitch, overtone_gain)
+        if self._vibrato:
+            self._vibrato.reset(offset, modulation)
+        if self._tremolo:
+            self._tremolo.reset(offset, modulation)
+        if self._amplitude_gain:
+            self._amplitude_gain.reset(amplitude_gain)
+        super().reset()
 
-    def start_closing(self):
-        self.stream.start_closing()
-        super().start_closing()
+    def start_closing(self, offset: int = 0):
+        self.stream.start_closing(offset)
+        super().start_closing(offset)
 
     def iterable(self):
         return self.stream
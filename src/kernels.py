@@ -0,0 +1,263 @@
+from collections import deque
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+from src.base import AudioStream
+from src.dataclasses import Timbre, Harmonic
+from src.envelopes import envelope_table, harmonic_gate, sustain_groups, HarmonicGate
+from src.modulation import ModulationBus, LFOVoice
+from src.services import start_phase
+from src.wavetables import harmonic_table, mipmap
+
+
+class ScratchBuffers(NamedTuple):
+    out: np.ndarray  # float32, the chunk handed out
+    scratch: np.ndarray  # float32, modulation and interpolation fractions
+    temp: np.ndarray  # float32, for combining shared LFOs
+    positions: np.ndarray  # float64 phases
+    indices: np.ndarray  # int64 table indices
+
+
+class BufferPool:
+    """Reusable chunk-sized buffers; acquire and release may be called from any thread"""
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self._free: deque[ScratchBuffers] = deque()
+
+    def acquire(self) -> ScratchBuffers:
+        try:
+            return self._free.pop()
+        except IndexError:
+            return ScratchBuffers(
+                out=np.empty(self.chunk_size, dtype=np.float32),
+                scratch=np.empty(self.chunk_size, dtype=np.float32),
+                temp=np.empty(self.chunk_size, dtype=np.float32),
+                positions=np.empty(self.chunk_size, dtype=np.float64),
+                indices=np.empty(self.chunk_size, dtype=np.int64),
+            )
+
+    def release(self, buffers: ScratchBuffers):
+        self._free.append(buffers)
+
+
+@lru_cache(maxsize=None)
+def buffer_pool(chunk_size: int) -> BufferPool:
+    return BufferPool(chunk_size)
+
+
+class KernelTable(NamedTuple):
+    values: np.ndarray  # (level, sample) table values
+    slopes: np.ndarray  # (level, sample) differences to the next sample
+    gate: HarmonicGate | None  # Fades the table's harmonics out after their sustain time
+
+
+class TimbreKernel:
+    """
+    A Timbre and output volume compiled into one fused per-chunk kernel. It renders the same samples as the
+    TimbredNoteStream decorator stack, in place and in float32, without allocating per chunk. It is also a note
+    factory for SynthesizerStream.
+    """
+
+    def __init__(self, timbre: Timbre, sample_rate: int, chunk_size: int, volume: float = 1.):
+        if timbre.lfos:
+            raise ValueError('The fused kernel does not render LFOs; use the streams or voicebank engine')
+        self.timbre = timbre
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.volume = volume
+        self.envelope = envelope_table(timbre.envelope, sample_rate, chunk_size)
+        self.pool = buffer_pool(chunk_size)
+        self.arange = np.arange(chunk_size, dtype=np.float64)
+
+        # One table per group of harmonics with the same sustain time, with rows of values and slopes, one per
+        # band-limited level of a non-sine oscillator
+        self.mipmap, self.tables = None, []
+        if timbre.harmonics or timbre.oscillator != 'sine':
+            harmonics = timbre.harmonics or (Harmonic(multiple=1, amplitude=1., sustain=None),)
+            for _, group, sustain in sustain_groups(harmonics):
+                partials = tuple((h.multiple, h.amplitude) for h in group)
+                if timbre.oscillator == 'sine':
+                    tables = harmonic_table(partials)[None]
+                else:
+                    self.mipmap = mipmap(timbre.oscillator, partials, sample_rate, timbre.spectrum)
+                    tables = self.mipmap.tables
+                gate = harmonic_gate(sustain, timbre.envelope, sample_rate)
+                self.tables.append(KernelTable(tables[:, :-1], np.diff(tables, axis=1), gate))
+        # The note ends early once all of its harmonics have been gated
+        self.gate_end = max((table.gate.end if table.gate else np.inf for table in self.tables), default=np.inf)
+        # HarmonicStream's composer yields one silent chunk after the envelope has finished
+        self.trailing_chunks = 1 if self.tables else 0
+
+        vibrato, tremolo = timbre.vibrato, timbre.tremolo
+        self.vibrato = vibrato if vibrato and vibrato.rate and vibrato.depth else None
+        self.tremolo = tremolo if tremolo and tremolo.rate and tremolo.depth else None
+
+    def create_note(self, frequency: float, amplitude: float, offset: int = 0,
+                    modulation: ModulationBus | None = None) -> 'FusedNoteStream':
+        return FusedNoteStream(self, frequency, amplitude, offset, modulation)
+
+
+@lru_cache(maxsize=64)
+def compile_timbre(timbre: Timbre, sample_rate: int, chunk_size: int, volume: float = 1.) -> TimbreKernel:
+    return TimbreKernel(timbre, sample_rate, chunk_size, volume)
+
+
+class FusedNoteStream(AudioStream):
+    """
+    One note rendered by a TimbreKernel. Every chunk is written into the same pooled buffer, so a chunk must be
+    consumed (e.g. mixed by a composer) before the next one is requested.
+    """
+
+    def __init__(self, kernel: TimbreKernel, frequency: float, amplitude: float, offset: int = 0,
+                 modulation: ModulationBus | None = None):
+        super().__init__(sample_rate=kernel.sample_rate, chunk_size=kernel.chunk_size)
+        self.kernel = kernel
+        self.pool = None  # The VoicePool it returns to when it closes
+        self._buffers = None
+        self._start(frequency, amplitude, offset, modulation)
+
+    def _start(self, frequency: float, amplitude: float, offset: int, modulation: ModulationBus | None):
+        kernel = self.kernel
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.position = -offset
+        self.release_start = kernel.envelope.initial_release_start()
+        self._trailing_chunks = kernel.trailing_chunks
+        if self._buffers is None:
+            self._buffers = kernel.pool.acquire()
+
+        self._phase = start_phase(frequency, self.sample_rate, offset)
+        self._increment = frequency / self.sample_rate
+        # Each table's phase and increment in table samples, and its values and slopes at the note's level
+        level = kernel.mipmap.level(frequency) if kernel.mipmap else 0
+        self._tables = [(self._phase * table.values.shape[1], self._increment * table.values.shape[1],
+                         table.values[level], table.slopes[level], table.gate) for table in kernel.tables]
+        self._vibrato_phase = start_phase(kernel.vibrato.rate, self.sample_rate, offset) if kernel.vibrato else 0.
+        self._tremolo_phase = start_phase(kernel.tremolo.rate, self.sample_rate, offset) if kernel.tremolo else 0.
+        # With a modulation bus the LFOs are read from it, like the decorators do
+        self._vibrato: LFOVoice | None = None
+        self._tremolo: LFOVoice | None = None
+        if modulation and kernel.vibrato:
+            self._vibrato = modulation.voice(kernel.vibrato.rate, modulation.position + offset)
+        if modulation and kernel.tremolo:
+            self._tremolo = modulation.voice(kernel.tremolo.rate, modulation.position + offset)
+
+    def reset(self, frequency: float, amplitude: float, offset: int = 0, modulation: ModulationBus | None = None):
+        self._start(frequency, amplitude, offset, modulation)
+        super().reset()
+
+    def start_closing(self, offset: int = 0):
+        if self.release_start is None:
+            self.release_start = self.kernel.envelope.release_start(self.position + offset)
+        super().start_closing(offset)
+
+    def close(self):
+        closing = not self.is_closed
+        if self._buffers is not None:
+            self.kernel.pool.release(self._buffers)
+            self._buffers = None
+        super().close()
+        if closing and self.pool:
+            self.pool.release(self)
+
+    def _sine(self, out: np.ndarray, rate: float, phase: float, volume: float) -> float:
+        """Writes a sine wave into 'out' like generate_sine_wave, and returns the phase for the next chunk"""
+        positions, increment = self._buffers.positions, rate / self.sample_rate
+        np.multiply(self.kernel.arange, 2 * np.pi * increment, out=positions)
+        positions += 2 * np.pi * phase
+        np.copyto(out, positions, casting='same_kind')
+        np.sin(out, out=out)
+        out *= np.float32(volume)
+        return (phase + increment * self.chunk_size) % 1.
+
+    def _lfo(self, out: np.ndarray, voice: LFOVoice | None, rate: float, phase: float, depth: float) -> float:
+        """Writes a key-synced LFO of amplitude 'depth' into 'out', and returns its phase for the next chunk"""
+        if voice is None:
+            return self._sine(out, rate, phase, depth)
+        voice.wave(out=out, scratch=self._buffers.temp)
+        out *= np.float32(depth)
+        return phase
+
+    def _wavetable(self, out: np.ndarray, phase: float, increment: float, values: np.ndarray, slopes: np.ndarray):
+        """Reads a table into 'out' like generate_wavetable_wave"""
+        kernel, (_, fractions, _, positions, indices) = self.kernel, self._buffers
+        np.multiply(kernel.arange, increment, out=positions)
+        positions += phase
+        np.copyto(indices, positions, casting='unsafe')
+        np.subtract(positions, indices, out=positions)
+        np.copyto(fractions, positions, casting='same_kind')
+        indices %= len(values)
+        np.take(slopes, indices, out=out)
+        out *= fractions
+        np.take(values, indices, out=fractions)
+        out += fractions
+        out *= self.amplitude
+
+    def _gate(self, out: np.ndarray, gate: HarmonicGate):
+        """Multiplies 'out' by the gate over the chunk, like HarmonicGateDecorator"""
+        gain, scratch = self._buffers.positions, self._buffers.scratch
+        np.add(self.kernel.arange, self.position, out=gain)
+        np.subtract(gate.end, gain, out=gain)
+        gain /= gate.length
+        np.clip(gain, 0, 1, out=gain)
+        np.copyto(scratch, gain, casting='same_kind')
+        out *= scratch
+
+    def _mix_tables(self, out: np.ndarray, envelope: np.ndarray):
+        """
+        Reads every table into 'out' like HarmonicStream mixes them, each faded by its gate once its harmonics'
+        sustain time has passed and shaped by the envelope
+        """
+        temp = self._buffers.temp
+        for index, (phase, increment, values, slopes, gate) in enumerate(self._tables):
+            target = out if index == 0 else temp
+            if gate and self.position >= gate.end:
+                target.fill(0)
+            else:
+                self._wavetable(target, phase, increment, values, slopes)
+                if gate:
+                    self._gate(target, gate)
+                target *= envelope
+            if index:
+                out += temp
+            self._tables[index] = ((phase + increment * self.chunk_size) % len(values), increment, values, slopes,
+                                   gate)
+
+    def render(self) -> np.ndarray | None:
+        """The next chunk, or None once the note has finished"""
+        kernel, out, scratch = self.kernel, self._buffers.out, self._buffers.scratch
+        if kernel.envelope.is_finished(self.position, self.release_start) or self.position >= kernel.gate_end:
+            if not self._trailing_chunks:
+                return None
+            self._trailing_chunks -= 1
+            out.fill(0)
+            return out
+
+        envelope = kernel.envelope.chunk(self.position, self.release_start)
+        if self._tables:
+            self._mix_tables(out, envelope)
+        else:
+            self._phase = self._sine(out, self.frequency, self._phase, self.amplitude)
+            out *= envelope
+        self.position += self.chunk_size
+
+        if vibrato := kernel.vibrato:
+            self._vibrato_phase = self._lfo(scratch, self._vibrato, vibrato.rate, self._vibrato_phase, vibrato.depth)
+            scratch *= vibrato.depth
+            scratch += 1
+            out *= scratch
+        if tremolo := kernel.tremolo:
+            self._tremolo_phase = self._lfo(scratch, self._tremolo, tremolo.rate, self._tremolo_phase, tremolo.depth)
+            scratch *= tremolo.depth
+            scratch += 1 - tremolo.depth
+            out *= scratch
+        if kernel.volume != 1:
+            out *= kernel.volume
+        return out
+
+    def iterable(self):
+        while (chunk := self.render()) is not None:
+            yield chunk
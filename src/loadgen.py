@@ -0,0 +1,99 @@
+import threading
+import time
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from src.base import AudioStream, AudioStreamDecorator
+from src.midi import TimedMessage, VirtualMidiInput
+
+if TYPE_CHECKING:
+    from mido import Message
+
+
+def random_notes(rate: float, polyphony: int, seconds: float, sample_rate: int, channel: int = 0,
+                 notes: tuple[int, int] = (36, 96), seed: int = 0) -> list[TimedMessage]:
+    """
+    Note-ons arriving at random at 'rate' per second for 'seconds', held long enough that 'polyphony' notes sound on
+    average, never more at once, each note ended by a note_off
+    """
+    from mido import Message
+
+    rng = np.random.default_rng(seed)
+    hold = polyphony / rate
+    events, held, now = [], {}, 0.
+    while (now := now + rng.exponential(1 / rate)) < seconds:
+        for note in [n for n, end in held.items() if end <= now]:
+            events.append((held.pop(note), Message('note_off', channel=channel, note=note)))
+        free = [n for n in range(*notes) if n not in held]
+        if len(held) >= polyphony or not free:
+            continue
+        note = int(rng.choice(free))
+        held[note] = now + rng.exponential(hold)
+        events.append((now, Message('note_on', channel=channel, note=note, velocity=int(rng.integers(40, 128)))))
+    events += [(end, Message('note_off', channel=channel, note=note)) for note, end in held.items()]
+    events.sort(key=lambda event: event[0])
+    return [TimedMessage(sample=round(at * sample_rate), track=0, message=message) for at, message in events]
+
+
+class MidiLoadGenerator:
+    """
+    Replays timed messages into a virtual port from a thread of its own, 'speed' times as fast as they were timed.
+    'sent' keeps each message with the perf_counter time it was sent at.
+    """
+
+    def __init__(self, port: VirtualMidiInput, messages: list[TimedMessage], sample_rate: int, speed: float = 1.):
+        self.port = port
+        self.messages = messages
+        self.sample_rate = sample_rate
+        self.speed = speed
+        self.sent: list[tuple[float, 'Message']] = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._replay, daemon=True)
+
+    @property
+    def is_done(self) -> bool:
+        return not self._thread.is_alive()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _replay(self):
+        started = time.perf_counter()
+        for timed in self.messages:
+            due = started + timed.sample / self.sample_rate / self.speed
+            if self._stopped.wait(max(0., due - time.perf_counter())):
+                return
+            self.sent.append((time.perf_counter(), timed.message))
+            self.port.send(timed.message)
+
+
+class NullAudioSink(AudioStreamDecorator):
+    """
+    Takes chunks at the pace of an audio device that queues up to 'buffer_chunks', without playing them. 'starts'
+    holds the perf_counter time each chunk starts playing at; a chunk that arrives after the device has run out is a
+    deadline miss, and starts late.
+    """
+
+    def __init__(self, stream: AudioStream, buffer_chunks: int = 2):
+        super().__init__(stream)
+        self.buffer = buffer_chunks * self.chunk_size / self.sample_rate
+        self.starts: list[float] = []
+        self.deadline_misses = 0
+        self._play_at = None  # When the next chunk starts playing
+
+    def transform(self, stream_item):
+        now = time.perf_counter()
+        if self._play_at is not None and now > self._play_at:
+            self.deadline_misses += 1
+        self._play_at = now if self._play_at is None else max(now, self._play_at)
+        self.starts.append(self._play_at)
+        self._play_at += self.chunk_size / self.sample_rate
+        if (wait := self._play_at - self.buffer - time.perf_counter()) > 0:
+            time.sleep(wait)
+        return stream_item
@@ -1,18 +1,83 @@
-from typing import Callable
+from dataclasses import dataclass
+from typing import Callable, TYPE_CHECKING
 
-import mido
-from mido import Message
+if TYPE_CHECKING:
+    from mido import Message
 
+DEFAULT_TEMPO = 500000  # Microseconds per beat until the file sets a tempo
 
-class MidiInputHandler:
-    def __init__(self, port_name: str):
-        self.port_name = port_name
-        self.observers: dict[int, list[Callable[[Message], ...]]] = {c: [] for c in range(16)}
-        self.device = mido.open_input(self.port_name, callback=self.notify_observers)
 
-    def register_observer(self, observer: Callable[[Message], ...], channel: int):
+@dataclass(frozen=True)
+class TimedMessage:
+    sample: int
+    track: int
+    message: 'Message'
+
+
+class MidiInput:
+    """Hands each MIDI message to the observers of its channel"""
+
+    def __init__(self):
+        self.observers: dict[int, list[Callable[['Message'], ...]]] = {c: [] for c in range(16)}
+
+    def register_observer(self, observer: Callable[['Message'], ...], channel: int):
         self.observers[channel].append(observer)
 
-    def notify_observers(self, message: mido.Message):
+    def unregister_observer(self, observer: Callable[['Message'], ...], channel: int):
+        if observer in self.observers[channel]:
+            self.observers[channel].remove(observer)
+
+    def notify_observers(self, message: 'Message'):
         for observer in self.observers[message.channel]:
             observer(message)
+
+    def close(self):
+        pass
+
+
+class MidiInputHandler(MidiInput):
+    """Messages from a MIDI input port, delivered on mido's callback thread"""
+
+    def __init__(self, port_name: str):
+        import mido  # Only ports and MIDI files need it, so it stays out of startup
+
+        super().__init__()
+        self.port_name = port_name
+        self.device = mido.open_input(self.port_name, callback=self.notify_observers)
+
+    def close(self):
+        """Closes the port, which stops its callback thread"""
+        self.device.close()
+
+
+class VirtualMidiInput(MidiInput):
+    """An in-process port: each message sent reaches the observers on the sender's thread, as from a real port's"""
+
+    def send(self, message: 'Message'):
+        self.notify_observers(message)
+
+
+def read_midi_file(filename: str, sample_rate: int) -> list[TimedMessage]:
+    """Note messages of all tracks in play order, timed in samples. A note_on without velocity is a note_off."""
+    import mido
+
+    midi_file = mido.MidiFile(filename)
+    merged = []
+    for track_index, track in enumerate(midi_file.tracks):
+        tick = 0
+        for message in track:
+            tick += message.time
+            merged.append((tick, track_index, message))
+    merged.sort(key=lambda item: item[0])
+
+    messages, tempo, last_tick, seconds = [], DEFAULT_TEMPO, 0, 0.
+    for tick, track_index, message in merged:
+        seconds += mido.tick2second(tick - last_tick, midi_file.ticks_per_beat, tempo)
+        last_tick = tick
+        if message.type == 'set_tempo':
+            tempo = message.tempo
+        elif message.type in ('note_on', 'note_off'):
+            if message.type == 'note_on' and message.velocity == 0:
+                message = mido.Message('note_off', channel=message.channel, note=message.note)
+            messages.append(TimedMessage(sample=round(seconds * sample_rate), track=track_index, message=message))
+    return messages
@@ -0,0 +1,199 @@
+import math
+from itertools import repeat
+from typing import Iterator
+
+import numpy as np
+
+from src.dataclasses import LFO
+
+LFO_TARGETS = ('pitch', 'amplitude', 'harmonics')
+LFO_SYNC_MODES = ('key', 'free')
+MODULATION_QUALITIES = {'full': 1, 'high': 16, 'medium': 32, 'low': 64}  # Samples between control points
+MAX_SPAN = 512  # Most samples one interpolation matrix covers
+
+
+class ModulationBus:
+    """
+    Low-frequency oscillators shared by every voice of a synthesizer. Each distinct rate is computed once per chunk,
+    as a sine and a cosine of its phase at the bus' sample clock. A voice's LFO is that sine shifted by a constant
+    angle, sin(a - angle) = sin(a) cos(angle) - cos(a) sin(angle), so key-synced and phase-offset voices cost a
+    multiply-add instead of a sine. Whoever renders calls start_chunk with the first sample of each chunk, and its
+    length when that is shorter than chunk_size.
+
+    With a 'control_period' above 1, oscillators are only evaluated at the chunk's control points 'offsets', every
+    that many samples up to and including one at or past the chunk's end. Voice banks combine the envelopes and LFOs
+    of all their voices at those points, and upsample the result to audio rate by linear interpolation once: a
+    product with a matrix of interpolation weights per span of up to MAX_SPAN samples, one BLAS call rather than
+    several passes over a (voice x sample) array. Notes rendered one stream each read their LFOs sample by sample,
+    from a bus with a control period of 1.
+    """
+
+    def __init__(self, sample_rate: int, chunk_size: int, control_period: int = 1):
+        if control_period < 1:
+            raise ValueError('The control period must be at least one sample')
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.control_period = control_period
+        self.position = 0
+        self.frames = chunk_size
+        self.voices_started = 0
+        self.origin = 0  # Sample of a longer render the clock's sample 0 is at
+        self._layouts: dict[int, tuple[np.ndarray, np.ndarray | None, dict[np.dtype, np.ndarray]]] = {}
+        self.offsets, self._windows, self._weights = self._layout(chunk_size)
+        self._oscillators: dict[float, tuple[np.ndarray, np.ndarray]] = {}
+
+    def _layout(self, frames: int) -> tuple[np.ndarray, np.ndarray | None, dict[np.dtype, np.ndarray]]:
+        """
+        The control point offsets for chunks of 'frames', the control points each span of the chunk interpolates
+        between, and the (point x sample) weights that interpolate a span, by dtype
+        """
+        period = self.control_period
+        if period == 1:
+            return np.arange(frames), None, {}
+        if (layout := self._layouts.get(frames)) is None:
+            points = min(-(-frames // period), MAX_SPAN // period or 1)
+            span, spans = points * period, -(-frames // (points * period))
+            samples = np.arange(span)
+            fractions = samples % period / period
+            weights = np.zeros((points + 1, span))
+            weights[samples // period, samples] = 1 - fractions
+            weights[samples // period + 1, samples] = fractions
+            windows = np.arange(spans)[:, None] * points + np.arange(points + 1)
+            layout = self._layouts[frames] = (np.arange(spans * points + 1) * period, windows, {
+                np.dtype(np.float32): weights.astype(np.float32), np.dtype(np.float64): weights})
+        return layout
+
+    def start_chunk(self, position: int, frames: int | None = None):
+        """Moves the clock to the chunk starting at sample 'position'; calling it again for the same chunk is a no-op"""
+        frames = frames or self.chunk_size
+        if position != self.position or frames != self.frames:
+            if frames != self.frames:
+                self.offsets, self._windows, self._weights = self._layout(frames)
+            self.position = position
+            self.frames = frames
+            self._oscillators.clear()
+
+    def resume(self, origin: int, voices_started: int = 0):
+        """Continues a longer render from its sample 'origin' after 'voices_started' notes, to render a part alone"""
+        self.origin = origin
+        self.voices_started = voices_started
+        self._oscillators.clear()
+
+    def upsample(self, values: np.ndarray) -> np.ndarray:
+        """Values at the control points (along the last axis) linearly interpolated to every sample of the chunk"""
+        if self.control_period == 1:
+            return values
+        weights = self._weights[values.dtype]
+        if len(self._windows) == 1:
+            return np.matmul(values, weights)[..., :self.frames]
+        spans = values[..., self._windows].reshape(-1, len(weights))
+        return np.matmul(spans, weights).reshape(values.shape[:-1] + (-1,))[..., :self.frames]
+
+    def at(self, values: np.ndarray, samples: np.ndarray) -> np.ndarray:
+        """Values at the control points (along the last axis) interpolated at the chunk's sample offsets 'samples'"""
+        if self.control_period == 1:
+            return values[..., samples]
+        points, fractions = np.divmod(samples, self.control_period)
+        fractions = (fractions / self.control_period).astype(values.dtype)
+        return values[..., points] + (values[..., points + 1] - values[..., points]) * fractions
+
+    def phase(self, rate: float, sample: int) -> float:
+        """Phase in cycles of an oscillator at 'rate' at a sample of the clock"""
+        return rate * (self.origin + sample) / self.sample_rate % 1.
+
+    def oscillator(self, rate: float) -> tuple[np.ndarray, np.ndarray]:
+        """The read-only float32 sine and cosine of an oscillator at 'rate' at the current chunk's control points"""
+        if (waves := self._oscillators.get(rate)) is None:
+            angles = 2 * np.pi * (self.phase(rate, self.position) + rate / self.sample_rate * self.offsets)
+            waves = tuple(wave.astype(np.float32) for wave in (np.sin(angles), np.cos(angles)))
+            for wave in waves:
+                wave.setflags(write=False)
+            self._oscillators[rate] = waves
+        return waves
+
+    def next_voice(self) -> int:
+        """Counts a started note, for LFOs that spread their phase across notes"""
+        self.voices_started += 1
+        return self.voices_started - 1
+
+    def angle(self, rate: float, start: int, sync: str = 'key', phase: float = 0.) -> float:
+        """
+        The angle a voice lags the bus oscillator by. A key-synced LFO starts at 'phase' (in cycles) on the sample the
+        note starts, a free-running one is 'phase' ahead of the bus.
+        """
+        synced = self.phase(rate, start) if sync == 'key' else 0.
+        return 2 * np.pi * (synced - phase)
+
+    def voice(self, rate: float, start: int, sync: str = 'key', phase: float = 0.) -> 'LFOVoice':
+        return LFOVoice(self, rate, self.angle(rate, start, sync, phase), start)
+
+    def lfo_voice(self, lfo: LFO, start: int, index: int) -> 'LFOVoice':
+        return self.voice(lfo.rate, start, lfo.sync, (lfo.phase + lfo.spread * index) % 1.)
+
+    def generate(self, rate: float, volume: float, offset: int = 0) -> Iterator[np.ndarray]:
+        """Like generate_sine_wave for a key-synced LFO that starts 'offset' samples into the current chunk"""
+        voice = self.voice(rate, self.position + offset)
+        return (voice.wave() * np.float32(volume) for _ in repeat(None))
+
+
+class LFOVoice:
+    """One voice's LFO, derived from the bus oscillator at its rate"""
+
+    def __init__(self, bus: ModulationBus, rate: float, angle: float, start: int):
+        self.bus = bus
+        self.rate = rate
+        self.angle = angle
+        self.cos = np.float32(math.cos(angle))
+        self.sin = np.float32(math.sin(angle))
+        # Where the LFO's cosine starts, the integration constant for pitch modulation
+        self.start_cos = math.cos(2 * np.pi * bus.phase(rate, start) - angle)
+
+    def wave(self, out: np.ndarray | None = None, scratch: np.ndarray | None = None) -> np.ndarray:
+        """sin(a - angle) at the chunk's control points, in 'out' if given (using 'scratch' to stay allocation free)"""
+        sin, cos = self.bus.oscillator(self.rate)
+        if not self.angle and out is None:
+            return sin
+        out = np.multiply(sin, self.cos, out=out)
+        out -= np.multiply(cos, self.sin, out=scratch)
+        return out
+
+    def cosine(self) -> np.ndarray:
+        """cos(a - angle) at the current chunk's control points"""
+        sin, cos = self.bus.oscillator(self.rate)
+        return cos * self.cos + sin * self.sin
+
+
+class PitchModulation:
+    """
+    Per chunk phase offsets in cycles that bend a note's pitch by 'depth' times its frequency along each pitch LFO.
+    They follow from integrating the frequency, f depth sin(2 pi r t - angle), which is analytic for a sine.
+    """
+
+    def __init__(self, voices: list[tuple[LFOVoice, float]], frequency: float):
+        self.terms = [(voice, frequency * depth / voice.rate) for voice, depth in voices]
+
+    def __call__(self) -> np.ndarray:
+        offsets = np.zeros(self.terms[0][0].bus.chunk_size, dtype=np.float64)
+        for voice, scale in self.terms:
+            offsets += scale / (2 * np.pi) * (voice.start_cos - voice.cosine())
+        return offsets
+
+
+class LFOGain:
+    """Per chunk gain 1 + depth * lfo, the product over several amplitude LFOs of a voice"""
+
+    def __init__(self, voices: list[tuple[LFOVoice, float]]):
+        self.voices = voices
+
+    def __call__(self) -> np.ndarray:
+        gain = None
+        for voice, depth in self.voices:
+            term = 1 + np.float32(depth) * voice.wave()
+            gain = term if gain is None else gain * term
+        return gain
+
+
+def voice_lfos(modulation: ModulationBus, lfos: tuple[LFO, ...], target: str, start: int,
+               index: int) -> list[tuple[LFOVoice, float]]:
+    """A voice's LFOs for one target, each with its depth"""
+    return [(modulation.lfo_voice(lfo, start, index), lfo.depth) for lfo in lfos if lfo.target == target]
@@ -1,24 +1,24 @@
-from functools import cached_property
-
 from src.base import AudioStream
 from src.dataclasses import Timbre
 from src.inputs import SineWaveStream, TimbredNoteStream
+from src.modulation import ModulationBus
 
 
 class MusicNote(AudioStream):
-    def __init__(self, frequency: float, amplitude: float, sample_rate: int, chunk_size: int):
+    """
+    A note's stream, built when the note or its timbre is set rather than on the first chunk. Reset starts another
+    note on it, and a note taken from a voice pool returns to it when it closes.
+    """
+
+    def __init__(self, frequency: float, amplitude: float, sample_rate: int, chunk_size: int, offset: int = 0,
+                 modulation: ModulationBus | None = None, timbre: Timbre | None = None):
         super().__init__(sample_rate=sample_rate, chunk_size=chunk_size)
         self.frequency = frequency
         self.amplitude = amplitude
-        self._timbre = None
-        self._timbre_decorator = None
-
-        self._sine_gen = SineWaveStream(
-            frequency=self.frequency,
-            amplitude=self.amplitude,
-            chunk_size=self.chunk_size,
-            sample_rate=self.sample_rate
-        )
+        self.offset = offset
+        self.modulation = modulation
+        self.pool = None  # The VoicePool it returns to when it closes
+        self.timbre = timbre
 
     @property
     def timbre(self):
@@ -27,23 +27,47 @@ class MusicNote(AudioStream):
     @timbre.setter
     def timbre(self, value: Timbre):
         self._timbre = value
+        self.stream = self._create_stream()
 
-    @cached_property
-    def stream(self):
+    def _create_stream(self) -> AudioStream:
         if self._timbre:
             return TimbredNoteStream(
                 frequency=self.frequency,
                 amplitude=self.amplitude,
                 timbre_profile=self._timbre,
                 chunk_size=self.chunk_size,
-                sample_rate=self.sample_rate
+                sample_rate=self.sample_rate,
+                offset=self.offset,
+                modulation=self.modulation
             )
+        return SineWaveStream(
+            frequency=self.frequency,
+            amplitude=self.amplitude,
+            chunk_size=self.chunk_size,
+            sample_rate=self.sample_rate,
+            offset=self.offset
+        )
+
+    def reset(self, frequency: float, amplitude: float, offset: int = 0, modulation: ModulationBus | None = None):
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.offset = offset
+        self.modulation = modulation
+        if self._timbre:
+            self.stream.reset(frequency, amplitude, offset, modulation)
         else:
-            return self._sine_gen
+            self.stream.reset(frequency, amplitude, offset)
+        super().reset()
+
+    def start_closing(self, offset: int = 0):
+        self.stream.start_closing(offset)
+        super().start_closing(offset)
 
-    def start_closing(self):
-        self.stream.start_closing()
-        super().start_closing()
+    def close(self):
+        closing = not self.is_closed
+        super().close()
+        if closing and self.pool:
+            self.pool.release(self)
 
     def iterable(self):
         return self.stream
@@ -55,9 +79,7 @@ class MusicNoteFactory:
         self.chunk_size = chunk_size
         self.timbre = timbre
 
-    def create_note(self, frequency: float, amplitude: float) -> MusicNote:
-        note = MusicNote(frequency=frequency, amplitude=amplitude,
-                         sample_rate=self.sample_rate, chunk_size=self.chunk_size)
-        if self.timbre:
-            note.timbre = self.timbre
-        return note
+    def create_note(self, frequency: float, amplitude: float, offset: int = 0,
+                    modulation: ModulationBus | None = None) -> MusicNote:
+        return MusicNote(frequency=frequency, amplitude=amplitude, sample_rate=self.sample_rate,
+                         chunk_size=self.chunk_size, offset=offset, modulation=modulation, timbre=self.timbre)
@@ -0,0 +1,26 @@
+import math
+
+import numpy as np
+
+from src.dataclasses import Panning
+from src.services import BASE_A4
+
+STEREO = 2
+MIDDLE_NOTE = 63.5  # Halfway between MIDI notes 0 and 127
+
+
+def pan_gains(positions) -> np.ndarray:
+    """Constant-power (left, right) gains of pan positions from -1 (left) to 1 (right), as a (... x 2) array"""
+    angles = (np.clip(positions, -1, 1) + 1) * np.pi / 4
+    return np.stack((np.cos(angles), np.sin(angles)), axis=-1).astype(np.float32)
+
+
+def note_position(panning: Panning, frequency: float) -> float:
+    """Where a note of 'frequency' sits, spread across the keyboard"""
+    note = 69 + 12 * math.log2(frequency / BASE_A4)
+    return panning.position + panning.spread * (note - MIDDLE_NOTE) / MIDDLE_NOTE
+
+
+def harmonic_offsets(panning: Panning, multiples: np.ndarray) -> np.ndarray:
+    """How far each harmonic sits from its note, overtones fanning out to alternate sides, the higher the further"""
+    return panning.width * np.where(multiples % 2, -1., 1.) * (1 - 1 / multiples)
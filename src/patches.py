@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import struct
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+
+MAGIC = b'SYNP'
+VERSION = 1  # Bumped whenever a compiled table function changes what it computes
+ALIGNMENT = 64  # Bytes each table starts on
+
+_loaded: dict[str, np.ndarray | tuple[np.ndarray, ...]] = {}  # Tables read from patch files, by call
+_recording: dict[str, np.ndarray | tuple[np.ndarray, ...]] | None = None  # Tables computed while a patch compiles
+
+
+def compiled_table(function):
+    """
+    Caches a function of hashable arguments that returns a read-only table or a tuple of them, like lru_cache, and
+    takes part in the patch cache: it returns tables a patch file holds instead of computing them, and records the
+    ones it returns while a patch compiles
+    """
+    cache = {}
+
+    @wraps(function)
+    def cached(*args):
+        table = cache.get(args)
+        if table is None or _recording is not None:
+            key = f'{function.__qualname__}{args!r}'
+            if table is None:
+                table = cache[args] = _loaded[key] if key in _loaded else function(*args)
+            if _recording is not None:
+                _recording[key] = table
+        return table
+
+    return cached
+
+
+def patch_key(*identity) -> str:
+    """
+    A hash of everything the tables of a patch are computed from, such as its timbres, engine, sample rate and the
+    chunk size its synthesis windows are sized by
+    """
+    return hashlib.sha256(repr((VERSION,) + identity).encode()).hexdigest()[:24]
+
+
+def write_patch(filename: str, tables: dict[str, np.ndarray | tuple[np.ndarray, ...]]):
+    """Writes the tables after a JSON header that gives each one's dtype, shape and offset"""
+    entries, offset = {}, 0
+    for key, table in tables.items():
+        arrays = table if isinstance(table, tuple) else (table,)
+        entries[key] = {'tuple': isinstance(table, tuple), 'arrays': []}
+        for array in arrays:
+            entries[key]['arrays'].append((array.dtype.str, array.shape, offset))
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps(entries).encode()
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % ALIGNMENT)
+
+    # Written under another name first, so a process starting meanwhile never maps a partial file
+    partial = f'{filename}.{os.getpid()}'
+    with open(partial, 'wb') as file:
+        file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for table in tables.values():
+            for array in table if isinstance(table, tuple) else (table,):
+                data = np.ascontiguousarray(array).tobytes()
+                file.write(data + b'\0' * (-len(data) % ALIGNMENT))
+    os.replace(partial, filename)
+
+
+def read_patch(filename: str) -> dict[str, np.ndarray | tuple[np.ndarray, ...]]:
+    """Maps a patch file into memory; its tables are read-only views of the mapping"""
+    with open(filename, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{filename}' is not a compiled patch")
+        size = struct.unpack('<I', file.read(4))[0]
+        entries = json.loads(file.read(size))
+    data = np.memmap(filename, dtype=np.uint8, mode='r', offset=len(MAGIC) + 4 + size)
+    tables = {}
+    for key, entry in entries.items():
+        arrays = tuple(np.asarray(data[offset:offset + np.dtype(dtype).itemsize * int(np.prod(shape))])
+                       .view(dtype).reshape(shape) for dtype, shape, offset in entry['arrays'])
+        tables[key] = arrays if entry['tuple'] else arrays[0]
+    return tables
+
+
+@contextmanager
+def compiled_patch(directory: str, *identity):
+    """
+    Serves the tables a patch compiled on an earlier start from its file in 'directory', named by the patch_key of
+    'identity'. The first time, the tables computed inside the block are recorded and written there instead.
+    """
+    global _recording
+    filename = os.path.join(directory, f'{patch_key(*identity)}.synp')
+    if os.path.exists(filename):
+        _loaded.update(read_patch(filename))
+        yield filename
+        return
+
+    _recording = {}
+    try:
+        yield filename
+        recorded = _recording
+    finally:
+        _recording = None
+    os.makedirs(directory, exist_ok=True)
+    write_patch(filename, recorded)
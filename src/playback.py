@@ -0,0 +1,81 @@
+import threading
+import time
+
+import numpy as np
+import sounddevice as sd
+
+from src.buffers import RingBuffer
+from src.base import AudioStreamDecorator, AudioStream, chunk_shape
+
+
+class AudioPlaybackDecorator(AudioStreamDecorator):
+    """Writes each chunk from a thread, clipped into one reused buffer whose interleaved frames go to the device"""
+
+    def __init__(self, stream: AudioStream):
+        super().__init__(stream)
+        self.output = sd.RawOutputStream(self.sample_rate, channels=self.channels, dtype='float32',
+                                         blocksize=self.chunk_size)
+        self.output.start()
+
+        self._clipped = np.zeros(chunk_shape(self.chunk_size, self.channels), dtype=np.float32)
+        self.play_thread = threading.Thread(target=self.play, args=(self._clipped, True))
+        self.play_thread.start()
+
+    def transform(self, stream_item):
+        self.silent = self.stream.silent
+        self.play_thread.join()
+        self.play_thread = threading.Thread(target=self.play, args=(stream_item, self.silent))
+        self.play_thread.start()
+        return stream_item
+
+    def play(self, current, silent: bool = False):
+        # The previous chunk is done with the buffer, as its thread is joined before this one starts
+        self.output.write(current if silent else np.clip(current, -1, 1, out=self._clipped[:len(current)]))
+
+    def close(self):
+        self.output.close()
+        super().close()
+
+
+class AudioCallbackPlaybackDecorator(AudioStreamDecorator):
+    """
+    Plays through the sounddevice callback API from a ring buffer. Rendering runs ahead of the device until the ring
+    is full, so it is never more than 'buffer_chunks' ahead; the device starts once 'prefill_chunks' are queued.
+    Chunks are copied into the ring as they are and clipped in place in the device's buffer. 'underruns' counts
+    callbacks that ran out of samples, 'overruns' counts chunks that found the ring full.
+    """
+
+    def __init__(self, stream: AudioStream, buffer_chunks: int = 4, prefill_chunks: int = 2):
+        super().__init__(stream)
+        self.buffer = RingBuffer(buffer_chunks * self.chunk_size, channels=self.channels)
+        self.prefill = min(prefill_chunks, buffer_chunks) * self.chunk_size
+        self.underruns = 0
+        self.overruns = 0
+        self.output = sd.OutputStream(self.sample_rate, channels=self.channels, dtype='float32',
+                                      blocksize=self.chunk_size, callback=self._callback)
+
+    def _callback(self, outdata, frames, time_info, status):
+        read = self.buffer.read_into(outdata[:, 0] if self.channels == 1 else outdata)
+        np.clip(outdata[:read], -1, 1, out=outdata[:read])
+        if read < frames:
+            outdata[read:] = 0
+        if status.output_underflow or read < frames:
+            self.underruns += 1
+
+    def transform(self, stream_item):
+        self.silent = self.stream.silent
+        if not self.buffer.write(stream_item):
+            self.overruns += 1
+            while not self.buffer.write(stream_item):
+                time.sleep(self.chunk_size / self.sample_rate / 4)
+
+        if not self.output.active and self.buffer.available >= self.prefill:
+            self.output.start()
+        return stream_item
+
+    def close(self):
+        deadline = time.monotonic() + self.buffer.capacity / self.sample_rate
+        while self.output.active and self.buffer.available and time.monotonic() < deadline:
+            time.sleep(self.chunk_size / self.sample_rate)
+        self.output.close()
+        super().close()
@@ -0,0 +1,59 @@
+import math
+
+import numpy as np
+
+STEAL_POLICIES = ('released-first', 'oldest', 'quietest', 'same-note')
+
+
+def steal_order(policy: str, started: np.ndarray, levels: np.ndarray, released: np.ndarray) -> np.ndarray:
+    """
+    Voice indices in the order a policy steals them. 'same-note' retriggers a sounding voice of the same note, and
+    otherwise steals like 'released-first': released voices before held ones, the oldest first.
+    """
+    if policy == 'oldest':
+        return np.argsort(started, kind='stable')
+    if policy == 'quietest':
+        return np.argsort(levels, kind='stable')
+    return np.lexsort((started, ~released))
+
+
+def shed_order(levels: np.ndarray, released: np.ndarray) -> np.ndarray:
+    """Voice indices from least to most audible: released voices first, then the quietest"""
+    return np.lexsort((levels, ~released))
+
+
+class RenderBudget:
+    """Smoothed render time per chunk as a fraction of the chunk's real-time deadline"""
+
+    def __init__(self, sample_rate: int, chunk_size: int, budget: float = .75, smoothing: float = .3,
+                 max_shed: float = .25):
+        self.deadline = chunk_size / sample_rate
+        self.budget = budget
+        self.smoothing = smoothing
+        self.max_shed = max_shed  # Sheds gradually, so one slow chunk does not silence most voices
+        self.load = 0.
+        self.misses = 0
+
+    @property
+    def has_headroom(self) -> bool:
+        return self.load < self.budget / 2
+
+    def update(self, elapsed: float) -> float:
+        """Records the render time of a chunk, and returns the fraction of voices to shed to get back within budget"""
+        load = elapsed / self.deadline
+        self.misses += load > 1
+        self.load += self.smoothing * (load - self.load)
+        if self.load <= self.budget:
+            return 0.
+        fraction = min(1 - self.budget / self.load, self.max_shed)
+        self.load = self.budget  # Give the shed voices time to fade before measuring again
+        return fraction
+
+    def regulate(self, elapsed: float, synthesizers):
+        """Sheds voices from, or restores detail to, synthesizers that have 'voice_count', 'shed' and 'restore'"""
+        fraction = self.update(elapsed)
+        for synthesizer in synthesizers:
+            if fraction:
+                synthesizer.shed(math.ceil(synthesizer.voice_count * fraction))
+            elif self.has_headroom:
+                synthesizer.restore()
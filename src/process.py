@@ -0,0 +1,154 @@
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+from typing import Callable, TYPE_CHECKING
+
+from src.base import AudioStream
+from src.buffers import SharedRingBuffer
+from src.midi import MidiInput
+
+if TYPE_CHECKING:
+    from mido import Message
+
+# Builds the synthesizer, whose voice_count is reported, and the stream of output chunks from a MIDI input
+RenderChain = Callable[[MidiInput], tuple[AudioStream, AudioStream]]
+
+STATE, VOICES = 2, 3  # Shared counters after the ring's written and read counts
+STARTING, RUNNING, STOPPING, STOPPED, FAILED = range(5)
+
+
+class QueuedMidiInput(MidiInput):
+    """Messages forwarded over a process queue, delivered on a thread of its own until a None arrives"""
+
+    def __init__(self, events: multiprocessing.Queue):
+        super().__init__()
+        self.events = events
+        self.thread = threading.Thread(target=self._receive, daemon=True)
+        self.thread.start()
+
+    def _receive(self):
+        while (message := self.events.get()) is not None:
+            self.notify_observers(message)
+
+    def close(self):
+        self.thread.join(timeout=1.)
+
+
+def _render(build: RenderChain, name: str, capacity: int, channels: int, events: multiprocessing.Queue,
+            errors: multiprocessing.Queue):
+    """The render process: fills the shared ring with chunks for as long as the parent keeps it running"""
+    ring = SharedRingBuffer(capacity, name=name, channels=channels)
+    midi_input = QueuedMidiInput(events)
+    stream, state = None, STOPPED
+    try:
+        synth, stream = build(midi_input)
+        if ring.counters[STATE] == STARTING:
+            ring.counters[STATE] = RUNNING
+        wait = stream.chunk_size / stream.sample_rate / 4
+        while ring.counters[STATE] == RUNNING:
+            if ring.free < stream.chunk_size:
+                time.sleep(wait)
+                continue
+            ring.write(next(stream))
+            ring.counters[VOICES] = synth.voice_count
+    except StopIteration:
+        pass
+    except Exception:
+        errors.put(traceback.format_exc())
+        state = FAILED
+    finally:
+        if stream is not None:
+            stream.close()
+        midi_input.close()
+        ring.counters[STATE] = state
+        ring.close()
+
+
+class RenderProcess(AudioStream):
+    """
+    Renders in a worker process, away from this process's MIDI, playback and file threads and their GIL. MIDI
+    messages of all channels go to the worker over a queue, and it runs up to 'buffer_chunks' ahead, writing chunks
+    into a ring in shared memory that this stream hands out as views, without copying. A handed out chunk stays
+    unread until the next one is handed out, so the worker never overwrites audio the consumer may still be using.
+    The chain must render 'channels', whose frames the ring keeps interleaved. 'fill' is the fraction of the ring
+    holding rendered audio, 'underruns' counts chunks that had to wait for it.
+    """
+
+    def __init__(self, build: RenderChain, sample_rate: int, chunk_size: int, buffer_chunks: int = 4,
+                 midi_handler: MidiInput | None = None, timeout: float = 5., channels: int = 1):
+        super().__init__(sample_rate=sample_rate, chunk_size=chunk_size, channels=channels)
+        if buffer_chunks < 2:
+            raise ValueError('The render process needs a buffer of at least two chunks')
+        self.timeout = timeout
+        self.underruns = 0
+        self.ring = SharedRingBuffer(buffer_chunks * chunk_size, channels=channels)
+        self.events = multiprocessing.Queue()
+        self.errors = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_render, name='render', daemon=True, args=(
+            build, self.ring.name, self.ring.capacity, channels, self.events, self.errors))
+        self.process.start()
+        self.midi_handler = midi_handler
+        if midi_handler:
+            for channel in range(16):
+                midi_handler.register_observer(self.forward, channel=channel)
+
+    @property
+    def fill(self) -> float:
+        return self.ring.available / self.ring.capacity if not self.is_closed else 0.
+
+    @property
+    def voice_count(self) -> int:
+        return int(self.ring.counters[VOICES]) if not self.is_closed else 0
+
+    def forward(self, message: 'Message'):
+        self.events.put(message)
+
+    def _failure(self) -> RuntimeError:
+        try:
+            return RuntimeError(f'The render process failed:\n{self.errors.get(timeout=self.timeout)}')
+        except queue.Empty:
+            return RuntimeError(f'The render process exited with code {self.process.exitcode}')
+
+    def _wait(self, skip: int):
+        """The chunk 'skip' samples past the next unread one, once the worker has rendered it"""
+        waited = False
+        while (chunk := self.ring.peek(self.chunk_size, skip)) is None:
+            state = self.ring.counters[STATE]
+            if state == STOPPED:
+                return None
+            if state == FAILED or not self.process.is_alive():
+                raise self._failure()
+            if state == RUNNING and not waited:
+                self.underruns += 1
+                waited = True
+            time.sleep(self.chunk_size / self.sample_rate / 4)
+        return chunk
+
+    def iterable(self):
+        chunk, skip = self._wait(0), self.chunk_size
+        while chunk is not None:
+            yield chunk
+            if (chunk := self._wait(skip)) is not None:
+                self.ring.consume(self.chunk_size)
+
+    def close(self):
+        """Stops the worker, letting it close its streams, and frees the ring once it has exited"""
+        if self.is_closed:
+            return
+        if self.midi_handler:
+            for channel in range(16):
+                self.midi_handler.unregister_observer(self.forward, channel=channel)
+        if self.process.is_alive():
+            if self.ring.counters[STATE] in (STARTING, RUNNING):
+                self.ring.counters[STATE] = STOPPING
+            self.events.put(None)
+            self.process.join(self.timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.current = None
+        self._cached_iterable = None
+        self.ring.close()
+        super().close()
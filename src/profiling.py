@@ -0,0 +1,270 @@
+import json
+import threading
+import time
+import tracemalloc
+from typing import Callable, TextIO
+
+import numpy as np
+
+from src.base import AudioStream, AudioStreamDecorator
+
+# Histogram bucket upper edges in seconds, four per doubling from 1 us to ~1 s
+BUCKET_EDGES = 1e-6 * 2. ** (np.arange(81) / 4)
+# Block on the device, or on the render process
+WAITING_STAGES = frozenset({'AudioPlaybackDecorator', 'AudioCallbackPlaybackDecorator', 'RenderProcess'})
+
+
+class TimeHistogram:
+    """Log-spaced histogram of durations, with their count, total and maximum"""
+
+    def __init__(self):
+        self.counts = np.zeros(len(BUCKET_EDGES) + 1, dtype=np.int64)
+        self.total = 0.
+        self.longest = 0.
+        self.calls = 0
+
+    @property
+    def samples(self) -> int:
+        return int(self.counts.sum())
+
+    def add(self, seconds: float, calls: int = 1):
+        self.counts[np.searchsorted(BUCKET_EDGES, seconds)] += 1
+        self.total += seconds
+        self.longest = max(self.longest, seconds)
+        self.calls += calls
+
+    def percentile(self, q: float) -> float:
+        """Upper edge of the bucket holding the q-th percentile, capped at the longest duration seen"""
+        if not self.samples:
+            return 0.
+        bucket = int(np.searchsorted(np.cumsum(self.counts), q / 100 * self.samples))
+        return min(BUCKET_EDGES[min(bucket, len(BUCKET_EDGES) - 1)], self.longest)
+
+    def summary(self) -> dict:
+        samples = max(1, self.samples)
+        return {
+            'mean_us': self.total / samples * 1e6,
+            'p50_us': self.percentile(50) * 1e6,
+            'p99_us': self.percentile(99) * 1e6,
+            'max_us': self.longest * 1e6,
+            'calls_per_chunk': self.calls / samples,
+            'histogram': self.counts.tolist(),
+        }
+
+
+def instrumented_methods() -> list[tuple[type, str]]:
+    """The __next__ of the stream base classes, and render_block of every stream class imported so far that has one"""
+    methods, classes, seen = [(AudioStream, '__next__'), (AudioStreamDecorator, '__next__')], [AudioStream], set()
+    while classes:
+        cls = classes.pop()
+        if cls in seen:
+            continue
+        seen.add(cls)
+        classes += cls.__subclasses__()
+        if 'render_block' in cls.__dict__:
+            methods.append((cls, 'render_block'))
+    return methods
+
+
+class Profiler:
+    """
+    Opt-in instrumentation of every stream's __next__, and of render_block wherever a stream class defines one.
+    Enabling it patches AudioStream, AudioStreamDecorator and those classes, so a profiler that is not enabled costs
+    nothing. Stages are stream classes, timed without the streams they pull from and summed per chunk. A chunk is
+    one call of the outermost stream on the thread that enabled profiling; time other threads spend in streams
+    meanwhile counts towards that chunk. Render time excludes stages that wait on the audio device, and a deadline
+    miss is a chunk whose render time exceeds chunk_size / sample_rate. 'buffer' reports how full a buffer ahead of
+    the output is, sampled once per chunk.
+    """
+    _enabled: 'Profiler | None' = None
+
+    def __init__(self,
+                 sample_rate: int,
+                 chunk_size: int,
+                 voices: Callable[[], int] | None = None,
+                 buffer: Callable[[], float] | None = None,
+                 allocations: bool = False,
+                 output: TextIO | None = None,
+                 json_lines: bool = False,
+                 interval: float = 5.,
+                 waiting_stages: frozenset[str] = WAITING_STAGES
+                 ):
+        self.deadline = chunk_size / sample_rate
+        self.voices = voices
+        self.buffer = buffer
+        self.allocations = allocations
+        self.output = output
+        self.json_lines = json_lines
+        self.interval = interval
+        self.waiting_stages = waiting_stages
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._originals = {}
+        self._started_tracing = False
+        self._thread = None
+        self.reset()
+
+    def reset(self):
+        self.chunks = 0
+        self.deadline_misses = 0
+        self.render = TimeHistogram()
+        self.stages: dict[str, TimeHistogram] = {}
+        self.voice_total, self.voice_max = 0, 0
+        self.fill_total, self.fill_min = 0., 1.
+        self.allocated_total, self.allocated_max = 0, 0
+        self._chunk: dict[str, list] = {}
+        self._next_report = time.monotonic() + self.interval
+
+    def enable(self):
+        if Profiler._enabled is not None:
+            raise RuntimeError('Another profiler is already enabled')
+        Profiler._enabled = self
+        self._thread = threading.get_ident()
+        for cls, name in instrumented_methods():
+            self._originals[cls, name] = cls.__dict__[name]
+            setattr(cls, name, self._instrument(self._originals[cls, name]))
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.reset()
+
+    def disable(self):
+        if Profiler._enabled is not self:
+            return
+        for (cls, name), method in self._originals.items():
+            setattr(cls, name, method)
+        self._originals.clear()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        Profiler._enabled = None
+        if self.output and self.chunks:
+            self.report()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _instrument(self, method):
+        profiler = self
+
+        def instrumented(stream, *args):
+            stack = profiler._stack()
+            if stack and stack[-1][0] is stream:
+                return method(stream, *args)  # A decorator's __next__ calling AudioStream.__next__ on itself
+
+            root = not stack and threading.get_ident() == profiler._thread
+            if root:
+                profiler._start_chunk()
+            frame = [stream, 0.]
+            stack.append(frame)
+            started = time.perf_counter()
+            produced = False
+            try:
+                chunk = method(stream, *args)
+                produced = True
+                return chunk
+            finally:
+                elapsed = time.perf_counter() - started
+                stack.pop()
+                if stack:
+                    stack[-1][1] += elapsed
+                profiler._record(type(stream).__name__, elapsed - frame[1])
+                if root:
+                    profiler._end_chunk(elapsed, produced)
+
+        return instrumented
+
+    def _record(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self._chunk.setdefault(stage, [0., 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def _start_chunk(self):
+        if self.allocations:
+            tracemalloc.reset_peak()
+            self._traced_at_start = tracemalloc.get_traced_memory()[0]
+
+    def _end_chunk(self, elapsed: float, produced: bool = True):
+        with self._lock:
+            chunk, self._chunk = self._chunk, {}
+        if not produced:
+            return  # The stream ended or failed instead of yielding a chunk
+        waited = sum(chunk[stage][0] for stage in self.waiting_stages if stage in chunk)
+        for stage, (seconds, calls) in chunk.items():
+            self.stages.setdefault(stage, TimeHistogram()).add(seconds, calls)
+
+        render = elapsed - waited
+        self.render.add(render)
+        self.chunks += 1
+        self.deadline_misses += render > self.deadline
+        if self.voices:
+            voices = self.voices()
+            self.voice_total += voices
+            self.voice_max = max(self.voice_max, voices)
+        if self.buffer:
+            fill = self.buffer()
+            self.fill_total += fill
+            self.fill_min = min(self.fill_min, fill)
+        if self.allocations:
+            allocated = tracemalloc.get_traced_memory()[1] - self._traced_at_start
+            self.allocated_total += allocated
+            self.allocated_max = max(self.allocated_max, allocated)
+
+        if self.output and time.monotonic() >= self._next_report:
+            self.report()
+
+    def stats(self) -> dict:
+        """Everything measured since profiling was enabled or last reported"""
+        chunks = max(1, self.chunks)
+        stats = {
+            'chunks': self.chunks,
+            'deadline_ms': self.deadline * 1e3,
+            'deadline_misses': self.deadline_misses,
+            'render': self.render.summary(),
+            'stages': {stage: histogram.summary() for stage, histogram in sorted(self.stages.items())},
+        }
+        if self.voices:
+            stats['voices'] = {'mean': self.voice_total / chunks, 'max': self.voice_max}
+        if self.buffer:
+            stats['buffer_fill'] = {'mean': self.fill_total / chunks, 'min': self.fill_min}
+        if self.allocations:
+            stats['allocated_bytes'] = {'mean': self.allocated_total / chunks, 'max': self.allocated_max}
+        return stats
+
+    def report(self):
+        """Writes the stats to the output, then starts measuring afresh"""
+        stats = self.stats()
+        self.output.write(json.dumps({'time': time.time(), **stats}) + '\n' if self.json_lines else format_stats(stats))
+        self.output.flush()
+        self.reset()
+
+
+def format_stats(stats: dict) -> str:
+    render = stats['render']
+    lines = [
+        f"{stats['chunks']} chunks   deadline {stats['deadline_ms']:.2f} ms   misses {stats['deadline_misses']}   "
+        f"render p50 {render['p50_us'] / 1e3:.2f} ms   p99 {render['p99_us'] / 1e3:.2f} ms   "
+        f"max {render['max_us'] / 1e3:.2f} ms"
+    ]
+    if 'voices' in stats:
+        lines[0] += f"   voices {stats['voices']['mean']:.1f} (max {stats['voices']['max']})"
+    if 'buffer_fill' in stats:
+        lines[0] += f"   buffer {stats['buffer_fill']['mean']:.0%} (min {stats['buffer_fill']['min']:.0%})"
+    if 'allocated_bytes' in stats:
+        lines[0] += f"   allocated {stats['allocated_bytes']['mean'] / 1024:.1f} KiB/chunk"
+
+    lines.append(f"  {'stage':<36}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}{'max us':>10}{'calls':>8}")
+    for stage, summary in sorted(stats['stages'].items(), key=lambda item: -item[1]['mean_us']):
+        lines.append(f"  {stage:<36}{summary['mean_us']:>10.1f}{summary['p50_us']:>10.1f}{summary['p99_us']:>10.1f}"
+                     f"{summary['max_us']:>10.1f}{summary['calls_per_chunk']:>8.1f}")
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,146 @@
+from dataclasses import dataclass, replace
+from functools import partial
+from typing import Hashable
+
+import numpy as np
+
+from src.additive import ADDITIVE_THRESHOLD
+from src.base import chunk_shape
+from src.dataclasses import Timbre, ChannelConfig, Polyphony, Panning
+from src.midi import TimedMessage
+from src.panning import STEREO
+from src.samplebank import SampleBank
+from src.synth import create_synthesizer, create_multichannel_synthesizer
+
+SPLIT_MODES = ('none', 'track', 'time')
+
+
+@dataclass(frozen=True)
+class RenderSettings:
+    timbre: Timbre
+    sample_rate: int
+    chunk_size: int
+    engine: str = 'streams'
+    channels: tuple[ChannelConfig, ...] = ()  # Renders every channel with 'timbre' when empty
+    threads: int = 1
+    polyphony: Polyphony | None = None
+    additive_threshold: int = ADDITIVE_THRESHOLD
+    sample_bank: str | None = None  # File the sampler engine maps, in each worker process
+    control_period: int = 1  # Samples between the control points envelopes and LFOs are evaluated at
+    panning: Panning | None = None  # Renders stereo when given, as does any channel's own panning
+
+
+@dataclass(frozen=True)
+class RenderSegment:
+    start: int  # First sample
+    messages: tuple[TimedMessage, ...]
+    voices_started: tuple[tuple[int, int], ...] = ()  # Notes started on each channel before a time window
+
+
+def plan_segments(messages: list[TimedMessage], split: str, window: int, per_channel: bool = False
+                  ) -> list[RenderSegment]:
+    """
+    Splits the messages into independently renderable segments. With 'time', notes ring on past the end of their
+    window. A synthesizer holds one voice per note, or per channel and note when 'per_channel': it ignores a note_on
+    while the note is held, and the next note_off releases it. The split follows suit, so a note_off goes to the
+    segment of the note it releases and the ignored messages are left out. A time window's notes are numbered on
+    from those of the windows before it, for LFOs spread across notes.
+    """
+    if split == 'none':
+        return [RenderSegment(start=0, messages=tuple(messages))]
+
+    segments: dict[int, list[TimedMessage]] = {}
+    voices_started: dict[int, tuple[tuple[int, int], ...]] = {}
+    held: dict[Hashable, int] = {}
+    started: dict[int, int] = {}
+    for timed in messages:
+        key = (timed.message.channel, timed.message.note) if per_channel else timed.message.note
+        if timed.message.type == 'note_on':
+            if key in held:
+                continue
+            index = held[key] = timed.track if split == 'track' else timed.sample // window
+            if split == 'time' and index not in voices_started:
+                voices_started[index] = tuple(sorted(started.items()))
+            started[timed.message.channel] = started.get(timed.message.channel, 0) + 1
+        elif key in held:
+            index = held.pop(key)
+        else:
+            continue
+        segments.setdefault(index, []).append(timed)
+    return [RenderSegment(start=index * window if split == 'time' else 0, messages=tuple(segments[index]),
+                          voices_started=voices_started.get(index, ())) for index in sorted(segments)]
+
+
+def render_segment(segment: RenderSegment, settings: RenderSettings) -> np.ndarray:
+    """
+    Renders from the segment start until every note it starts has been released and has rung out. Adaptive polyphony
+    is left out, as offline renders have no deadline and must not depend on how fast they run. The LFOs carry on
+    from the segment start and notes before it, as in a render of all segments at once.
+    """
+    polyphony = replace(settings.polyphony, adaptive=False) if settings.polyphony else None
+    sample_bank = SampleBank(settings.sample_bank) if settings.sample_bank else None
+    if settings.channels:
+        synth = create_multichannel_synthesizer(settings.channels, settings.sample_rate, settings.chunk_size,
+                                                engine=settings.engine, workers=settings.threads, polyphony=polyphony,
+                                                additive_threshold=settings.additive_threshold,
+                                                sample_bank=sample_bank, control_period=settings.control_period,
+                                                panning=settings.panning)
+    else:
+        synth = create_synthesizer(settings.timbre, settings.sample_rate, settings.chunk_size, engine=settings.engine,
+                                   polyphony=polyphony, additive_threshold=settings.additive_threshold,
+                                   sample_bank=sample_bank, control_period=settings.control_period,
+                                   panning=settings.panning)
+    voices_started = dict(segment.voices_started)
+    if settings.channels:
+        for channel, channel_synth in synth.synthesizers.items():
+            channel_synth.modulation.resume(segment.start, voices_started.get(channel, 0))
+    else:
+        synth.modulation.resume(segment.start, sum(voices_started.values()))
+    for timed in segment.messages:
+        synth.schedule(timed.message, timed.sample - segment.start)
+
+    chunks = []
+    while synth.pending_events or synth.voice_count:
+        chunks.append(next(synth))
+        if not synth.pending_events and not synth.is_closing:
+            synth.start_closing()
+    return np.concatenate(chunks) if chunks else np.zeros(chunk_shape(0, synth.channels), dtype=np.float32)
+
+
+def output_channels(settings: RenderSettings) -> int:
+    return STEREO if settings.panning or any(config.panning for config in settings.channels) else 1
+
+
+def render_midi(messages: list[TimedMessage],
+                settings: RenderSettings,
+                split: str = 'none',
+                window_seconds: float = 10.,
+                workers: int = 1
+                ) -> np.ndarray:
+    """
+    Renders the messages as fast as possible. Segments are mixed in plan order, so the result is identical for any
+    number of worker processes. Windows start on chunk boundaries and the mix is padded to whole chunks, so a split
+    render is as long as the unsplit one and matches it up to float32 rounding of the mix.
+    """
+    if split != 'none' and settings.polyphony and settings.polyphony.max_voices:
+        raise ValueError('A voice limit holds across the whole render, which cannot be split')
+    timbres = [config.timbre for config in settings.channels] or [settings.timbre]
+    if split == 'track' and any(lfo.spread for timbre in timbres for lfo in timbre.lfos):
+        raise ValueError('LFOs spread across notes number the notes of all tracks in turn; split the render by time')
+    chunks = max(1, round(window_seconds * settings.sample_rate / settings.chunk_size))
+    segments = plan_segments(messages, split, chunks * settings.chunk_size, per_channel=bool(settings.channels))
+    render = partial(render_segment, settings=settings)
+    if workers > 1 and len(segments) > 1:
+        from concurrent.futures import ProcessPoolExecutor  # Only offline renders on several workers need it
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(segments))) as pool:
+            rendered = list(pool.map(render, segments))
+    else:
+        rendered = [render(segment) for segment in segments]
+
+    end = max((s.start + len(r) for s, r in zip(segments, rendered)), default=0)
+    length = -(-end // settings.chunk_size) * settings.chunk_size
+    mix = np.zeros(chunk_shape(length, output_channels(settings)), dtype=np.float32)
+    for segment, samples in zip(segments, rendered):
+        mix[segment.start:segment.start + len(samples)] += samples
+    return mix
@@ -0,0 +1,204 @@
+import json
+import math
+import struct
+from dataclasses import replace
+from functools import partial
+
+import numpy as np
+
+from src.dataclasses import Timbre, Polyphony, Panning
+from src.envelopes import harmonic_gate
+from src.modulation import ModulationBus
+from src.services import midi_note_to_frequency, BASE_A4
+from src.voicebank import VoiceBank, NOT_RELEASED
+
+MAGIC = b'SYNB'
+NOTES = 128
+ALIGNMENT = 64  # Bytes the samples start on
+RENDER_CHUNK = 1024
+
+
+def _raw_timbre(timbre: Timbre) -> Timbre:
+    """The timbre without its ADSR envelope, which is applied at playback; the release still times harmonic gates"""
+    return replace(timbre, envelope=replace(timbre.envelope, attack=0., decay=0., sustain_amplitude=1., sustain=None,
+                                            sustain_till_close=True))
+
+
+def sample_layout(timbre: Timbre, sample_rate: int, loop_seconds: float = .5, crossfade: float = .01
+                  ) -> list[tuple[int, int]]:
+    """
+    Where each MIDI note's sustain loop starts and ends. Loops start once every harmonic with a sustain time has
+    faded out, and last a whole number of the note's periods, close to 'loop_seconds'.
+    """
+    gates = [harmonic_gate(h.sustain, timbre.envelope, sample_rate) for h in timbre.harmonics or ()]
+    loop_start = max([gate.end for gate in gates if gate] + [round(crossfade * sample_rate), 1])
+    layout = []
+    for note in range(NOTES):
+        period = sample_rate / midi_note_to_frequency(note)
+        loop_length = round(max(1, round(loop_seconds * sample_rate / period)) * period)
+        layout.append((loop_start, loop_start + loop_length))
+    return layout
+
+
+def _render_note(note: int, loop: tuple[int, int], timbre: Timbre, filename: str, data_offset: int,
+                 sample_rate: int, velocities: tuple[int, ...], offsets: tuple[int, ...], crossfade: int):
+    """Renders one note for every velocity layer straight into the bank file"""
+    loop_start, loop_end = loop
+    frames = -(-loop_end // RENDER_CHUNK) * RENDER_CHUNK
+    fade = min(crossfade, loop_start, loop_end - loop_start)
+    ramp = np.linspace(0, 1, fade, endpoint=False, dtype=np.float32)
+    samples = np.memmap(filename, dtype=np.float32, mode='r+', offset=data_offset)
+    for layer, velocity in enumerate(velocities):
+        voices = VoiceBank(_raw_timbre(timbre), sample_rate, RENDER_CHUNK, capacity=1)
+        voices.note_on(note, midi_note_to_frequency(note), velocity / 127)
+        raw = np.concatenate([voices.render() for _ in range(frames // RENDER_CHUNK)])[:loop_end]
+        # The loop's end fades into what precedes its start, so it wraps around without a click
+        raw[loop_end - fade:] = raw[loop_end - fade:] * (1 - ramp) + raw[loop_start - fade:loop_start] * ramp
+        offset = offsets[layer * NOTES + note]
+        samples[offset:offset + loop_end] = raw
+    samples.flush()
+
+
+def build_sample_bank(timbre: Timbre, filename: str, sample_rate: int, velocities: tuple[int, ...] = (127,),
+                      loop_seconds: float = .5, crossfade: float = .01, workers: int = 1) -> 'SampleBank':
+    """
+    Renders every MIDI note of the timbre at each of the 'velocities' into one float32 file, on a pool of 'workers'
+    processes that each write their notes in place
+    """
+    velocities = tuple(sorted(set(velocities)))
+    layout = sample_layout(timbre, sample_rate, loop_seconds, crossfade)
+    offsets, regions, frames = [], [], 0
+    for _ in velocities:
+        for loop_start, loop_end in layout:
+            offsets.append(frames)
+            regions.append((frames, loop_start, loop_end))
+            frames += loop_end
+
+    header = json.dumps({'sample_rate': sample_rate, 'velocities': velocities, 'timbre': repr(timbre),
+                         'regions': regions}).encode()
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % ALIGNMENT)
+    data_offset = len(MAGIC) + 4 + len(header)
+    with open(filename, 'wb') as file:
+        file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        file.truncate(data_offset + frames * 4)
+
+    render = partial(_render_note, timbre=timbre, filename=filename, data_offset=data_offset,
+                     sample_rate=sample_rate, velocities=velocities, offsets=tuple(offsets),
+                     crossfade=round(crossfade * sample_rate))
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor  # Loads multiprocessing, which playback never needs
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(render, range(NOTES), layout, chunksize=8))
+    else:
+        for note, loop in enumerate(layout):
+            render(note, loop)
+    return SampleBank(filename)
+
+
+class SampleBank:
+    """
+    A bank file mapped into memory: for each velocity layer and MIDI note, a region of samples whose sustain loop runs
+    from 'loop_start' to its end, without the ADSR envelope. Opening it reads only the header.
+    """
+
+    def __init__(self, filename: str):
+        with open(filename, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"'{filename}' is not a sample bank")
+            size = struct.unpack('<I', file.read(4))[0]
+            header = json.loads(file.read(size))
+        self.filename = filename
+        self.sample_rate = header['sample_rate']
+        self.velocities = tuple(header['velocities'])
+        self.timbre = header['timbre']  # The repr of the timbre it was rendered from
+        self.samples = np.memmap(filename, dtype=np.float32, mode='r', offset=len(MAGIC) + 4 + size)
+        self.offsets, self.loop_starts, self.loop_ends = np.array(header['regions'], dtype=np.int64).T.tolist()
+
+    def matches(self, timbre: Timbre) -> bool:
+        return self.timbre == repr(timbre)
+
+    def region(self, frequency: float, amplitude: float) -> tuple[int, float]:
+        """The region of the nearest note in the softest layer at least as loud, and the gain that makes up the rest"""
+        note = min(NOTES - 1, max(0, round(69 + 12 * math.log2(frequency / BASE_A4))))
+        velocity = amplitude * 127
+        layer = next((i for i, v in enumerate(self.velocities) if v >= velocity), len(self.velocities) - 1)
+        return layer * NOTES + note, velocity / self.velocities[layer]
+
+    def read(self, region: int, position: int, out: np.ndarray):
+        """Copies the region's samples from 'position' into 'out', looping the sustain; silence before the start"""
+        offset, loop_start, loop_end = self.offsets[region], self.loop_starts[region], self.loop_ends[region]
+        filled = min(len(out), max(0, -position))
+        out[:filled] = 0
+        position += filled
+        while filled < len(out):
+            if position >= loop_end:
+                position = loop_start + (position - loop_start) % (loop_end - loop_start)
+            count = min(len(out) - filled, loop_end - position)
+            out[filled:filled + count] = self.samples[offset + position:offset + position + count]
+            filled += count
+            position += count
+
+
+class SamplePlaybackBank(VoiceBank):
+    """
+    Plays notes from a sample bank rendered for the same timbre. Each voice copies its slice of the note's region and
+    scales it by its velocity gain and the ADSR envelope, which releases over the looped sustain. LFOs are part of
+    the samples, so they always start with the note. In stereo, the voices are mixed by one (voice x channel) gain
+    matrix product; a note's harmonics are mixed into its samples, so they all sit at its position.
+    """
+
+    def __init__(self, timbre: Timbre, bank: SampleBank, chunk_size: int, capacity: int = 32,
+                 polyphony: Polyphony | None = None, modulation: ModulationBus | None = None,
+                 panning: Panning | None = None):
+        if not bank.matches(timbre):
+            raise ValueError(f"The sample bank '{bank.filename}' was rendered for another timbre; rebuild it")
+        self.bank = bank
+        super().__init__(timbre, bank.sample_rate, chunk_size, capacity=capacity, polyphony=polyphony,
+                         modulation=modulation, panning=panning)
+        if panning:
+            self._pan_offsets = np.zeros_like(self._pan_offsets)
+
+    @staticmethod
+    def _collect_lfos(timbre: Timbre) -> list:
+        return []
+
+    def _allocate(self, capacity: int):
+        super()._allocate(capacity)
+        self._region = np.zeros(capacity, dtype=np.int64)
+        self._gain = np.zeros(capacity, dtype=np.float32)
+
+    @property
+    def _state(self) -> tuple[np.ndarray, ...]:
+        return super()._state + (self._region, self._gain)
+
+    def note_on(self, identifier, frequency: float, amplitude: float, offset: int = 0):
+        count = self._count
+        super().note_on(identifier, frequency, amplitude, offset)
+        if self._count > count:
+            self._region[count], self._gain[count] = self.bank.region(frequency, amplitude)
+
+    def render(self, frames: int | None = None) -> np.ndarray:
+        count, frames = self._count, frames or self.chunk_size
+        self.modulation.start_chunk(self._clock, frames)
+        self._clock += frames
+        self.silent = not count
+        if self.silent:
+            return self._silence[:frames]
+
+        voices = np.empty((count, frames), dtype=np.float32)
+        for slot in range(count):
+            self.bank.read(int(self._region[slot]), int(self._position[slot]), voices[slot])
+        positions = self._position[:count, None] + self.modulation.offsets
+        envelope = self._envelope(positions, self._release_start[:count])
+        if self.polyphony:
+            self._level[:count] = self._amplitude[:count].sum(axis=1) * envelope[:, -1]
+        envelope *= self._gain[:count, None]
+        if (self._fade_start[:count] != NOT_RELEASED).any():
+            envelope *= self._fade(positions, self._fade_start[:count])
+        voices *= self.modulation.upsample(envelope)
+        mix = np.matmul(voices.T, self._pan[:count, :, 0]) if self.panning else voices.sum(axis=0, dtype=np.float32)
+
+        self._position[:count] += frames
+        self._drop_finished()
+        return mix
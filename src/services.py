@@ -1,6 +1,6 @@
 import json
 import os
-from typing import Iterator
+from typing import Iterator, Callable
 
 import numpy as np
 
@@ -13,14 +13,50 @@ def midi_note_to_frequency(note: int) -> float:
     return BASE_A4 * (2.0 ** ((note - 69) / 12.0))
 
 
-def generate_sine_wave(freq: float, chunk_size: int, sample_rate: int, volume: float):
-    t = 0
-    omega = 2 * np.pi * freq
+def start_phase(freq: float, sample_rate: int, offset: int) -> float:
+    """Phase in cycles that reaches zero 'offset' samples into the first chunk"""
+    return -offset * freq / sample_rate % 1.
+
+
+def generate_sine_wave(freq: float, chunk_size: int, sample_rate: int, volume: float, phase: float = 0.,
+                       pitch: Callable[[], np.ndarray] | None = None):
+    """
+    Phase accumulator kept in wrapped double precision, so long notes don't drift. 'phase' is in cycles, and 'pitch'
+    optionally gives each chunk's phase offsets in cycles.
+    """
+    increment = freq / sample_rate
+    ramp = 2 * np.pi * increment * np.arange(chunk_size)
+    phase %= 1.
+    while True:
+        positions = 2 * np.pi * phase + ramp
+        if pitch:
+            positions += 2 * np.pi * pitch()
+        yield np.sin(positions.astype(np.float32)) * np.float32(volume)
+        phase = (phase + increment * chunk_size) % 1.
+
+
+def generate_wavetable_wave(table: np.ndarray, freq: float, chunk_size: int, sample_rate: int, volume: float,
+                            phase: float = 0., pitch: Callable[[], np.ndarray] | None = None):
+    """Reads one cycle 'table' (with a guard sample at the end) at 'freq' using linear interpolation"""
+    size = len(table) - 1
+    values, slopes = table[:-1], np.diff(table)
+    increment = freq / sample_rate * size
+    ramp = increment * np.arange(chunk_size)
+    phase = phase % 1. * size
     while True:
-        samples = np.arange(t, t + chunk_size, dtype=np.float32) / sample_rate
-        chunk = np.sin(omega * samples) * volume
+        positions = ramp + phase
+        if pitch:
+            positions += pitch() * size
+            positions %= size
+        indices = positions.astype(np.int64)
+        fractions = (positions - indices).astype(np.float32)
+        indices %= size
+        chunk = np.take(slopes, indices)
+        chunk *= fractions
+        chunk += np.take(values, indices)
+        chunk *= volume
         yield chunk
-        t += chunk_size
+        phase = (phase + increment * chunk_size) % size
 
 
 def array_to_wav_format(data: np.array):
@@ -30,7 +66,7 @@ def array_to_wav_format(data: np.array):
 
 def buffer_stream(generator: Iterator[np.array], buffer_size: int):
     """Ensures the yielded chunks are of length 'buffer_size'"""
-    current_buffer = np.array([], dtype=float)
+    current_buffer = np.array([], dtype=np.float32)
     for phase_slice in generator:
         remaining_space = buffer_size - len(current_buffer)
         if len(phase_slice) <= remaining_space:
@@ -43,7 +79,7 @@ def buffer_stream(generator: Iterator[np.array], buffer_size: int):
 
         if len(current_buffer) == buffer_size:
             yield current_buffer
-            current_buffer = np.array([], dtype=float)
+            current_buffer = np.array([], dtype=np.float32)
 
     if len(current_buffer) > 0:
         padded_buffer = np.pad(current_buffer, (0, buffer_size - len(current_buffer)), mode='constant')
@@ -58,8 +94,14 @@ def load_template(filepath):
     with open(full_path, 'r') as file:
         template = json.load(file)
 
-    # Special handling for harmonics
+    # Special handling for harmonics, spectra, LFOs and channels
     if 'harmonic' in template:
         template['harmonic'] = [','.join(map(str, h)) for h in template['harmonic']]
+    if 'spectrum' in template:
+        template['spectrum'] = ','.join(map(str, template['spectrum']))
+    if 'lfo' in template:
+        template['lfo'] = [','.join(map(str, lfo)) for lfo in template['lfo']]
+    if 'channel' in template:
+        template['channel'] = [','.join(map(str, c)) for c in template['channel']]
 
     return template
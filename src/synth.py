@@ -1,45 +1,402 @@
-from time import sleep
-from typing import Iterator
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from typing import Iterator, TYPE_CHECKING
 
-from mido import Message
+import numpy as np
 
-from src.base import AudioStream
+from src.additive import AdditiveBank, ADDITIVE_THRESHOLD
+from src.base import AudioStream, chunk_shape
 from src.composer import AudioStreamComposer
-from src.midi import MidiInputHandler
+from src.dataclasses import Timbre, ChannelConfig, Polyphony, Panning
+from src.events import MidiEventQueue
+from src.kernels import TimbreKernel, compile_timbre
+from src.midi import MidiInput
+from src.modulation import ModulationBus
 from src.notes import MusicNoteFactory
+from src.panning import STEREO, pan_gains, note_position
+from src.polyphony import RenderBudget
+from src.samplebank import SampleBank, SamplePlaybackBank
 from src.services import midi_note_to_frequency
+from src.voicebank import VoiceBank
+from src.voicepool import VoicePool
 
+if TYPE_CHECKING:
+    from mido import Message
+
+ENGINES = ('streams', 'fused', 'voicebank', 'additive', 'sampler')
+VARIABLE_BLOCK_ENGINES = ('voicebank', 'sampler')  # Those whose render_block takes blocks of any length
+CONTROL_RATE_ENGINES = ('voicebank', 'additive', 'sampler')  # Those that modulate at a control period
+
+
+class MidiSynthesizerStream(AudioStream, ABC):
+    """
+    Queues MIDI messages from the handler's thread and applies them from the render loop, each at its exact sample
+    offset within the chunk. With adaptive polyphony it sheds voices while chunks take too long to render. Its
+    voices share the LFOs of one modulation bus, which it clocks.
+    """
+    applies_volume = False  # Whether it renders its notes at the output volume, which is otherwise left to the caller
+
+    def __init__(self, midi_handler: MidiInput | None, channel: int, sample_rate: int, chunk_size: int,
+                 polyphony: Polyphony | None = None, modulation: ModulationBus | None = None, channels: int = 1):
+        super().__init__(sample_rate=sample_rate, chunk_size=chunk_size, channels=channels)
+        self.events = MidiEventQueue(sample_rate, chunk_size)
+        self.position = 0
+        self.modulation = modulation or ModulationBus(sample_rate, chunk_size)
+        self.budget = RenderBudget(sample_rate, chunk_size, polyphony.budget) if polyphony and polyphony.adaptive \
+            else None
+        self.midi_handler = midi_handler
+        self.channel = channel
+        if midi_handler:
+            midi_handler.register_observer(self.handle_midi_message, channel=channel)
+
+    @property
+    @abstractmethod
+    def voice_count(self) -> int:
+        pass
+
+    @property
+    def pending_events(self) -> int:
+        return self.events.pending
+
+    @property
+    def variable_blocks(self) -> bool:
+        """Whether it has a render_block that takes blocks of any length up to chunk_size"""
+        return False
+
+    @property
+    @abstractmethod
+    def source(self) -> AudioStream:
+        pass
+
+    @abstractmethod
+    def note_on(self, note: int, velocity: int, offset: int):
+        pass
+
+    @abstractmethod
+    def note_off(self, note: int, offset: int):
+        pass
+
+    @abstractmethod
+    def shed(self, count: int):
+        """Fades out the 'count' least audible voices, or otherwise lightens the load"""
+        pass
+
+    def restore(self):
+        """Undoes shedding that can be undone"""
+        pass
+
+    def handle_midi_message(self, message: 'Message'):
+        self.events.put(message)
+
+    def schedule(self, message: 'Message', sample: int):
+        """Queues a message at a sample position counted from the first rendered chunk"""
+        self.events.put(message, sample)
+
+    def _apply(self, message: 'Message', offset: int):
+        if message.type == 'note_on':
+            self.note_on(message.note, message.velocity, offset)
+        elif message.type == 'note_off':
+            self.note_off(message.note, offset)
+
+    def iterable(self) -> Iterator:
+        while True:
+            self.modulation.start_chunk(self.position)
+            for offset, message in self.events.drain(self.position):
+                self._apply(message, offset)
+            self.position += self.chunk_size
+            if self.budget is None:
+                chunk = next(self.source)
+            else:
+                started = time.perf_counter()
+                chunk = next(self.source)
+                self.budget.regulate(time.perf_counter() - started, (self,))
+            self.silent = self.source.silent
+            yield chunk
+
+    def close(self):
+        # No more messages arrive from the handler's thread once the observer is gone
+        if self.midi_handler:
+            self.midi_handler.unregister_observer(self.handle_midi_message, channel=self.channel)
+        super().close()
+
+
+class SynthesizerStream(MidiSynthesizerStream):
+    """
+    Renders every note as its own stream; with a 'voice_pool' size, notes reuse voices built up front. With 'panning'
+    the composer mixes the notes into stereo, each at its own position.
+    """
 
-class SynthesizerStream(AudioStream):
     def __init__(self,
-                 note_factory: MusicNoteFactory,
-                 midi_handler: MidiInputHandler,
+                 note_factory: MusicNoteFactory | TimbreKernel,
+                 midi_handler: MidiInput | None = None,
                  channel: int = 0,
                  sample_rate: int = 44100,
-                 chunk_size: int = 512
+                 chunk_size: int = 512,
+                 polyphony: Polyphony | None = None,
+                 voice_pool: int = 0,
+                 panning: Panning | None = None
                  ):
-        super().__init__(sample_rate=sample_rate, chunk_size=chunk_size)
+        super().__init__(midi_handler=midi_handler, channel=channel, sample_rate=sample_rate, chunk_size=chunk_size,
+                         polyphony=polyphony, channels=STEREO if panning else 1)
         self.note_factory = note_factory
-        self.midi_handler = midi_handler
-        self.midi_handler.register_observer(self.handle_midi_message, channel=channel)
+        self.panning = panning
+        self.applies_volume = isinstance(note_factory, TimbreKernel)
+        self.voices = VoicePool(note_factory, voice_pool) if voice_pool else None
+        self.composer = AudioStreamComposer(sample_rate, chunk_size, polyphony=polyphony, channels=self.channels)
 
-        self.composer = AudioStreamComposer(sample_rate, chunk_size)
+    @property
+    def voice_count(self) -> int:
+        return self.composer.stream_count
+
+    @property
+    def source(self) -> AudioStream:
+        return self.composer
 
-    def _create_sound_stream(self, note: int, velocity: int):
-        return self.note_factory.create_note(
-            frequency=midi_note_to_frequency(note), amplitude=velocity / 127
+    def _create_sound_stream(self, note: int, velocity: int, offset: int = 0):
+        create_note = self.voices.acquire if self.voices else self.note_factory.create_note
+        return create_note(
+            frequency=midi_note_to_frequency(note), amplitude=velocity / 127, offset=offset, modulation=self.modulation
         )
 
-    def handle_midi_message(self, message: Message):
-        if message.type == 'note_on':
-            stream = self._create_sound_stream(message.note, message.velocity)
-            self.composer.add_stream(stream, identifier=message.note)
-        elif message.type == 'note_off':
-            self.composer.close_stream(identifier=message.note)
+    def note_on(self, note: int, velocity: int, offset: int = 0):
+        if self.composer.is_held(note):
+            return  # Like the voice banks, without taking a voice or counting the note as started
+        stream = self._create_sound_stream(note, velocity, offset)
+        gains = pan_gains(note_position(self.panning, midi_note_to_frequency(note))) if self.panning else None
+        self.composer.add_stream(stream, identifier=note, offset=offset, gains=gains)
+
+    def note_off(self, note: int, offset: int = 0):
+        self.composer.close_stream(identifier=note, offset=offset)
+
+    def shed(self, count: int):
+        self.composer.shed(count)
+
+    def start_closing(self, offset: int = 0):
+        self.composer.start_closing(offset)
+        super().start_closing(offset)
+
+
+class VoiceBankSynthesizerStream(MidiSynthesizerStream):
+    def __init__(self, voice_bank: VoiceBank, midi_handler: MidiInput | None = None, channel: int = 0):
+        super().__init__(midi_handler=midi_handler, channel=channel, sample_rate=voice_bank.sample_rate,
+                         chunk_size=voice_bank.chunk_size, polyphony=voice_bank.polyphony,
+                         modulation=voice_bank.modulation, channels=voice_bank.channels)
+        self.voice_bank = voice_bank
+
+    @property
+    def voice_count(self) -> int:
+        return self.voice_bank.voice_count
+
+    @property
+    def source(self) -> AudioStream:
+        return self.voice_bank
+
+    @property
+    def variable_blocks(self) -> bool:
+        return self.voice_bank.variable_blocks
+
+    def render_block(self, frames: int) -> np.ndarray:
+        """The next 'frames' samples, with the MIDI messages due in them applied"""
+        self.modulation.start_chunk(self.position, frames)
+        for offset, message in self.events.drain(self.position, frames):
+            self._apply(message, offset)
+        self.position += frames
+        block = self.voice_bank.render(frames)
+        self.silent = self.voice_bank.silent
+        return block
+
+    def note_on(self, note: int, velocity: int, offset: int = 0):
+        self.voice_bank.note_on(note, frequency=midi_note_to_frequency(note), amplitude=velocity / 127, offset=offset)
+
+    def note_off(self, note: int, offset: int = 0):
+        self.voice_bank.note_off(note, offset)
+
+    def shed(self, count: int):
+        self.voice_bank.shed(count)
+
+    def restore(self):
+        self.voice_bank.restore()
+
+    def start_closing(self, offset: int = 0):
+        self.voice_bank.start_closing(offset)
+        super().start_closing(offset)
+
+
+class MultiChannelSynthesizerStream(AudioStream):
+    """
+    One synthesizer per configured MIDI channel, each with its own timbre and volume. The channels' chunks are
+    rendered on a thread pool, which runs in parallel wherever NumPy releases the GIL, and summed in channel order.
+    A render 'budget' sheds voices across all channels while the mix takes too long to render. The synthesizers all
+    render the same number of output channels.
+    """
+    applies_volume = False  # Only the channels' own volumes; the output volume is left to the caller
+
+    def __init__(self, synthesizers: dict[int, MidiSynthesizerStream], volumes: dict[int, float],
+                 workers: int | None = None, budget: RenderBudget | None = None):
+        first = next(iter(synthesizers.values()))
+        super().__init__(sample_rate=first.sample_rate, chunk_size=first.chunk_size, channels=first.channels)
+        self.synthesizers = dict(sorted(synthesizers.items()))
+        self.volumes = volumes
+        self.budget = budget
+        self._pool = ThreadPoolExecutor(max_workers=workers) if workers != 1 and len(synthesizers) > 1 else None
+        self._silence = np.zeros(chunk_shape(self.chunk_size, self.channels), dtype=np.float32)
+        self._silence.setflags(write=False)
+
+    @property
+    def voice_count(self) -> int:
+        return sum(s.voice_count for s in self.synthesizers.values())
+
+    @property
+    def pending_events(self) -> int:
+        return sum(s.pending_events for s in self.synthesizers.values())
+
+    @property
+    def variable_blocks(self) -> bool:
+        return all(s.variable_blocks for s in self.synthesizers.values())
+
+    def schedule(self, message: 'Message', sample: int):
+        if synthesizer := self.synthesizers.get(message.channel):
+            synthesizer.schedule(message, sample)
+
+    @property
+    def _parallel(self) -> bool:
+        """Whether to render on the pool, which isn't worth its overhead while every channel is idle"""
+        return self._pool is not None and not self.silent
+
+    def render_block(self, frames: int) -> np.ndarray:
+        synthesizers = list(self.synthesizers.values())
+        blocks = self._pool.map(lambda s: s.render_block(frames), synthesizers) if self._parallel else \
+            (s.render_block(frames) for s in synthesizers)
+        return self._mix(list(blocks), [np.float32(self.volumes.get(channel, 1.)) for channel in self.synthesizers],
+                         frames)
+
+    def _mix(self, chunks: list[np.ndarray], volumes: list[np.float32], frames: int) -> np.ndarray:
+        """Sums the channels that aren't silent"""
+        self.silent = all(s.silent for s in self.synthesizers.values())
+        if self.silent:
+            return self._silence[:frames]
+        mix = np.zeros(chunk_shape(frames, self.channels), dtype=np.float32)
+        for chunk, volume, synthesizer in zip(chunks, volumes, self.synthesizers.values()):
+            if not synthesizer.silent:
+                mix += chunk * volume
+        return mix
+
+    def start_closing(self, offset: int = 0):
+        for synthesizer in self.synthesizers.values():
+            synthesizer.start_closing(offset)
+        super().start_closing(offset)
 
     def iterable(self) -> Iterator:
-        return self.composer
+        synthesizers = list(self.synthesizers.values())
+        volumes = [np.float32(self.volumes.get(channel, 1.)) for channel in self.synthesizers]
+        while True:
+            started = time.perf_counter()
+            chunks = list(self._pool.map(next, synthesizers) if self._parallel else map(next, synthesizers))
+            mix = self._mix(chunks, volumes, self.chunk_size)
+            if self.budget:
+                self.budget.regulate(time.perf_counter() - started, synthesizers)
+            yield mix
 
     def close(self):
-        sleep(.1)  # Helps give the threads time to properly shut down
+        if self._pool:
+            self._pool.shutdown(wait=False)
         super().close()
+
+
+def select_engine(engine: str, timbre: Timbre, additive_threshold: int = ADDITIVE_THRESHOLD) -> str:
+    """
+    The additive engine takes over sine timbres with at least 'additive_threshold' partials (never when 0), except
+    from the sampler
+    """
+    partials = len(timbre.harmonics or ())
+    if additive_threshold and partials >= additive_threshold and timbre.oscillator == 'sine' and engine != 'sampler':
+        return 'additive'
+    return engine
+
+
+def create_synthesizer(timbre: Timbre,
+                       sample_rate: int,
+                       chunk_size: int,
+                       engine: str = 'streams',
+                       midi_handler: MidiInput | None = None,
+                       channel: int = 0,
+                       polyphony: Polyphony | None = None,
+                       voice_pool: int = 0,
+                       additive_threshold: int = ADDITIVE_THRESHOLD,
+                       sample_bank: SampleBank | None = None,
+                       control_period: int = 1,
+                       panning: Panning | None = None,
+                       volume: float = 1.
+                       ) -> SynthesizerStream | VoiceBankSynthesizerStream:
+    """
+    'voice_pool' voices are built up front; the voice bank allocates as many slots instead. The sampler plays
+    'sample_bank', which must have been rendered from the timbre at the same sample rate. The voice banks evaluate
+    envelopes and LFOs every 'control_period' samples (see ModulationBus); the other engines only at every sample. With
+    'panning' the synthesizer renders stereo; only the voicebank and additive engines spread harmonics apart. The
+    fused engine renders its notes at 'volume', and the synthesizer's 'applies_volume' tells whether it did.
+    """
+    engine = select_engine(engine, timbre, additive_threshold)
+    if control_period > 1 and engine not in CONTROL_RATE_ENGINES:
+        raise ValueError(f'The {engine} engine modulates at every sample, not at a control period')
+    modulation = ModulationBus(sample_rate, chunk_size, control_period)
+    if engine == 'sampler':
+        if sample_bank is None or sample_bank.sample_rate != sample_rate:
+            raise ValueError(f'The sampler engine needs a sample bank rendered at {sample_rate} Hz')
+        voice_bank = SamplePlaybackBank(timbre, sample_bank, chunk_size, capacity=voice_pool or 32, polyphony=polyphony,
+                                        modulation=modulation, panning=panning)
+        return VoiceBankSynthesizerStream(voice_bank=voice_bank, midi_handler=midi_handler, channel=channel)
+    if engine in ('voicebank', 'additive'):
+        bank = AdditiveBank if engine == 'additive' else VoiceBank
+        voice_bank = bank(timbre=timbre, sample_rate=sample_rate, chunk_size=chunk_size, capacity=voice_pool or 32,
+                          polyphony=polyphony, modulation=modulation, panning=panning)
+        return VoiceBankSynthesizerStream(voice_bank=voice_bank, midi_handler=midi_handler, channel=channel)
+
+    if engine == 'fused':
+        note_factory = compile_timbre(timbre, sample_rate, chunk_size, volume)
+    else:
+        note_factory = MusicNoteFactory(sample_rate=sample_rate, chunk_size=chunk_size, timbre=timbre)
+    return SynthesizerStream(
+        note_factory=note_factory,
+        midi_handler=midi_handler,
+        channel=channel,
+        sample_rate=sample_rate,
+        chunk_size=chunk_size,
+        polyphony=polyphony,
+        voice_pool=voice_pool,
+        panning=panning
+    )
+
+
+def create_multichannel_synthesizer(channels: tuple[ChannelConfig, ...],
+                                    sample_rate: int,
+                                    chunk_size: int,
+                                    engine: str = 'streams',
+                                    midi_handler: MidiInput | None = None,
+                                    workers: int | None = None,
+                                    polyphony: Polyphony | None = None,
+                                    voice_pool: int = 0,
+                                    additive_threshold: int = ADDITIVE_THRESHOLD,
+                                    sample_bank: SampleBank | None = None,
+                                    control_period: int = 1,
+                                    panning: Panning | None = None
+                                    ) -> MultiChannelSynthesizerStream:
+    """
+    The polyphony limit and voice pool apply per channel, while adaptive shedding measures the whole mix. The mix is
+    stereo when 'panning' or any channel's own panning is given, and channels without their own use 'panning'.
+    """
+    channel_polyphony = replace(polyphony, adaptive=False) if polyphony else None
+    stereo = panning is not None or any(config.panning for config in channels)
+    synthesizers = {
+        config.channel: create_synthesizer(config.timbre, sample_rate, chunk_size, engine=engine,
+                                           midi_handler=midi_handler, channel=config.channel,
+                                           polyphony=channel_polyphony, voice_pool=voice_pool,
+                                           additive_threshold=additive_threshold, sample_bank=sample_bank,
+                                           control_period=control_period,
+                                           panning=config.panning or panning or Panning() if stereo else None)
+        for config in channels
+    }
+    volumes = {config.channel: config.volume for config in channels}
+    budget = RenderBudget(sample_rate, chunk_size, polyphony.budget) if polyphony and polyphony.adaptive else None
+    return MultiChannelSynthesizerStream(synthesizers, volumes, workers=workers, budget=budget)
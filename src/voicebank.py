@@ -0,0 +1,368 @@
+from typing import Hashable
+
+import numpy as np
+
+from src.base import AudioStream, chunk_shape
+from src.dataclasses import Timbre, Harmonic, Polyphony, LFO, Panning
+from src.envelopes import envelope_table, harmonic_gate, sustain_groups
+from src.modulation import ModulationBus
+from src.panning import STEREO, pan_gains, note_position, harmonic_offsets
+from src.polyphony import steal_order, shed_order
+from src.wavetables import mipmap
+
+NOT_RELEASED = np.iinfo(np.int64).max // 2
+
+
+class VoiceBank(AudioStream):
+    """
+    Renders all voices of a Timbre in batched array ops from struct-of-arrays (voice x partial) state. Partials are
+    kept loudest first, so the weakest can be shed by rendering fewer columns. Vibrato, tremolo and the timbre's
+    LFOs are read from a modulation bus, each voice keeping only the angle its LFOs lag the bus oscillators by. The
+    envelope, gates, fades and LFOs are evaluated at the bus' control points and combined there, then upsampled.
+    A non-sine oscillator renders all harmonics from one band-limited table per voice (more when harmonics have their
+    own sustain times, or an LFO modulates the overtones apart), so its columns are tables rather than partials.
+    With 'panning' it renders stereo: each voice keeps (channel x partial) gains, which weight its partials in the
+    same matrix product as their amplitudes. 'render' takes any number of frames up to chunk_size.
+    """
+    variable_blocks = True  # Whether render takes blocks shorter than chunk_size
+
+    def __init__(self, timbre: Timbre, sample_rate: int, chunk_size: int, capacity: int = 32,
+                 polyphony: Polyphony | None = None, modulation: ModulationBus | None = None,
+                 panning: Panning | None = None):
+        super().__init__(sample_rate=sample_rate, chunk_size=chunk_size, channels=STEREO if panning else 1)
+        self.timbre = timbre
+        self.polyphony = polyphony
+        self.panning = panning
+        self.modulation = modulation or ModulationBus(sample_rate, chunk_size)
+        self._clock = 0  # First sample of the next chunk
+        self._lfos = self._collect_lfos(timbre)
+        partials = timbre.harmonics or (Harmonic(multiple=1, amplitude=1., sustain=None),)
+        partials = sorted(partials, key=lambda h: -h.amplitude)
+        self._tables = None
+        if timbre.oscillator != 'sine':
+            groups = self._oscillator_groups(timbre, partials)
+            self._tables = [mipmap(timbre.oscillator, tuple((h.multiple, h.amplitude) for h in group), sample_rate,
+                                   timbre.spectrum) for _, group, _ in groups]
+            partials = [Harmonic(multiple=1, amplitude=1., sustain=sustain) for _, _, sustain in groups]
+            self._overtones = np.array([all(h.multiple != 1 for h in group) for _, group, _ in groups])
+        self._multiples = np.array([h.multiple for h in partials], dtype=np.float64)
+        self._partial_amplitudes = np.array([h.amplitude for h in partials], dtype=np.float32)
+        if not self._tables:
+            self._overtones = self._multiples != 1
+        self._pan_offsets = harmonic_offsets(panning, self._multiples) if panning else None
+        # Where each partial's gate ends, for those that fade out after their own sustain time
+        gates = [harmonic_gate(h.sustain, timbre.envelope, sample_rate) for h in partials]
+        self._gate_end = np.array([gate.end if gate else np.inf for gate in gates])
+        self._gate_length = next((gate.length for gate in gates if gate), 1)
+        if self._tables:
+            # (table, level, sample) values and slopes of each table's band-limited levels
+            self._table_values = np.stack([table.tables[:, :-1] for table in self._tables])
+            self._table_slopes = np.stack([np.diff(table.tables, axis=1) for table in self._tables])
+            self._table_size = self._tables[0].size
+
+        self._envelope_table = envelope_table(timbre.envelope, sample_rate, chunk_size)
+        # Padded so notes that start mid-chunk (negative positions) read silence
+        self._head = np.concatenate((np.zeros(chunk_size, dtype=np.float32), self._envelope_table.head))
+        self._release = np.append(self._envelope_table.release, np.float32(0))
+        self._ramp = np.arange(chunk_size, dtype=np.float64)
+        self._silence = np.zeros(chunk_shape(chunk_size, self.channels), dtype=np.float32)
+        self._silence.setflags(write=False)
+        self._fade_length = max(1, round(polyphony.fade * sample_rate)) if polyphony else 1
+
+        self._partials = len(partials)  # Partials being rendered
+        self._partial_ramp = None  # Fades the last rendered partial in or out over the next chunk
+        self._count = 0
+        self._started_count = 0
+        self._identifiers: list[Hashable] = []
+        self._allocate(capacity)
+
+    @property
+    def voice_count(self) -> int:
+        return self._count
+
+    @staticmethod
+    def _oscillator_groups(timbre: Timbre, partials: list[Harmonic]) -> list[tuple[str, tuple[Harmonic, ...], float]]:
+        """The partials mixed into each table: those with the same sustain time, overtones apart when modulated"""
+        split = any(lfo.target == 'harmonics' for lfo in timbre.lfos) and any(h.multiple != 1 for h in partials)
+        return sustain_groups(tuple(partials), split_overtones=split)
+
+    @staticmethod
+    def _collect_lfos(timbre: Timbre) -> list[tuple[str, LFO]]:
+        """Every LFO of the timbre, each with what it modulates; vibrato and tremolo keep their own formulas"""
+        lfos = [(lfo.target, lfo) for lfo in timbre.lfos]
+        if timbre.vibrato and timbre.vibrato.rate and timbre.vibrato.depth:
+            lfos.append(('vibrato', LFO(rate=timbre.vibrato.rate, depth=timbre.vibrato.depth)))
+        if timbre.tremolo and timbre.tremolo.rate and timbre.tremolo.depth:
+            lfos.append(('tremolo', LFO(rate=timbre.tremolo.rate, depth=timbre.tremolo.depth)))
+        return lfos
+
+    def _allocate(self, capacity: int):
+        partials = len(self._multiples)
+        self._phase = np.zeros((capacity, partials), dtype=np.float64)
+        self._increment = np.zeros((capacity, partials), dtype=np.float64)
+        self._amplitude = np.zeros((capacity, partials), dtype=np.float32)
+        self._pan = np.ones((capacity, self.channels, partials), dtype=np.float32)
+        self._position = np.zeros(capacity, dtype=np.int64)
+        self._release_start = np.full(capacity, NOT_RELEASED, dtype=np.int64)
+        self._held = np.zeros(capacity, dtype=bool)
+        self._fade_start = np.full(capacity, NOT_RELEASED, dtype=np.int64)
+        self._started = np.zeros(capacity, dtype=np.int64)
+        self._level = np.zeros(capacity, dtype=np.float32)
+        # Per voice x LFO: cosine and sine of the angle it lags the bus by, and its cosine at the voice's start
+        self._lfo_cos = np.zeros((capacity, len(self._lfos)), dtype=np.float32)
+        self._lfo_sin = np.zeros((capacity, len(self._lfos)), dtype=np.float32)
+        self._lfo_start_cos = np.zeros((capacity, len(self._lfos)), dtype=np.float64)
+        self._table_level = np.zeros(capacity, dtype=np.int64)
+
+    @property
+    def _state(self) -> tuple[np.ndarray, ...]:
+        return (self._phase, self._increment, self._amplitude, self._pan, self._position, self._release_start,
+                self._held, self._fade_start, self._started, self._level, self._lfo_cos, self._lfo_sin,
+                self._lfo_start_cos, self._table_level)
+
+    def _grow(self):
+        count, old = self._count, self._state
+        self._allocate(2 * len(self._position))
+        for new_array, old_array in zip(self._state, old):
+            new_array[:count] = old_array[:count]
+
+    def _held_slot(self, identifier: Hashable) -> int | None:
+        for slot in range(self._count):
+            if self._held[slot] and self._identifiers[slot] == identifier:
+                return slot
+        return None
+
+    def note_on(self, identifier: Hashable, frequency: float, amplitude: float, offset: int = 0):
+        """Starts a voice 'offset' samples into the next chunk"""
+        if self._held_slot(identifier) is not None:
+            return
+        if self.polyphony:
+            self._make_room(identifier, offset)
+        if self._count == len(self._position):
+            self._grow()
+
+        slot = self._count
+        self._increment[slot] = frequency * self._multiples / self.sample_rate
+        self._phase[slot] = -offset * self._increment[slot] % 1.
+        self._amplitude[slot] = amplitude * self._partial_amplitudes
+        if self.panning:
+            self._pan[slot] = pan_gains(note_position(self.panning, frequency) + self._pan_offsets).T
+        if self._tables:
+            self._table_level[slot] = self._tables[0].level(frequency)
+        self._position[slot] = -offset
+        release_start = self._envelope_table.initial_release_start()
+        self._release_start[slot] = NOT_RELEASED if release_start is None else release_start
+        self._held[slot] = True
+        self._fade_start[slot] = NOT_RELEASED
+        self._started[slot] = self._started_count
+        self._level[slot] = np.inf
+        self._started_count += 1
+        if self._lfos:
+            self._start_lfos(slot, self._clock + offset, self.modulation.next_voice())
+        self._identifiers.append(identifier)
+        self._count += 1
+
+    def note_off(self, identifier: Hashable, offset: int = 0):
+        slot = self._held_slot(identifier)
+        if slot is None:
+            return
+        self._held[slot] = False
+        if self._release_start[slot] == NOT_RELEASED:
+            self._release_start[slot] = self._envelope_table.release_start(self._position[slot] + offset)
+
+    def _stealable(self) -> np.ndarray:
+        return np.flatnonzero(self._fade_start[:self._count] == NOT_RELEASED)
+
+    def _make_room(self, identifier: Hashable, offset: int):
+        if self.polyphony.steal == 'same-note':
+            for slot in self._stealable():
+                if self._identifiers[slot] == identifier:
+                    self._fade_out(slot, offset)
+
+        slots = self._stealable()
+        excess = len(slots) + 1 - (self.polyphony.max_voices or len(slots) + 1)
+        if excess > 0:
+            order = steal_order(self.polyphony.steal, self._started[slots], self._level[slots], ~self._held[slots])
+            for slot in slots[order[:excess]]:
+                self._fade_out(slot, offset)
+
+    def _fade_out(self, slot: int, offset: int):
+        self._held[slot] = False
+        self._fade_start[slot] = self._position[slot] + offset
+
+    def shed(self, count: int, offset: int = 0):
+        """
+        Reduces the load by the least audible means: fading out released voices, then dropping the weakest partial,
+        then fading out the quietest held voices
+        """
+        slots = self._stealable()
+        released = ~self._held[slots]
+        if not released.any() and self._partials > 1:
+            if self._partial_ramp is None:
+                self._partial_ramp = np.linspace(1, 0, self.chunk_size, dtype=np.float32)
+            return
+        for slot in slots[shed_order(self._level[slots], released)[:count]]:
+            self._fade_out(slot, offset)
+
+    def restore(self):
+        """Brings back one shed partial"""
+        if self._partials < len(self._multiples) and self._partial_ramp is None:
+            self._partials += 1
+            self._partial_ramp = np.linspace(0, 1, self.chunk_size, dtype=np.float32)
+
+    def start_closing(self, offset: int = 0):
+        for identifier in list(self._identifiers):
+            self.note_off(identifier, offset)
+        super().start_closing(offset)
+
+    def _envelope(self, positions: np.ndarray, release_start: np.ndarray) -> np.ndarray:
+        table = self._envelope_table
+        envelope = np.where(
+            positions < table.head_length,
+            self._head[np.clip(positions + self.chunk_size, 0, len(self._head) - 1)],
+            table.sustain_amplitude
+        )
+        release_offset = positions - release_start[:, None]
+        in_release = release_offset >= 0
+        if in_release.any():
+            release = self._release[np.clip(release_offset, 0, len(self._release) - 1)]
+            envelope = np.where(in_release, release, envelope)
+        return envelope
+
+    def _start_lfos(self, slot: int, start: int, index: int):
+        for column, (_, lfo) in enumerate(self._lfos):
+            angle = self.modulation.angle(lfo.rate, start, lfo.sync, (lfo.phase + lfo.spread * index) % 1.)
+            self._lfo_cos[slot, column] = np.cos(angle)
+            self._lfo_sin[slot, column] = np.sin(angle)
+            self._lfo_start_cos[slot, column] = np.cos(2 * np.pi * self.modulation.phase(lfo.rate, start) - angle)
+
+    def _lfo_wave(self, column: int, count: int, cosine: bool = False) -> np.ndarray:
+        """Each voice's LFO (or its cosine) at the bus' control points, as a (voice x point) array"""
+        sin, cos = self.modulation.oscillator(self._lfos[column][1].rate)
+        angle_cos, angle_sin = self._lfo_cos[:count, column, None], self._lfo_sin[:count, column, None]
+        if cosine:
+            return cos * angle_cos + sin * angle_sin
+        return sin * angle_cos - cos * angle_sin
+
+    def _sample_clock(self, count: int) -> np.ndarray | None:
+        """
+        Each voice's samples since the chunk started, bent by the integral of its pitch LFOs, as a (voice x sample)
+        array; a partial's phase advances by its increment per step of it
+        """
+        clock = None
+        for column, (target, lfo) in enumerate(self._lfos):
+            if target == 'pitch':
+                swing = self._lfo_start_cos[:count, column, None] - self._lfo_wave(column, count, cosine=True)
+                term = self.sample_rate * lfo.depth / (2 * np.pi * lfo.rate) * swing
+                clock = term if clock is None else clock + term
+        return None if clock is None else self.modulation.upsample(clock + self.modulation.offsets)
+
+    def _lfo_gain(self, count: int, targets: tuple[str, ...]) -> np.ndarray | None:
+        gain = None
+        for column, (target, lfo) in enumerate(self._lfos):
+            if target not in targets:
+                continue
+            wave, depth = self._lfo_wave(column, count), lfo.depth
+            if target == 'vibrato':
+                term = 1 + depth * depth * wave
+            elif target == 'tremolo':
+                term = 1 - depth + depth * depth * wave
+            else:
+                term = 1 + depth * wave
+            gain = term if gain is None else gain * term
+        return gain
+
+    def _read_tables(self, phases: np.ndarray, count: int, partials: int) -> np.ndarray:
+        """Linearly interpolated (voice x table x sample) reads at phases in cycles, each from the voice's level"""
+        positions = phases * self._table_size
+        indices = np.floor(positions).astype(np.int64)
+        fractions = (positions - indices).astype(np.float32)
+        indices %= self._table_size
+        tables = np.arange(partials)[None, :, None]
+        levels = self._table_level[:count, None, None]
+        waves = self._table_slopes[tables, levels, indices]
+        waves *= fractions
+        waves += self._table_values[tables, levels, indices]
+        return waves
+
+    def _gates(self, positions: np.ndarray, partials: int) -> np.ndarray:
+        """Each partial's gain (voice x partial x sample) after its sustain time, like HarmonicGate"""
+        gates = (self._gate_end[:partials, None] - positions[:, None, :]) / self._gate_length
+        return np.clip(gates, 0, 1).astype(np.float32)
+
+    def _fade(self, positions: np.ndarray, fade_start: np.ndarray) -> np.ndarray:
+        return np.clip(1 - (positions - fade_start[:, None]) / self._fade_length, 0, 1).astype(np.float32)
+
+    def _take_partial_ramp(self, frames: int) -> np.ndarray:
+        """The pending partial fade over 'frames' samples, dropping the partial once it has faded out"""
+        ramp, self._partial_ramp = self._partial_ramp, None
+        if ramp[-1] == 0:
+            self._partials -= 1
+        return ramp if frames == len(ramp) else np.linspace(ramp[0], ramp[-1], frames, dtype=np.float32)
+
+    def render(self, frames: int | None = None) -> np.ndarray:
+        count, frames = self._count, frames or self.chunk_size
+        modulation = self.modulation
+        modulation.start_chunk(self._clock, frames)
+        self._clock += frames
+        self.silent = not count
+        if self.silent:
+            return self._silence[:frames]
+
+        partials = self._partials
+        clock = self._sample_clock(count)
+        clock = self._ramp[:frames] if clock is None else clock[:, None, :]
+        phases = self._phase[:count, :partials, None] + self._increment[:count, :partials, None] * clock
+        waves = self._read_tables(phases, count, partials) if self._tables else \
+            np.sin((2 * np.pi * phases).astype(np.float32))
+        positions = self._position[:count, None] + modulation.offsets
+        if np.isfinite(self._gate_end[:partials]).any():
+            waves *= modulation.upsample(self._gates(positions, partials))
+        if self._partial_ramp is not None:
+            waves[:, -1] *= self._take_partial_ramp(frames)
+        weights = self._amplitude[:count, None, :partials]
+        if self.panning:
+            weights = weights * self._pan[:count, :, :partials]
+        voices = np.matmul(weights, waves)
+        if (overtone_gain := self._lfo_gain(count, ('harmonics',))) is not None:
+            overtones = weights * self._overtones[:partials]
+            voices += np.matmul(overtones, waves) * modulation.upsample(overtone_gain - 1)[:, None]
+
+        envelope = self._envelope(positions, self._release_start[:count])
+        if self.polyphony:
+            self._level[:count] = self._amplitude[:count, :self._partials].sum(axis=1) * envelope[:, -1]
+        if (gain := self._lfo_gain(count, ('vibrato', 'tremolo', 'amplitude'))) is not None:
+            envelope *= gain
+        if (self._fade_start[:count] != NOT_RELEASED).any():
+            envelope *= self._fade(positions, self._fade_start[:count])
+        voices *= modulation.upsample(envelope)[:, None]
+
+        self._phase[:count] = (self._phase[:count] + self._increment[:count] * frames) % 1.
+        self._position[:count] += frames
+        self._drop_finished()
+        return self._interleave(voices.sum(axis=0, dtype=np.float32))
+
+    def _interleave(self, mix: np.ndarray) -> np.ndarray:
+        """A (channel x frame) mix as a chunk"""
+        return mix[0] if self.channels == 1 else np.ascontiguousarray(mix.T)
+
+    def _drop_finished(self):
+        finished = (
+            (self._position[:self._count] >= self._release_start[:self._count] + len(self._release))
+            | (self._position[:self._count] >= self._gate_end.max())
+            | (self._position[:self._count] >= self._fade_start[:self._count] + self._fade_length)
+        )
+        if self._envelope_table.floor:
+            peaks = self._envelope_table.peak_ahead(self._position[:self._count], self._release_start[:self._count])
+            finished |= peaks < self._envelope_table.floor
+        for slot in np.flatnonzero(finished)[::-1]:
+            last = self._count - 1
+            for array in self._state:
+                array[slot] = array[last]
+            self._identifiers[slot] = self._identifiers[last]
+            self._identifiers.pop()
+            self._count = last
+
+    def iterable(self):
+        while True:
+            yield self.render()
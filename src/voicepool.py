@@ -0,0 +1,45 @@
+from collections import deque
+
+from src.kernels import TimbreKernel, FusedNoteStream
+from src.modulation import ModulationBus
+from src.notes import MusicNoteFactory, MusicNote
+
+
+class VoicePool:
+    """
+    Voices built ahead of time by a note factory, so that a note-on only resets one with the note's parameters.
+    A voice returns to the pool when it closes. When every voice is playing the pool builds another one, so it
+    bounds construction at note-on rather than polyphony; 'built' counts them all. A pool is used from one thread.
+    """
+
+    def __init__(self, factory: MusicNoteFactory | TimbreKernel, size: int):
+        self.factory = factory
+        self.built = 0
+        self._free: deque[MusicNote | FusedNoteStream] = deque()
+        # Voices are built against a scratch bus, so that building them doesn't count as starting notes
+        self._scratch_modulation = ModulationBus(factory.sample_rate, factory.chunk_size)
+        for _ in range(size):
+            voice = self._build()
+            voice.close()
+
+    @property
+    def free(self) -> int:
+        return len(self._free)
+
+    def _build(self) -> MusicNote | FusedNoteStream:
+        voice = self.factory.create_note(frequency=440., amplitude=0., modulation=self._scratch_modulation)
+        voice.pool = self
+        self.built += 1
+        return voice
+
+    def acquire(self, frequency: float, amplitude: float, offset: int = 0,
+                modulation: ModulationBus | None = None) -> MusicNote | FusedNoteStream:
+        try:
+            voice = self._free.pop()
+        except IndexError:
+            voice = self._build()
+        voice.reset(frequency, amplitude, offset, modulation)
+        return voice
+
+    def release(self, voice: MusicNote | FusedNoteStream):
+        self._free.append(voice)
@@ -0,0 +1,120 @@
+from functools import lru_cache
+
+import numpy as np
+
+from src.patches import compiled_table
+
+MIN_TABLE_SIZE = 4096
+SAMPLES_PER_CYCLE = 1024  # Keeps linear interpolation error around -100 dB for the highest partial
+
+
+def table_size(highest_multiple: float) -> int:
+    return max(MIN_TABLE_SIZE, 1 << int(np.ceil(np.log2(highest_multiple * SAMPLES_PER_CYCLE))))
+
+
+@compiled_table
+def harmonic_table(partials: tuple[tuple[float, float], ...]) -> np.ndarray:
+    """One cycle of the sum of sine partials given as (multiple, amplitude), plus a wrap-around guard sample"""
+    size = table_size(max(multiple for multiple, _ in partials))
+    cycle = np.arange(size + 1) / size
+    table = np.zeros(size + 1)
+    for multiple, amplitude in partials:
+        table += amplitude * np.sin(2 * np.pi * multiple * cycle)
+    table[-1] = table[0]
+    table = table.astype(np.float32)
+    table.setflags(write=False)
+    return table
+
+
+OSCILLATORS = ('sine', 'saw', 'square', 'triangle', 'custom')
+MIPMAP_TABLE_SIZE = 4096
+MIPMAP_HARMONICS = MIPMAP_TABLE_SIZE // 4  # Harmonics in the lowest level, leaving room for interpolation
+
+
+def oscillator_coefficients(oscillator: str, harmonics: int, spectrum: tuple[float, ...] = ()) -> np.ndarray:
+    """Sine series amplitudes of harmonics 1 to 'harmonics' of a waveform, scaled so the full waveform peaks at 1"""
+    n = np.arange(1, harmonics + 1)
+    odd = n % 2 == 1
+    if oscillator == 'sine':
+        coefficients = (n == 1).astype(np.float64)
+    elif oscillator == 'saw':
+        coefficients = 2 / np.pi * np.where(odd, 1., -1.) / n
+    elif oscillator == 'square':
+        coefficients = np.where(odd, 4 / np.pi / n, 0.)
+    elif oscillator == 'triangle':
+        coefficients = np.where(odd, 8 / np.pi ** 2 * np.where(n % 4 == 1, 1., -1.) / n ** 2, 0.)
+    elif oscillator == 'custom':
+        coefficients = np.zeros(harmonics)
+        coefficients[:min(len(spectrum), harmonics)] = spectrum[:harmonics]
+    else:
+        raise ValueError(f'Unknown oscillator {oscillator!r}; expected one of {OSCILLATORS}')
+    peak = np.abs(_sine_series(coefficients, MIPMAP_TABLE_SIZE)).max()
+    return coefficients / peak if peak else coefficients
+
+
+def _sine_series(coefficients: np.ndarray, size: int) -> np.ndarray:
+    """One cycle of sum(coefficients[k - 1] * sin(2 pi k t)) over 'size' samples"""
+    spectrum = np.zeros(size // 2 + 1, dtype=np.complex128)
+    spectrum[1:len(coefficients) + 1] = -0.5j * size * coefficients
+    return np.fft.irfft(spectrum, n=size)
+
+
+class MipMap:
+    """
+    Band-limited tables of one waveform, one per octave of fundamental frequency. Level k holds the harmonics that stay
+    below Nyquist for fundamentals up to base * 2^k, so a note reads the level for its frequency without aliasing.
+    """
+
+    def __init__(self, tables: np.ndarray, sample_rate: int):
+        self.tables = tables  # (levels, size + 1), each with a wrap-around guard sample
+        self.size = tables.shape[1] - 1
+        self.sample_rate = sample_rate
+        self.base = sample_rate / 2 / MIPMAP_HARMONICS
+
+    @property
+    def levels(self) -> int:
+        return len(self.tables)
+
+    def level(self, frequency: float) -> int:
+        if frequency <= self.base:
+            return 0
+        return min(int(np.ceil(np.log2(frequency / self.base))), self.levels - 1)
+
+    def table(self, frequency: float) -> np.ndarray:
+        return self.tables[self.level(frequency)]
+
+
+@compiled_table
+def mipmap_tables(oscillator: str, partials: tuple[tuple[int, float], ...], spectrum: tuple[float, ...]) -> np.ndarray:
+    """
+    Tables of the oscillator played at each partial given as (multiple, amplitude), like harmonic_table does with
+    sines, as one summed spectrum that is cut off per level
+    """
+    coefficients = oscillator_coefficients(oscillator, MIPMAP_HARMONICS, spectrum)
+    summed = np.zeros(MIPMAP_HARMONICS)
+    for multiple, amplitude in partials:
+        multiple = int(multiple)
+        summed[multiple - 1::multiple] += amplitude * coefficients[:len(summed[multiple - 1::multiple])]
+
+    levels = int(np.log2(MIPMAP_HARMONICS)) + 1
+    tables = np.empty((levels, MIPMAP_TABLE_SIZE + 1), dtype=np.float32)
+    for level in range(levels):
+        cycle = _sine_series(summed[:MIPMAP_HARMONICS >> level], MIPMAP_TABLE_SIZE)
+        tables[level, :-1] = cycle
+        tables[level, -1] = cycle[0]
+    tables.setflags(write=False)
+    return tables
+
+
+@lru_cache(maxsize=None)
+def mipmap(oscillator: str, partials: tuple[tuple[int, float], ...], sample_rate: int,
+           spectrum: tuple[float, ...] = ()) -> MipMap:
+    return MipMap(mipmap_tables(oscillator, partials, spectrum), sample_rate)
+
+
+def oscillator_table(partials: tuple[tuple[int, float], ...], frequency: float, sample_rate: int,
+                     oscillator: str = 'sine', spectrum: tuple[float, ...] = ()) -> np.ndarray:
+    """The table a note at 'frequency' reads: summed sines for the sine oscillator, otherwise a band-limited level"""
+    if oscillator == 'sine':
+        return harmonic_table(partials)
+    return mipmap(oscillator, partials, sample_rate, spectrum).table(frequency)
@@ -1,23 +1,81 @@
 import argparse
+import importlib
+import os
+import sys
+import time
+from contextlib import nullcontext
+from functools import partial
 
-from src.dataclasses import Timbre, ADSRProfile, Vibrato, Tremolo, Harmonic
-from src.effects import MultiplyAudioStreamDecorator
-from src.midi import MidiInputHandler
-from src.notes import MusicNoteFactory
-from src.outputs import AudioPlaybackDecorator, AudioFileOutputDecorator
+from src.additive import ADDITIVE_THRESHOLD
+from src.blocks import AdaptiveBlockStream, block_sizes
+from src.dataclasses import Timbre, ADSRProfile, Vibrato, Tremolo, Harmonic, ChannelConfig, Polyphony, LFO, Panning
+from src.convolution import load_impulse_response
+from src.effects import MultiplyAudioStreamDecorator, ConvolutionReverbDecorator
+from src.files import FILE_FORMATS
+from src.inputs import ArrayStream
+from src.midi import MidiInput, MidiInputHandler, read_midi_file
+from src.modulation import LFO_TARGETS, LFO_SYNC_MODES, MODULATION_QUALITIES
+from src.polyphony import STEAL_POLICIES
+from src.profiling import Profiler
+from src.outputs import AudioFileOutputDecorator
+from src.panning import STEREO
+from src.patches import compiled_patch
+from src.render import RenderSettings, SPLIT_MODES, render_midi
+from src.samplebank import SampleBank, build_sample_bank
 from src.services import load_template
-from src.synth import SynthesizerStream
+from src.synth import ENGINES, VARIABLE_BLOCK_ENGINES, CONTROL_RATE_ENGINES, create_synthesizer, \
+    create_multichannel_synthesizer, select_engine
+from src.wavetables import OSCILLATORS
 
+# Backends are imported only once selected, so headless and offline runs never load PortAudio or multiprocessing
+PLAYBACK_BACKENDS = {'callback': 'src.playback:AudioCallbackPlaybackDecorator',
+                     'thread': 'src.playback:AudioPlaybackDecorator'}
+RENDER_PROCESS = 'src.process:RenderProcess'
 
-def parse_args():
+
+def load_backend(path: str):
+    module, name = path.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description='Synthesizer and MIDI handler with effects.')
 
     parser.add_argument('--template', type=str, help='JSON template file (e.g. "default.json")')
+    parser.add_argument('--patch-cache', type=str, metavar='DIR',
+                        help='Save the tables a patch compiles to in this directory, and map them on later starts')
 
     # Synth configuration
     parser.add_argument('--volume', type=float, default=0.3, help='Set output volume of a note')
     parser.add_argument('--sample-rate', type=int, default=44100, help='Sample rate for the synthesizer')
     parser.add_argument('--chunk_size', type=int, default=512, help='Chunk size for the synthesizer')
+    parser.add_argument('--engine', choices=ENGINES, default='streams',
+                        help='Render notes as a tree of streams per note, as one fused kernel per note, or all at '
+                             'once from a vectorized voice bank or by inverse FFT additive synthesis')
+    parser.add_argument('--additive-threshold', type=int, default=ADDITIVE_THRESHOLD,
+                        help='Partials from which a sine timbre is rendered by the additive engine; 0 never switches')
+    parser.add_argument('--channel', action='append', default=[],
+                        help='Play a MIDI channel with its own template in the format "channel,template,volume" '
+                             '(volume is optional and defaults to the template\'s). Repeatable for multiple channels.')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='Threads rendering MIDI channels')
+    parser.add_argument('--max-voices', type=int, help='Most notes sounding at once per channel; unlimited if not set')
+    parser.add_argument('--voice-pool', type=int,
+                        help='Voices built before playing starts, reused by later notes (default: --max-voices, or 16).'
+                             ' The voicebank engine allocates as many slots; 0 builds every note afresh')
+    parser.add_argument('--steal', choices=STEAL_POLICIES, default='released-first',
+                        help='Which voice makes room for a new note once --max-voices are sounding')
+    parser.add_argument('--steal-fade', type=float, default=.005, help='Seconds a stolen voice fades out over')
+    parser.add_argument('--adaptive-polyphony', action='store_true',
+                        help='Shed the least audible voices while rendering a chunk nears its real-time deadline')
+    parser.add_argument('--cpu-budget', type=float, default=.75,
+                        help='Fraction of the chunk deadline adaptive polyphony keeps the render time under')
+    parser.add_argument('--adaptive-latency', action='store_true',
+                        help='Render in blocks of doublings of --chunk_size, larger while rendering is heavy, and '
+                             'play them in chunks of --chunk_size (voicebank and sampler engines)')
+    parser.add_argument('--min-latency', type=float, default=0., help='Seconds the smallest render block adds')
+    parser.add_argument('--max-latency', type=float, default=.05, help='Seconds the largest render block adds')
+    parser.add_argument('--latency-budget', type=float, default=.5,
+                        help='Fraction of a block\'s deadline above which adaptive latency renders larger blocks')
 
     # Timbre configuration
     parser.add_argument('--attack', type=float, default=0.1, help='Attack time for ADSR envelope')
@@ -25,6 +83,9 @@ def parse_args():
     parser.add_argument('--sustain-amplitude', type=float, default=0.7, help='Sustain amplitude for ADSR envelope')
     parser.add_argument('--sustain', type=float, help='Optional sustain time for ADSR envelope')
     parser.add_argument('--release', type=float, default=0.5, help='Release time for ADSR envelope')
+    parser.add_argument('--silence-floor', type=float, metavar='DB',
+                        help='End notes once their envelope stays below this many dB (e.g. -80) instead of playing '
+                             'the envelope out')
 
     parser.add_argument('--vibrato-rate', type=float, default=5.5, help='Rate of vibrato')
     parser.add_argument('--vibrato-depth', type=float, default=0.06, help='Depth of vibrato')
@@ -32,32 +93,135 @@ def parse_args():
     parser.add_argument('--tremolo-rate', type=float, default=4.0, help='Rate of tremolo')
     parser.add_argument('--tremolo-depth', type=float, default=0.1, help='Depth of tremolo')
 
+    parser.add_argument('--oscillator', choices=OSCILLATORS, default='sine',
+                        help='Waveform the note and each harmonic play; all but sine read band-limited wavetables')
+    parser.add_argument('--spectrum', default='',
+                        help='Amplitudes of harmonics 1, 2, ... of the custom oscillator, e.g. 1,0,0.33,0,0.2')
     parser.add_argument('--harmonic', action='append', default=['2,0.5,None', '3,0.3,.8'],
                         help='Add a harmonic in the format "multiple,amplitude,sustain duration (None for infinite)".'
                              ' Default is; --harmonic 2,0.5,None --harmonic 3,0.3,.8'
                         )
+    parser.add_argument('--lfo', action='append', default=[],
+                        help='Add an LFO in the format "rate,depth,target[,sync[,phase[,spread]]]", where target is '
+                             f'one of {", ".join(LFO_TARGETS)} and sync one of {", ".join(LFO_SYNC_MODES)} (default '
+                             'key). Phase and spread, the phase added per note, are in cycles. Not supported by the '
+                             'fused engine'
+                        )
+    parser.add_argument('--modulation-quality', choices=MODULATION_QUALITIES, default='full',
+                        help='How often the voicebank, additive and sampler engines evaluate envelopes and LFOs: '
+                             'every sample (full), or every 16 (high), 32 (medium) or 64 (low) samples, interpolated '
+                             'linearly in between (default: full)')
+
+    # Stereo
+    parser.add_argument('--stereo', action='store_true', help='Render, play and write two channels')
+    parser.add_argument('--pan', type=float, default=0., help='Where notes sit, from -1 (left) to 1 (right)')
+    parser.add_argument('--pan-spread', type=float, default=0.,
+                        help='Pan added across the keyboard, from -spread at the lowest note to +spread at the highest')
+    parser.add_argument('--stereo-width', type=float, default=0.,
+                        help='How far harmonics fan out to alternate sides of their note, up to 1 (voicebank and '
+                             'additive engines)')
+
+    # Sample bank
+    parser.add_argument('--sample-bank', type=str, metavar='FILE', help='Sample bank file the sampler engine plays')
+    parser.add_argument('--build-sample-bank', action='store_true',
+                        help='Render every MIDI note of the timbre into --sample-bank on --workers processes, '
+                             'then exit')
+    parser.add_argument('--velocity-layers', type=int, nargs='+', default=[127],
+                        help='Velocities a sample bank renders each note at; notes play the nearest layer above')
+    parser.add_argument('--loop-seconds', type=float, default=.5, help='Length of the sustain loop of a sample bank')
+
+    # Reverb arguments
+    parser.add_argument('--reverb', type=str, metavar='FILE', help='Convolve the output with this WAV impulse response')
+    parser.add_argument('--reverb-wet', type=float, default=.3, help='Level of the reverberated signal')
+    parser.add_argument('--reverb-dry', type=float, default=1., help='Level of the direct signal under reverb')
 
     # Toggle options
     parser.add_argument('--disable-speaker', action='store_true', help='Disable output to speaker')
+    parser.add_argument('--playback', choices=PLAYBACK_BACKENDS, default='callback',
+                        help='Feed the speaker from a ring buffer in the device callback, '
+                             'or write each chunk from a new thread')
+    parser.add_argument('--buffer-chunks', type=int, default=4,
+                        help='Chunks the renderer may run ahead of the speaker in callback playback')
+    parser.add_argument('--prefill-chunks', type=int, default=2,
+                        help='Chunks to queue before callback playback starts')
+    parser.add_argument('--render-process', action='store_true',
+                        help='Render in a worker process that hands chunks over through shared memory')
+    parser.add_argument('--process-buffer-chunks', type=int, default=4,
+                        help='Chunks the render process may run ahead of playback, which adds as much MIDI latency')
     parser.add_argument('--output', type=str, help='Filename for the output file')
+    parser.add_argument('--output-format', choices=FILE_FORMATS,
+                        help='16-bit or 32-bit float WAV, or headerless float32 samples (default: int16, or float32 '
+                             'with --output-mmap)')
+    parser.add_argument('--output-mmap', action='store_true',
+                        help='Write float32 samples straight into a memory-mapped output file')
+    parser.add_argument('--output-sparse', action='store_true',
+                        help='Skip over silent chunks in the output file, leaving holes that read as zeros')
 
     # MIDI handler argument
     parser.add_argument('--port-name', type=str, default='IAC Driver Bus 1', help='MIDI input port name')
 
+    # Offline rendering
+    parser.add_argument('--render-midi', type=str, help='Render this MIDI file to --output instead of playing live')
+    parser.add_argument('--split', choices=SPLIT_MODES, default='none',
+                        help='Split a MIDI render into segments per track or per time window')
+    parser.add_argument('--segment-seconds', type=float, default=10., help='Length of a time window segment')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes rendering segments')
+
+    # Profiling
+    parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+                        help='Report where the render time goes every --profile-interval seconds, printed to the '
+                             'console, or appended as JSON lines to FILE')
+    parser.add_argument('--profile-interval', type=float, default=5., help='Seconds between profile reports')
+    parser.add_argument('--profile-allocations', action='store_true',
+                        help='Also measure memory allocated per chunk, which slows rendering down')
+    return parser
+
+
+def apply_template(args, template: str, provided_args=frozenset()):
+    for key, value in load_template(template).items():
+        key = key.replace('-', '_')
+        if key not in provided_args:
+            setattr(args, key, value)
+
+
+def parse_args():
+    parser = build_parser()
     parser, user_args = parser, parser.parse_args()
     user_args, unknown = parser.parse_known_args()
     provided_args = {arg for arg in vars(user_args) if getattr(user_args, arg) != parser.get_default(arg)}
 
     # Load template if specified
     if user_args.template:
-        template_settings = load_template(user_args.template)
-        for key, value in template_settings.items():
-            if key not in provided_args:
-                setattr(user_args, key, value)
+        apply_template(user_args, user_args.template, provided_args)
 
+    if user_args.output_format is None:
+        user_args.output_format = 'float32' if user_args.output_mmap else 'int16'
+    elif user_args.output_mmap and user_args.output_format == 'int16':
+        parser.error('--output-mmap writes float32 or raw samples; use --output-format float32 or raw')
+    if user_args.patch_cache and (user_args.render_midi or user_args.build_sample_bank):
+        parser.error('--patch-cache only serves live starts; --render-midi and --build-sample-bank compute their '
+                     'tables afresh, in each of their worker processes')
+    if user_args.split != 'none' and user_args.max_voices:
+        parser.error('--split renders each segment on its own synthesizer, which cannot keep to --max-voices')
+    if user_args.adaptive_latency:
+        if unsupported := sorted(rendering_engines(user_args).difference(VARIABLE_BLOCK_ENGINES)):
+            hint = ', or raise --additive-threshold' if user_args.engine in VARIABLE_BLOCK_ENGINES else ''
+            parser.error(f'--adaptive-latency renders blocks of any length, which the {" and ".join(unsupported)} '
+                         f'engine cannot; use --engine voicebank or sampler{hint}')
+    if user_args.modulation_quality != 'full':
+        if unsupported := sorted(rendering_engines(user_args).difference(CONTROL_RATE_ENGINES)):
+            parser.error(f'--modulation-quality {user_args.modulation_quality} evaluates modulation at control points, '
+                         f'which the {" and ".join(unsupported)} engine cannot; use --engine voicebank, additive or '
+                         f'sampler')
     return user_args
 
 
+def rendering_engines(args) -> set[str]:
+    """The engines the channels' timbres, or the single timbre, are rendered on"""
+    timbres = [config.timbre for config in create_channels(args)] or [create_timbre(args)]
+    return {select_engine(args.engine, timbre, args.additive_threshold) for timbre in timbres}
+
+
 def _parse_harmonics(args):
     harmonics = []
     if args.harmonic:
@@ -73,6 +237,22 @@ def _parse_harmonics(args):
     return harmonics
 
 
+def _parse_lfos(args):
+    lfos = []
+    for lfo in args.lfo or ():
+        fields = lfo.split(',')
+        if not 3 <= len(fields) <= 6:
+            raise ValueError(f'Invalid LFO "{lfo}"; expected "rate,depth,target[,sync[,phase[,spread]]]"')
+        fields += ['key', '0', '0'][len(fields) - 3:]
+        rate, depth, target, sync, phase, spread = fields
+        if target not in LFO_TARGETS or sync not in LFO_SYNC_MODES:
+            raise ValueError(f'Invalid LFO "{lfo}"; target must be one of {LFO_TARGETS} and sync one of '
+                             f'{LFO_SYNC_MODES}')
+        lfos.append(LFO(rate=float(rate), depth=float(depth), target=target, sync=sync, phase=float(phase),
+                        spread=float(spread)))
+    return lfos
+
+
 def create_timbre(args):
     return Timbre(
         envelope=ADSRProfile(
@@ -82,39 +262,201 @@ def create_timbre(args):
             sustain=args.sustain,
             release=args.release,
             sustain_till_close=not args.sustain,
+            floor=args.silence_floor,
         ),
         vibrato=Vibrato(rate=args.vibrato_rate,
                         depth=args.vibrato_depth) if args.vibrato_rate and args.vibrato_depth else None,
         tremolo=Tremolo(rate=args.tremolo_rate,
                         depth=args.tremolo_depth) if args.tremolo_rate and args.tremolo_depth else None,
-        harmonics=tuple(_parse_harmonics(args))
+        harmonics=tuple(_parse_harmonics(args)),
+        lfos=tuple(_parse_lfos(args)),
+        oscillator=args.oscillator,
+        spectrum=tuple(float(amplitude) for amplitude in args.spectrum.split(',') if amplitude)
     )
 
 
-def main():
-    args = parse_args()
+def create_polyphony(args) -> Polyphony | None:
+    if not args.max_voices and not args.adaptive_polyphony:
+        return None
+    return Polyphony(max_voices=args.max_voices, steal=args.steal, fade=args.steal_fade,
+                     adaptive=args.adaptive_polyphony, budget=args.cpu_budget)
 
-    note_factory = MusicNoteFactory(
-        sample_rate=args.sample_rate,
-        chunk_size=args.chunk_size,
-        timbre=create_timbre(args)
-    )
 
-    stream = SynthesizerStream(
-        note_factory=note_factory,
-        midi_handler=MidiInputHandler(port_name=args.port_name),
+def create_panning(args) -> Panning:
+    return Panning(position=args.pan, spread=args.pan_spread, width=args.stereo_width)
+
+
+def create_channels(args) -> tuple[ChannelConfig, ...]:
+    channels = []
+    for entry in args.channel:
+        channel, template, *volume = entry.split(',')
+        channel_args = build_parser().parse_args([])
+        apply_template(channel_args, template)
+        channels.append(ChannelConfig(
+            channel=int(channel),
+            timbre=create_timbre(channel_args),
+            volume=float(volume[0]) if volume else channel_args.volume,
+            panning=create_panning(channel_args) if args.stereo else None
+        ))
+    return tuple(channels)
+
+
+def voice_pool_size(args) -> int:
+    if args.voice_pool is not None:
+        return args.voice_pool
+    return args.max_voices or 16
+
+
+def create_stream(args, midi_handler: MidiInput, chunk_size: int | None = None):
+    chunk_size = chunk_size or args.chunk_size
+    sample_bank = SampleBank(args.sample_bank) if args.engine == 'sampler' and args.sample_bank else None
+    if channels := create_channels(args):
+        return create_multichannel_synthesizer(channels, args.sample_rate, chunk_size, engine=args.engine,
+                                               midi_handler=midi_handler, workers=args.threads,
+                                               polyphony=create_polyphony(args), voice_pool=voice_pool_size(args),
+                                               additive_threshold=args.additive_threshold, sample_bank=sample_bank,
+                                               control_period=MODULATION_QUALITIES[args.modulation_quality],
+                                               panning=create_panning(args) if args.stereo else None)
+    return create_synthesizer(
+        timbre=create_timbre(args),
         sample_rate=args.sample_rate,
-        chunk_size=args.chunk_size
+        chunk_size=chunk_size,
+        engine=args.engine,
+        midi_handler=midi_handler,
+        polyphony=create_polyphony(args),
+        voice_pool=voice_pool_size(args),
+        additive_threshold=args.additive_threshold,
+        sample_bank=sample_bank,
+        control_period=MODULATION_QUALITIES[args.modulation_quality],
+        panning=create_panning(args) if args.stereo else None,
+        volume=args.volume
     )
-    stream = MultiplyAudioStreamDecorator(stream, multiplier=args.volume)
-    if not args.disable_speaker:
-        stream = AudioPlaybackDecorator(stream)
+
+
+def apply_volume(args, synth, stream):
+    """Scales 'stream' by --volume, unless the synthesizer already renders its notes at it"""
+    if synth.applies_volume:
+        return stream
+    return MultiplyAudioStreamDecorator(stream, multiplier=args.volume)
+
+
+def add_reverb(args, stream):
+    if not args.reverb:
+        return stream
+    impulse_response = load_impulse_response(args.reverb, args.sample_rate, args.chunk_size)
+    return ConvolutionReverbDecorator(stream, impulse_response, wet=args.reverb_wet, dry=args.reverb_dry)
+
+
+def render_chunk_size(args) -> int:
+    """The chunk size the synthesizer renders at, which with --adaptive-latency is the largest block"""
+    if not args.adaptive_latency:
+        return args.chunk_size
+    return block_sizes(args.chunk_size, args.sample_rate, args.min_latency, args.max_latency)[-1]
+
+
+def compile_patch(args):
+    if not args.patch_cache:
+        return nullcontext()
+    return compiled_patch(args.patch_cache, create_timbre(args), create_channels(args), args.engine, args.sample_rate,
+                          render_chunk_size(args), args.additive_threshold)
+
+
+def create_render_chain(args, midi_handler: MidiInput):
+    with compile_patch(args):
+        if not args.adaptive_latency:
+            synth = create_stream(args, midi_handler=midi_handler)
+            return synth, add_reverb(args, apply_volume(args, synth, synth))
+
+        # The synthesizer renders blocks of up to the largest size, reblocked into chunks before the effects
+        source = create_stream(args, midi_handler=midi_handler, chunk_size=render_chunk_size(args))
+        synth = AdaptiveBlockStream(source, args.chunk_size, min_latency=args.min_latency,
+                                    max_latency=args.max_latency, budget=args.latency_budget, output=sys.stdout)
+        return synth, add_reverb(args, apply_volume(args, source, synth))
+
+
+def create_profiler(args, voices=None, buffer=None):
+    if not args.profile:
+        return nullcontext()
+    json_lines = args.profile != '-'
+    return Profiler(args.sample_rate, args.chunk_size, voices=voices, buffer=buffer,
+                    allocations=args.profile_allocations,
+                    output=open(args.profile, 'a') if json_lines else sys.stdout, json_lines=json_lines,
+                    interval=args.profile_interval)
+
+
+def render_file(args):
+    if not args.output:
+        raise SystemExit('--render-midi needs an --output file')
+
+    started = time.perf_counter()
+    settings = RenderSettings(timbre=create_timbre(args), sample_rate=args.sample_rate, chunk_size=args.chunk_size,
+                              engine=args.engine, channels=create_channels(args), threads=args.threads,
+                              polyphony=create_polyphony(args), additive_threshold=args.additive_threshold,
+                              sample_bank=args.sample_bank if args.engine == 'sampler' else None,
+                              control_period=MODULATION_QUALITIES[args.modulation_quality],
+                              panning=create_panning(args) if args.stereo else None)
+    with create_profiler(args):
+        samples = render_midi(read_midi_file(args.render_midi, args.sample_rate), settings, split=args.split,
+                              window_seconds=args.segment_seconds, workers=args.workers)
+
+        stream = ArrayStream(samples, chunk_size=args.chunk_size, sample_rate=args.sample_rate)
+        stream = add_reverb(args, MultiplyAudioStreamDecorator(stream, multiplier=args.volume))
+        stream = AudioFileOutputDecorator(stream, filename=args.output, file_format=args.output_format,
+                                          memory_mapped=args.output_mmap, frames=len(samples),
+                                          sparse=args.output_sparse)
+        stream.run()
+    print(f'Rendered {len(samples) / args.sample_rate:.1f}s of audio in {time.perf_counter() - started:.1f}s')
+
+
+def build_bank(args):
+    if not args.sample_bank:
+        raise SystemExit('--build-sample-bank needs a --sample-bank file')
+
+    started = time.perf_counter()
+    bank = build_sample_bank(create_timbre(args), args.sample_bank, args.sample_rate,
+                             velocities=tuple(args.velocity_layers), loop_seconds=args.loop_seconds,
+                             workers=args.workers)
+    print(f'Rendered {len(bank.samples) / args.sample_rate:.1f}s of samples into {args.sample_bank} '
+          f'in {time.perf_counter() - started:.1f}s')
+
+
+def main():
+    args = parse_args()
+    if args.build_sample_bank:
+        return build_bank(args)
+    if args.render_midi:
+        return render_file(args)
+
+    midi_handler = MidiInputHandler(port_name=args.port_name)
+    if args.render_process:
+        synth = stream = load_backend(RENDER_PROCESS)(partial(create_render_chain, args), args.sample_rate,
+                                                      args.chunk_size, buffer_chunks=args.process_buffer_chunks,
+                                                      midi_handler=midi_handler,
+                                                      channels=STEREO if args.stereo else 1)
+    else:
+        synth, stream = create_render_chain(args, midi_handler)
+    playback = None if args.disable_speaker else load_backend(PLAYBACK_BACKENDS[args.playback])
+    if playback and args.playback == 'callback':
+        buffer_chunks = args.buffer_chunks
+        if args.adaptive_latency:
+            # Room for the chunks played while the largest block renders
+            buffer_chunks = max(buffer_chunks, render_chunk_size(args) // args.chunk_size + 1)
+        stream = playback(stream, buffer_chunks=buffer_chunks, prefill_chunks=args.prefill_chunks)
+    elif playback:
+        stream = playback(stream)
 
     if args.output:
-        stream = AudioFileOutputDecorator(stream, filename=args.output)
+        stream = AudioFileOutputDecorator(stream, filename=args.output, file_format=args.output_format,
+                                          memory_mapped=args.output_mmap, sparse=args.output_sparse)
 
     print('Started the Synth!')
-    stream.run()
+    try:
+        with create_profiler(args, voices=lambda: synth.voice_count,
+                             buffer=(lambda: synth.fill) if args.render_process else None):
+            stream.run()
+    finally:
+        synth.close()
+        midi_handler.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+import numpy as np
+from mido import Message
+
+from src.dataclasses import ADSRProfile, Harmonic, Timbre, Tremolo, Vibrato
+from src.synth import create_synthesizer
+
+SAMPLE_RATE = 22050
+CHUNK_SIZE = 512
+HOP = 128  # The additive engine's frame hop at this chunk size
+ONSETS, RELEASES = (37, 1148, 2259), (11025, 11802, 12579)
+
+envelope = ADSRProfile(attack=.02, decay=.1, sustain_amplitude=.8, release=.2, sustain_till_close=True)
+# Partials falling off with their number, the upper ones fading out after a shorter sustain time each
+organ = Timbre(envelope, vibrato=Vibrato(rate=5., depth=.02), tremolo=Tremolo(rate=6., depth=.05),
+               harmonics=tuple(Harmonic(k, 1 / k, None if k <= 8 else .2 + 2 / k) for k in range(1, 41)))
+
+
+def render(engine: str) -> np.ndarray:
+    """Low notes, so that no partial goes past Nyquist, where the streams engine aliases and additive leaves it out"""
+    synth = create_synthesizer(organ, SAMPLE_RATE, CHUNK_SIZE, engine=engine, additive_threshold=0)
+    for note, onset, release in zip((28, 35, 40), ONSETS, RELEASES):
+        synth.schedule(Message('note_on', note=note, velocity=100), onset)
+        synth.schedule(Message('note_off', note=note), release)
+    return np.concatenate([next(synth).copy() for _ in range(SAMPLE_RATE // CHUNK_SIZE)])
+
+
+def relative_error(samples: np.ndarray, reference: np.ndarray) -> float:
+    return float(np.sqrt(np.mean(np.square(samples - reference)) / np.mean(np.square(reference))))
+
+
+def test_additive_engine_sounds_like_streams():
+    streams, additive = render('streams'), render('additive')
+    assert relative_error(additive, streams) < 1e-2
+
+    # Frames interpolate amplitudes over one hop, which only smooths the corners where notes start, end their decay,
+    # lose a partial or release; in between the engines agree closely
+    steady = slice(ONSETS[-1] + int((envelope.attack + envelope.decay) * SAMPLE_RATE) + HOP, RELEASES[0] - HOP)
+    assert relative_error(additive[steady], streams[steady]) < 3e-4
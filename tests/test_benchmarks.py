@@ -0,0 +1,50 @@
+import json
+import sys
+
+import pytest
+
+from benchmarks import latency, suite
+from benchmarks.kernels import TIMBRES
+
+TINY = ('--components', 'sine', 'synth', '--engines', 'voicebank', '--voices', '2', '--harmonics', '2',
+        '--chunk-sizes', '64', '--sample-rates', '8000', '--min-time', '.005', '--rounds', '1')
+
+
+def run_suite(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['suite.py', *TINY, *args])
+    suite.main()
+
+
+def test_suite_compares_with_a_saved_baseline(monkeypatch, capsys, tmp_path):
+    saved = tmp_path / 'baseline.json'
+    run_suite(monkeypatch, '--output', str(saved))
+    results = json.loads(saved.read_text())['results']
+    assert set(results) == {'sine chunk_size=64 sample_rate=8000',
+                            'synth/voicebank voices=2 harmonics=2 chunk_size=64 sample_rate=8000'}
+
+    # A baseline far slower than this run is no regression, while one far faster is one for every case
+    for filename, scale in (('slow.json', .01), ('fast.json', 100)):
+        baseline = {name: {**result, 'chunks_per_second': result['chunks_per_second'] * scale}
+                    for name, result in results.items()}
+        (tmp_path / filename).write_text(json.dumps({'results': baseline}))
+    capsys.readouterr()
+    run_suite(monkeypatch, '--baseline', str(tmp_path / 'slow.json'))
+    assert 'Regressions' not in capsys.readouterr().out
+
+    with pytest.raises(SystemExit) as exit_info:
+        run_suite(monkeypatch, '--baseline', str(tmp_path / 'fast.json'))
+    assert exit_info.value.code == 1
+    output = capsys.readouterr().out
+    assert output.count('of the baseline throughput') == len(results)
+
+
+def test_latency_harness_reports_pooled_and_fresh_voices(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['latency.py', '--sample-rate', '8000', '--chunk_size', '64', '--timbre', 'sine',
+                                      '--notes', '20', '--voice-pool', '4'])
+    latency.main()  # Which first checks that pooled voices sound like fresh ones
+    output = capsys.readouterr().out.splitlines()
+    assert [line.split()[0] for line in output] == ['streams:', 'no', 'pool', 'fused:', 'no', 'pool']
+    assert all('p50' in line and 'p99' in line for line in output if line.startswith('  '))
+
+    latencies = latency.first_chunk_latency('fused', TIMBRES['sine'], 4, 20, 8000, 64)
+    assert latencies.shape == (20,) and (latencies > 0).all()
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src.buffers import RingBuffer
+from src.inputs import ArrayStream
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 4
+
+
+def test_ring_buffer_wraps_around():
+    buffer = RingBuffer(10)
+    assert buffer.write(np.arange(7, dtype=np.float32))
+    out = np.zeros(5, dtype=np.float32)
+    assert buffer.read_into(out) == 5
+
+    # The next write runs past the end of the ring and continues at its start
+    assert buffer.write(np.arange(7, 13, dtype=np.float32))
+    assert buffer.peek(6) is None
+    out = np.zeros(8, dtype=np.float32)
+    assert buffer.read_into(out) == 8
+    np.testing.assert_array_equal(out, np.arange(5, 13))
+
+
+def test_ring_buffer_refuses_writes_when_full_and_reads_nothing_when_empty():
+    buffer = RingBuffer(8)
+    out = np.full(4, -1, dtype=np.float32)
+    assert buffer.read_into(out) == 0
+    np.testing.assert_array_equal(out, -1)
+
+    assert buffer.write(np.ones(6, dtype=np.float32))
+    assert not buffer.write(np.ones(3, dtype=np.float32))
+    assert buffer.available == 6 and buffer.free == 2
+    assert buffer.write(np.ones(2, dtype=np.float32))
+    assert buffer.free == 0
+
+    # A short read returns what there is, and makes room for as much
+    out = np.zeros(10, dtype=np.float32)
+    assert buffer.read_into(out) == 8
+    assert buffer.available == 0 and buffer.free == 8
+
+
+def test_ring_buffer_keeps_frames_of_several_channels_together():
+    buffer = RingBuffer(4, channels=2)
+    frames = np.arange(12, dtype=np.float32).reshape(6, 2)
+    assert buffer.write(frames[:3])
+    buffer.consume(2)
+    assert buffer.write(frames[3:])
+    out = np.zeros((4, 2), dtype=np.float32)
+    assert buffer.read_into(out) == 4
+    np.testing.assert_array_equal(out, frames[2:])
+
+
+class FakeOutputStream:
+    """Stands in for the device; the test runs its callback"""
+
+    def __init__(self, sample_rate, channels, dtype, blocksize, callback):
+        self.active = False
+
+    def start(self):
+        self.active = True
+
+    def close(self):
+        self.active = False
+
+
+def test_callback_playback_counts_one_underrun_per_short_callback(monkeypatch):
+    try:
+        from src import playback
+    except (ImportError, OSError) as error:  # sounddevice, or the PortAudio library it loads
+        pytest.skip(str(error))
+    monkeypatch.setattr(playback.sd, 'OutputStream', FakeOutputStream)
+    samples = np.linspace(-2, 2, 3 * CHUNK_SIZE, dtype=np.float32)
+    stream = playback.AudioCallbackPlaybackDecorator(ArrayStream(samples, CHUNK_SIZE, SAMPLE_RATE), buffer_chunks=4)
+    for _ in range(3):
+        next(stream)
+
+    fine, underflow = SimpleNamespace(output_underflow=False), SimpleNamespace(output_underflow=True)
+    played = []
+    for status in (fine, fine, underflow, fine):
+        outdata = np.full((CHUNK_SIZE, 1), 9, dtype=np.float32)
+        stream._callback(outdata, CHUNK_SIZE, None, status)
+        played.append(outdata[:, 0])
+
+    # Clipped as it plays, then one underrun for the device's underflow and one for the callback finding nothing
+    np.testing.assert_array_equal(np.concatenate(played[:3]), np.clip(samples, -1, 1))
+    np.testing.assert_array_equal(played[3], 0)
+    assert stream.underruns == 2
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from src.convolution import PartitionedConvolver, PartitionedImpulseResponse, decaying_noise
+from src.effects import ConvolutionReverbDecorator
+from src.inputs import ArrayStream
+
+SAMPLE_RATE = 8000
+BLOCK_SIZE = 64
+TOLERANCE = 2e-6  # float32 spectra, summed over the partitions
+
+
+def unit_energy(samples: np.ndarray) -> np.ndarray:
+    return samples / np.sqrt(np.sum(np.square(samples, dtype=np.float64)))
+
+
+def convolve_blocks(convolver: PartitionedConvolver, samples: np.ndarray) -> np.ndarray:
+    return np.concatenate([convolver.process(samples[start:start + BLOCK_SIZE])
+                           for start in range(0, len(samples), BLOCK_SIZE)])
+
+
+@pytest.mark.parametrize('length', (1, BLOCK_SIZE, 5 * BLOCK_SIZE + 17))
+def test_partitioned_convolution_matches_direct_convolution(length):
+    rng = np.random.default_rng(3)
+    response = decaying_noise(length / SAMPLE_RATE, SAMPLE_RATE) if length > 1 else np.ones(1, dtype=np.float32)
+    signal = np.zeros(12 * BLOCK_SIZE, dtype=np.float32)
+    signal[:6 * BLOCK_SIZE] = rng.uniform(-1, 1, 6 * BLOCK_SIZE)
+
+    convolver = PartitionedConvolver(PartitionedImpulseResponse(response, BLOCK_SIZE))
+    expected = np.convolve(signal.astype(np.float64), unit_energy(response))[:len(signal)]
+    np.testing.assert_allclose(convolve_blocks(convolver, signal), expected, rtol=0, atol=TOLERANCE)
+
+
+def test_channels_are_convolved_apart():
+    rng = np.random.default_rng(4)
+    response = decaying_noise(3.5 * BLOCK_SIZE / SAMPLE_RATE, SAMPLE_RATE)
+    frames = rng.uniform(-1, 1, (10 * BLOCK_SIZE, 2)).astype(np.float32)
+    frames[:, 1] *= .25
+    frames[4 * BLOCK_SIZE:, 1] = 0
+
+    stereo = convolve_blocks(PartitionedConvolver(PartitionedImpulseResponse(response, BLOCK_SIZE), 2), frames)
+    assert stereo.shape == frames.shape
+    for channel in range(2):
+        mono = convolve_blocks(PartitionedConvolver(PartitionedImpulseResponse(response, BLOCK_SIZE)),
+                               np.ascontiguousarray(frames[:, channel]))
+        np.testing.assert_allclose(stereo[:, channel], mono, rtol=0, atol=TOLERANCE)
+
+
+def test_reverb_tail_plays_out_after_the_stream_ends():
+    response = decaying_noise(3.5 * BLOCK_SIZE / SAMPLE_RATE, SAMPLE_RATE)
+    impulse = np.zeros(2 * BLOCK_SIZE, dtype=np.float32)
+    impulse[10] = 1
+    reverb = ConvolutionReverbDecorator(ArrayStream(impulse, BLOCK_SIZE, SAMPLE_RATE),
+                                        PartitionedImpulseResponse(response, BLOCK_SIZE), wet=.5, dry=1.)
+    output = np.concatenate([chunk.copy() for chunk in reverb])
+
+    # The stream's two blocks, then one block per partition of the tail
+    assert len(output) == (2 + 4) * BLOCK_SIZE
+    expected = np.zeros(len(output))
+    expected[10:10 + len(response)] = .5 * unit_energy(response)
+    expected[10] += 1
+    np.testing.assert_allclose(output, expected, rtol=0, atol=TOLERANCE)
@@ -0,0 +1,42 @@
+import numpy as np
+
+from src.dataclasses import ADSRProfile
+from src.envelopes import envelope_table
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 256
+
+
+def profile_with(attack: float) -> ADSRProfile:
+    return ADSRProfile(attack=attack, decay=.2, sustain_amplitude=.7, release=.3, sustain=.5)
+
+
+def test_envelope_tables_are_shared_until_evicted():
+    envelope_table.cache_clear()
+    profile = ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3, sustain_till_close=True)
+    table = envelope_table(profile, SAMPLE_RATE, CHUNK_SIZE)
+
+    # Equal profiles share a table, whose chunks are read-only views rather than copies
+    assert envelope_table(ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3,
+                                      sustain_till_close=True), SAMPLE_RATE, CHUNK_SIZE) is table
+    assert envelope_table.cache_info().hits == 1
+    assert not table.chunk(0, None).flags.writeable
+    assert np.shares_memory(table.chunk(SAMPLE_RATE, None), table.chunk(2 * SAMPLE_RATE, None))
+
+    # Any other sample rate or chunk size is a table of its own
+    assert envelope_table(profile, SAMPLE_RATE * 2, CHUNK_SIZE) is not table
+    assert envelope_table(profile, SAMPLE_RATE, CHUNK_SIZE * 2) is not table
+
+    # Least recently used tables go first, so a table kept in use survives as many others
+    for attack in range(1, envelope_table.cache_info().maxsize):
+        envelope_table(profile, SAMPLE_RATE, CHUNK_SIZE)
+        envelope_table(profile_with(attack / 100), SAMPLE_RATE, CHUNK_SIZE)
+    assert envelope_table(profile, SAMPLE_RATE, CHUNK_SIZE) is table
+    assert envelope_table.cache_info().currsize == envelope_table.cache_info().maxsize
+
+    envelope_table(profile_with(1.), SAMPLE_RATE, CHUNK_SIZE)
+    envelope_table(profile_with(2.), SAMPLE_RATE, CHUNK_SIZE)
+    assert envelope_table(profile, SAMPLE_RATE, CHUNK_SIZE) is table
+    misses = envelope_table.cache_info().misses
+    envelope_table(profile, SAMPLE_RATE * 2, CHUNK_SIZE)
+    assert envelope_table.cache_info().misses == misses + 1
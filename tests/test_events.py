@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from mido import Message
+
+from src.dataclasses import ADSRProfile, Timbre
+from src.events import MidiEventQueue
+from src.synth import create_synthesizer
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 256
+ATTACK, RELEASE = 80, 160  # In samples
+
+timbre = Timbre(ADSRProfile(attack=ATTACK / SAMPLE_RATE, decay=.01, sustain_amplitude=.7,
+                            release=RELEASE / SAMPLE_RATE, sustain_till_close=True))
+
+
+def test_scheduled_messages_drain_at_their_offset_into_the_chunk():
+    events = MidiEventQueue(SAMPLE_RATE, CHUNK_SIZE)
+    on, off = Message('note_on', note=60), Message('note_off', note=60)
+    events.put(on, 100)
+    events.put(off, CHUNK_SIZE + 17)
+
+    assert events.drain(0) == [(100, on)]
+    assert events.pending == 1
+    # A shorter block ends before the note off, which lands at its offset into the block it falls in
+    assert events.drain(CHUNK_SIZE, 10) == []
+    assert events.drain(CHUNK_SIZE + 10) == [(7, off)]
+    # Late messages apply at the start of the next chunk
+    events.put(on, 5)
+    assert events.drain(2 * CHUNK_SIZE) == [(0, on)]
+
+
+@pytest.mark.parametrize('engine', ('streams', 'fused', 'voicebank'))
+@pytest.mark.parametrize('onset, release', ((100, CHUNK_SIZE + 17), (CHUNK_SIZE - 1, 3 * CHUNK_SIZE)))
+def test_notes_start_and_release_at_their_sample(engine, onset, release):
+    synth = create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE, engine=engine)
+    synth.schedule(Message('note_on', note=69, velocity=127), onset)
+    synth.schedule(Message('note_off', note=69), release)
+    samples = np.concatenate([next(synth).copy() for _ in range(6)])
+
+    # The attack and the sine both start from 0 at the onset, and the release ramp reaches 0 after RELEASE samples
+    assert not samples[:onset + 1].any()
+    assert samples[onset + 1] != 0
+    ends = release + RELEASE
+    assert np.abs(samples[ends - 20:ends - 1]).max() > 0
+    assert not samples[ends:].any()
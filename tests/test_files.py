@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from src import files
+from src.files import AudioFileWriter, MemoryMappedAudioFile, read_wav
+
+SAMPLE_RATE = 8000
+
+
+def chunks(channels: int = 1) -> list[np.ndarray]:
+    """Chunks of odd lengths, so batches and the map fill up mid-chunk"""
+    rng = np.random.default_rng(5)
+    return [rng.uniform(-1, 1, (length, channels) if channels > 1 else length).astype(np.float32)
+            for length in (100, 37, 300, 1, 250)]
+
+
+def write(writer, chunks: list[np.ndarray], hole: int = 0) -> np.ndarray:
+    """Writes 'chunks' with 'hole' frames skipped after the second, and returns what the file should hold"""
+    expected = []
+    for index, chunk in enumerate(chunks):
+        writer.write(chunk)
+        expected.append(chunk)
+        if index == 1 and hole:
+            writer.skip(hole)
+            expected.append(np.zeros((hole,) + chunk.shape[1:], dtype=np.float32))
+    writer.close()
+    return np.concatenate(expected)
+
+
+@pytest.mark.parametrize('hole', (0, 123))
+def test_float_wav_round_trip(tmp_path, hole):
+    filename = str(tmp_path / 'out.wav')
+    expected = write(AudioFileWriter(filename, SAMPLE_RATE, 'float32', batch_frames=128, queue_batches=2),
+                     chunks(), hole)
+    samples, sample_rate = read_wav(filename)
+    assert sample_rate == SAMPLE_RATE
+    np.testing.assert_array_equal(samples, expected)
+
+
+def test_int16_wav_round_trip(tmp_path):
+    filename = str(tmp_path / 'out.wav')
+    expected = write(AudioFileWriter(filename, SAMPLE_RATE, 'int16', batch_frames=128), chunks(), 50)
+    samples, _ = read_wav(filename)
+    np.testing.assert_allclose(samples, expected, rtol=0, atol=1 / (1 << 14))
+
+
+@pytest.mark.parametrize('channels', (1, 2))
+def test_raw_round_trip_interleaves_channels(tmp_path, channels):
+    filename = tmp_path / 'out.raw'
+    expected = write(AudioFileWriter(str(filename), SAMPLE_RATE, 'raw', batch_frames=128, channels=channels),
+                     chunks(channels), 123)
+    np.testing.assert_array_equal(np.fromfile(filename, dtype='<f4'), expected.ravel())
+
+
+@pytest.mark.parametrize('file_format', ('float32', 'raw'))
+@pytest.mark.parametrize('channels', (1, 2))
+def test_memory_mapped_round_trip_grows_the_map(tmp_path, file_format, channels):
+    filename = tmp_path / 'out.wav'
+    writer = MemoryMappedAudioFile(str(filename), SAMPLE_RATE, frames=64, file_format=file_format, channels=channels)
+    expected = write(writer, chunks(channels), 500)
+    if file_format == 'raw':
+        samples = np.fromfile(filename, dtype='<f4')
+        np.testing.assert_array_equal(samples, expected.ravel())
+    else:
+        samples, _ = read_wav(str(filename))
+        np.testing.assert_array_equal(samples, expected if channels == 1 else expected.mean(axis=1))
+
+
+def test_writer_thread_errors_reach_the_caller(tmp_path, monkeypatch):
+    def fail(samples, file_format):
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(files, 'encode_samples', fail)
+    writer = AudioFileWriter(str(tmp_path / 'short.wav'), SAMPLE_RATE, 'float32', batch_frames=16)
+    writer.write(np.zeros(10, dtype=np.float32))
+    with pytest.raises(OSError, match='No space left'):
+        writer.close(timeout=5)
+    assert not writer._thread.is_alive()
+
+    # The failed thread keeps taking batches, so writing on raises its error rather than blocking on a full queue
+    writer = AudioFileWriter(str(tmp_path / 'long.wav'), SAMPLE_RATE, 'float32', batch_frames=16, queue_batches=1)
+    with pytest.raises(OSError, match='No space left'):
+        for _ in range(100):
+            writer.write(np.zeros(16, dtype=np.float32))
+    with pytest.raises(OSError, match='No space left'):
+        writer.close(timeout=5)
+    assert not writer._thread.is_alive()
@@ -0,0 +1,33 @@
+import numpy as np
+
+from src.dataclasses import ADSRProfile, Harmonic
+from src.inputs import HarmonicStream
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 256
+
+envelope = ADSRProfile(attack=.02, decay=.05, sustain_amplitude=.6, release=.05, sustain=.1)
+harmonics = (Harmonic(1, 1., None), Harmonic(2, .5, None), Harmonic(3, .3, .05))
+
+
+def render(stream: HarmonicStream) -> np.ndarray:
+    return np.concatenate([chunk.copy() for chunk in stream])
+
+
+def test_reset_harmonic_stream_reuses_its_composer():
+    stream = HarmonicStream(220., .5, harmonics, envelope, CHUNK_SIZE, SAMPLE_RATE)
+    composer = stream.composer
+    render(stream)
+    stream.reset(330., .4, offset=17)
+
+    assert stream.composer is composer
+    fresh = HarmonicStream(330., .4, harmonics, envelope, CHUNK_SIZE, SAMPLE_RATE, offset=17)
+    np.testing.assert_array_equal(render(stream), render(fresh))
+
+
+def test_reset_harmonic_stream_drops_the_playing_note():
+    stream = HarmonicStream(220., .5, harmonics, envelope, CHUNK_SIZE, SAMPLE_RATE)
+    next(stream)
+    stream.reset(330., .4)
+    fresh = HarmonicStream(330., .4, harmonics, envelope, CHUNK_SIZE, SAMPLE_RATE)
+    np.testing.assert_array_equal(render(stream), render(fresh))
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from mido import Message
+
+from src.dataclasses import ADSRProfile, Harmonic, Timbre, Tremolo, Vibrato
+from src.effects import MultiplyAudioStreamDecorator
+from src.synth import create_synthesizer
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 256
+VOLUME = .3
+TOLERANCE = 1e-5  # float32 rounding of the per-note volume against the scaled mix
+
+TIMBRES = {
+    'sine': Timbre(ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3, sustain_till_close=True),
+                   vibrato=Vibrato(rate=5.5, depth=.06), tremolo=Tremolo(rate=4., depth=.1)),
+    'harmonics': Timbre(ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3, sustain=.5),
+                        vibrato=Vibrato(rate=5.5, depth=.06), tremolo=Tremolo(rate=4., depth=.1),
+                        harmonics=(Harmonic(1, 1., None), Harmonic(2, .5, None), Harmonic(3, .3, .4))),
+    'saw': Timbre(ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3, sustain_till_close=True),
+                  tremolo=Tremolo(rate=4., depth=.1), oscillator='saw'),
+}
+
+
+def render(synth, stream=None) -> np.ndarray:
+    """Overlapping notes that start and end mid-chunk, until they have all rung out"""
+    for note in range(4):
+        synth.schedule(Message('note_on', note=48 + 5 * note, velocity=100), 37 * note)
+        synth.schedule(Message('note_off', note=48 + 5 * note), SAMPLE_RATE // 2 + 101 * note)
+    chunks = []
+    while synth.pending_events or synth.voice_count:
+        chunks.append(next(stream or synth).copy())
+        if not synth.pending_events and not synth.is_closing:
+            synth.start_closing()
+    return np.concatenate(chunks)
+
+
+@pytest.mark.parametrize('timbre', TIMBRES.values(), ids=TIMBRES.keys())
+def test_fused_kernel_renders_the_decorator_stack(timbre):
+    fused = render(create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE, engine='fused'))
+    np.testing.assert_array_equal(fused, render(create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE)))
+
+
+@pytest.mark.parametrize('timbre', TIMBRES.values(), ids=TIMBRES.keys())
+def test_fused_kernel_renders_at_its_volume(timbre):
+    fused = create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE, engine='fused', volume=VOLUME)
+    assert fused.applies_volume
+    streams = create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE, volume=VOLUME)
+    assert not streams.applies_volume
+    scaled = render(streams, MultiplyAudioStreamDecorator(streams, multiplier=VOLUME))
+    rendered = render(fused)
+    assert rendered.shape == scaled.shape
+    np.testing.assert_allclose(rendered, scaled, rtol=0, atol=TOLERANCE)
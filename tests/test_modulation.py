@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from mido import Message
+
+from src.dataclasses import ADSRProfile, Harmonic, LFO, Polyphony, Timbre, Tremolo, Vibrato
+from src.effects import lfo_wave
+from src.modulation import ModulationBus, MODULATION_QUALITIES
+from src.synth import create_synthesizer
+
+SAMPLE_RATE = 44100
+CHUNK_SIZE = 512
+# Relative RMS error each quality may have against full-rate modulation, with fast attacks and fades to stress it
+ERROR_BOUNDS = {'full': 0., 'high': 2e-4, 'medium': 1e-3, 'low': 3e-3}
+
+timbre = Timbre(envelope=ADSRProfile(attack=.02, decay=.1, sustain_amplitude=.6, release=.2, sustain_till_close=True),
+                vibrato=Vibrato(rate=5., depth=.3), tremolo=Tremolo(rate=4., depth=.2),
+                harmonics=(Harmonic(1, 1., None), Harmonic(2, .5, None), Harmonic(3, .3, .4)),
+                lfos=(LFO(rate=6., depth=.01, target='pitch'), LFO(rate=2., depth=.3, target='amplitude'),
+                      LFO(rate=3., depth=.5, target='harmonics')))
+
+
+def render_phrase(engine: str, control_period: int) -> np.ndarray:
+    """Overlapping notes that start and end mid-chunk, the oldest stolen once three sound"""
+    synth = create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE, engine=engine, additive_threshold=0,
+                               polyphony=Polyphony(max_voices=3, fade=.01), control_period=control_period)
+    for index, note in enumerate((60, 64, 67, 71, 72)):
+        synth.schedule(Message('note_on', note=note, velocity=100), 3037 * index)
+        synth.schedule(Message('note_off', note=note), 3037 * index + 20011)
+    return np.concatenate([next(synth) for _ in range(SAMPLE_RATE // CHUNK_SIZE)])
+
+
+@pytest.mark.parametrize('offset', [0, 37, 1000])
+def test_bus_lfo_matches_per_voice_sine(offset):
+    bus = ModulationBus(SAMPLE_RATE, CHUNK_SIZE)
+    reference = next(lfo_wave(5.5, 1., SAMPLE_RATE, CHUNK_SIZE, offset))
+    np.testing.assert_allclose(next(lfo_wave(5.5, 1., SAMPLE_RATE, CHUNK_SIZE, offset, bus)), reference, rtol=0,
+                               atol=1e-5)
+
+
+@pytest.mark.parametrize('engine', ['voicebank', 'additive'])
+@pytest.mark.parametrize('quality', MODULATION_QUALITIES)
+def test_control_rate_modulation_within_error_bound(engine, quality):
+    reference = render_phrase(engine, 1)
+    samples = render_phrase(engine, MODULATION_QUALITIES[quality])
+    error = np.sqrt(np.mean((samples - reference) ** 2) / np.mean(reference ** 2))
+    assert error <= ERROR_BOUNDS[quality]
+
+
+@pytest.mark.parametrize('engine', ['streams', 'fused'])
+def test_full_rate_engines_refuse_control_period(engine):
+    with pytest.raises(ValueError):
+        create_synthesizer(Timbre(timbre.envelope), SAMPLE_RATE, CHUNK_SIZE, engine=engine, control_period=32)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from mido import Message
+
+from src.dataclasses import ADSRProfile, Panning, Timbre
+from src.panning import STEREO, note_position, pan_gains
+from src.services import midi_note_to_frequency
+from src.synth import create_synthesizer
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 256
+
+timbre = Timbre(ADSRProfile(attack=.01, decay=.05, sustain_amplitude=.7, release=.1, sustain_till_close=True))
+
+
+def render(engine: str, panning: Panning | None, chunks: int = 8) -> np.ndarray:
+    synth = create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE, engine=engine, panning=panning)
+    synth.schedule(Message('note_on', note=48, velocity=100), 17)
+    rendered = [next(synth).copy() for _ in range(chunks)]
+    assert all(chunk.flags.c_contiguous for chunk in rendered)
+    return np.concatenate(rendered)
+
+
+def test_pan_gains_keep_constant_power():
+    positions = np.linspace(-1.5, 1.5, 31)
+    gains = pan_gains(positions)
+    assert gains.shape == (31, STEREO)
+    np.testing.assert_allclose((gains ** 2).sum(axis=-1), 1., atol=1e-6)
+    np.testing.assert_allclose(pan_gains([-1., 0., 1.]), [[1., 0.], [np.sqrt(.5), np.sqrt(.5)], [0., 1.]], atol=1e-6)
+    # Positions past the edges are clamped to them
+    np.testing.assert_array_equal(gains[:5], np.broadcast_to(pan_gains(-1.), (5, STEREO)))
+
+
+@pytest.mark.parametrize('engine', ('streams', 'voicebank'))
+def test_stereo_chunks_interleave_the_panned_mono_render(engine):
+    panning = Panning(position=.2, spread=.5)
+    mono, stereo = render(engine, None), render(engine, panning)
+    assert mono.shape == (8 * CHUNK_SIZE,) and stereo.shape == (8 * CHUNK_SIZE, STEREO)
+
+    # A low note sits left of the position, and each side is the mono render at its constant-power gain
+    position = note_position(panning, midi_note_to_frequency(48))
+    assert position < panning.position
+    left, right = pan_gains(position)
+    np.testing.assert_allclose(stereo, mono[:, None] * [left, right], atol=1e-6)
+    # Interleaved frames: the chunks are contiguous, so their samples alternate left and right in memory
+    flat = stereo.reshape(-1)
+    np.testing.assert_array_equal(flat[0::2], stereo[:, 0])
+    np.testing.assert_array_equal(flat[1::2], stereo[:, 1])
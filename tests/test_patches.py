@@ -0,0 +1,27 @@
+import sys
+
+import synthon
+from src.additive import AdditiveBank
+from src.patches import read_patch
+
+
+def start(monkeypatch, directory, chunk_size: int):
+    monkeypatch.setattr(sys, 'argv', ['synthon.py', '--engine', 'additive', '--patch-cache', str(directory),
+                                      '--chunk_size', str(chunk_size)])
+    synth, _ = synthon.create_render_chain(synthon.parse_args(), midi_handler=None)
+    return synth.voice_bank
+
+
+def test_patch_cache_keeps_a_patch_per_chunk_size(monkeypatch, tmp_path):
+    fft_sizes = {}
+    for chunk_size in (512, 320, 512):
+        bank = start(monkeypatch, tmp_path, chunk_size)
+        assert isinstance(bank, AdditiveBank)
+        fft_sizes[chunk_size] = bank.fft_size
+    assert fft_sizes[512] != fft_sizes[320]
+
+    # One file per chunk size, the second start at 512 mapping the first one's, each with the window it is sized for
+    patches = sorted(tmp_path.glob('*.synp'))
+    assert len(patches) == 2
+    windows = {key for patch in patches for key in read_patch(str(patch)) if key.startswith('synthesis_window')}
+    assert windows == {f'synthesis_window({fft_size},)' for fft_size in fft_sizes.values()}
@@ -0,0 +1,77 @@
+import pytest
+
+from src.dataclasses import ADSRProfile, Polyphony, Timbre
+from src.synth import create_synthesizer
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 256
+ENGINES = ('streams', 'voicebank')
+
+timbre = Timbre(ADSRProfile(attack=.01, decay=.01, sustain_amplitude=.7, release=1., sustain_till_close=True))
+# Started in this order, at these velocities; the quietest is 62, and 64 is released before another note comes in
+LOUD, QUIET, RELEASED = 60, 62, 64
+NOTES = {LOUD: 120, QUIET: 20, RELEASED: 70}
+
+
+def sounding(synth) -> set[int]:
+    """Notes that are neither fading out after being stolen or shed, nor finished"""
+    if hasattr(synth, 'voice_bank'):
+        bank = synth.voice_bank
+        return {bank._identifiers[slot] for slot in bank._stealable()}
+    return set(synth.composer._identifiers.values())
+
+
+def play(engine: str, polyphony: Polyphony):
+    synth = create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE, engine=engine, polyphony=polyphony)
+    for note, velocity in NOTES.items():
+        synth.note_on(note, velocity)
+    next(synth)
+    synth.note_off(RELEASED)
+    next(synth)
+    return synth
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('steal, stolen', (('oldest', LOUD), ('quietest', QUIET), ('released-first', RELEASED),
+                                           ('same-note', RELEASED)))
+def test_steal_policy_picks_the_voice_to_drop(engine, steal, stolen):
+    synth = play(engine, Polyphony(max_voices=3, steal=steal))
+    synth.note_on(67, 100)
+    assert sounding(synth) == set(NOTES) - {stolen} | {67}
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_same_note_retriggers_its_released_voice(engine):
+    synth = play(engine, Polyphony(steal='same-note'))
+    synth.note_on(RELEASED, 100)
+    assert sounding(synth) == set(NOTES)
+    assert synth.voice_count == len(NOTES) + 1  # The released voice fades out next to the new one
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_voices_within_the_limit_are_not_stolen(engine):
+    synth = play(engine, Polyphony(max_voices=4, steal='oldest'))
+    synth.note_on(67, 100)
+    assert sounding(synth) == set(NOTES) | {67}
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_adaptive_polyphony_sheds_released_then_quietest_voices(engine):
+    synth = play(engine, Polyphony(adaptive=True))
+    deadline = synth.budget.deadline
+
+    # One slow chunk only moves the smoothed load; sustained overload sheds at most a quarter of the voices at a time
+    synth.budget.regulate(2 * deadline, (synth,))
+    assert sounding(synth) == set(NOTES)
+    synth.budget.regulate(2 * deadline, (synth,))
+    assert sounding(synth) == set(NOTES) - {RELEASED}
+    assert synth.budget.misses == 2
+
+    # Measuring starts again from the budget, so the next slow chunk sheds the quietest held voice
+    next(synth)
+    synth.budget.regulate(2 * deadline, (synth,))
+    assert sounding(synth) == {LOUD}
+
+    # Fast chunks leave held voices alone
+    synth.budget.regulate(0., (synth,))
+    assert sounding(synth) == {LOUD}
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from mido import Message
+
+from src.dataclasses import ADSRProfile, Timbre
+from src.inputs import ArrayStream
+from src.process import RenderProcess
+from src.synth import create_synthesizer
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 64
+FRAMES = np.arange(2 * 10 * CHUNK_SIZE, dtype=np.float32).reshape(-1, 2) / 1000
+
+
+def build_frames(midi_input):
+    return SimpleNamespace(voice_count=0), ArrayStream(FRAMES, CHUNK_SIZE, SAMPLE_RATE)
+
+
+def build_synthesizer(midi_input):
+    timbre = Timbre(ADSRProfile(attack=.01, decay=.01, sustain_amplitude=.7, release=.01, sustain_till_close=True))
+    synth = create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE, midi_handler=midi_input)
+    return synth, synth
+
+
+def build_failing(midi_input):
+    raise ValueError('No such template')
+
+
+def test_render_process_hands_out_every_chunk_in_order():
+    process = RenderProcess(build_frames, SAMPLE_RATE, CHUNK_SIZE, buffer_chunks=3, channels=2)
+    try:
+        # More chunks than fit in the ring, so the worker waits for the reader as it goes round
+        chunks = [chunk.copy() for chunk in process]
+    finally:
+        process.close()
+    np.testing.assert_array_equal(np.concatenate(chunks), FRAMES)
+
+
+def test_render_process_plays_forwarded_messages():
+    process = RenderProcess(build_synthesizer, SAMPLE_RATE, CHUNK_SIZE, buffer_chunks=2)
+    try:
+        assert not next(process).any()
+        process.forward(Message('note_on', note=69, velocity=100))
+        for _ in range(100):
+            if next(process).any():
+                break
+        else:
+            pytest.fail('The forwarded note was never heard')
+        assert process.voice_count == 1
+    finally:
+        process.close()
+    assert not process.process.is_alive()
+
+
+def test_render_process_raises_the_worker_error():
+    process = RenderProcess(build_failing, SAMPLE_RATE, CHUNK_SIZE)
+    try:
+        with pytest.raises(RuntimeError, match='No such template'):
+            next(process)
+    finally:
+        process.close()
@@ -0,0 +1,71 @@
+import io
+import json
+import time
+
+import numpy as np
+
+from src.base import AudioStream, AudioStreamDecorator
+from src.blocks import AdaptiveBlockStream
+from src.dataclasses import ADSRProfile, Timbre
+from src.profiling import Profiler, format_stats
+from src.synth import VoiceBankSynthesizerStream, create_synthesizer
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 80  # A 10 ms deadline
+SLOW_CHUNKS = (1, 3)
+
+
+class SlowStream(AudioStream):
+    """Takes twice the deadline to render the chunks in SLOW_CHUNKS"""
+
+    def iterable(self):
+        for index in range(5):
+            if index in SLOW_CHUNKS:
+                time.sleep(2 * CHUNK_SIZE / SAMPLE_RATE)
+            yield np.zeros(self.chunk_size, dtype=np.float32)
+
+
+class DeviceDecorator(AudioStreamDecorator):
+    """Waits on a pretend device for longer than the deadline every chunk"""
+
+    def transform(self, stream_item):
+        time.sleep(1.5 * CHUNK_SIZE / SAMPLE_RATE)
+        return stream_item
+
+
+def test_profiler_reports_deadline_misses_without_time_spent_waiting():
+    output = io.StringIO()
+    stream = DeviceDecorator(SlowStream(SAMPLE_RATE, CHUNK_SIZE))
+    with Profiler(SAMPLE_RATE, CHUNK_SIZE, voices=lambda: 3, output=output, json_lines=True, interval=60,
+                  waiting_stages=frozenset({'DeviceDecorator'})):
+        for _ in stream:
+            pass
+
+    stats = json.loads(output.getvalue())
+    assert stats['chunks'] == 5
+    assert stats['deadline_ms'] == 10.
+    assert stats['deadline_misses'] == len(SLOW_CHUNKS)
+    assert stats['render']['max_us'] >= 20e3
+    assert stats['stages']['DeviceDecorator']['p50_us'] >= 15e3
+    assert stats['stages']['SlowStream']['calls_per_chunk'] == 1  # Not counting the call that ends the stream
+    assert stats['voices'] == {'mean': 3, 'max': 3}
+    assert f'misses {len(SLOW_CHUNKS)}' in format_stats(stats)
+
+
+def test_profiler_times_blocks_rendered_for_adaptive_latency():
+    timbre = Timbre(ADSRProfile(attack=.01, decay=.01, sustain_amplitude=.7, release=.01, sustain_till_close=True))
+    synth = create_synthesizer(timbre, SAMPLE_RATE, 4 * CHUNK_SIZE, engine='voicebank')
+    synth.note_on(69, 100)
+    stream = AdaptiveBlockStream(synth, CHUNK_SIZE, max_latency=4 * CHUNK_SIZE / SAMPLE_RATE)
+    original = VoiceBankSynthesizerStream.render_block
+
+    output = io.StringIO()
+    with Profiler(SAMPLE_RATE, CHUNK_SIZE, output=output, json_lines=True, interval=60):
+        for _ in range(8):
+            next(stream)
+    assert VoiceBankSynthesizerStream.render_block is original
+
+    # The synthesizer's blocks are a stage of their own, rather than part of the stream reblocking them into chunks
+    stages = json.loads(output.getvalue())['stages']
+    assert stages['VoiceBankSynthesizerStream']['calls_per_chunk'] == 1
+    assert stages['AdaptiveBlockStream']['calls_per_chunk'] == 1
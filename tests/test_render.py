@@ -0,0 +1,89 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+from mido import Message
+
+from src.dataclasses import ADSRProfile, ChannelConfig, Harmonic, LFO, Polyphony, Timbre, Tremolo, Vibrato
+from src.midi import TimedMessage
+from src.render import RenderSettings, plan_segments, render_midi
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 256
+SPLIT_TOLERANCE = 1e-5  # As the README states for --split
+
+timbre = Timbre(ADSRProfile(attack=.05, decay=.1, sustain_amplitude=.6, release=.2,
+                             sustain_till_close=True), Vibrato(6, .05),
+                Tremolo(4, .15), (Harmonic(2, .5, None), Harmonic(3, .3, .4)))
+
+# Free-running LFOs follow the render's clock, and spread ones the count of notes started before
+lfo_timbre = replace(timbre, lfos=(LFO(5., .01, 'pitch', sync='free'), LFO(3., .3, 'amplitude', sync='free', phase=.25),
+                                   LFO(2., .5, 'harmonics', spread=.3)))
+
+
+def note(sample: int, track: int, kind: str, pitch: int, channel: int = 0) -> TimedMessage:
+    message = Message(kind, channel=channel, note=pitch, velocity=90 if kind == 'note_on' else 0)
+    return TimedMessage(sample=sample, track=track, message=message)
+
+
+# Two tracks on two channels, with a note held across window boundaries and the same note held in both tracks at once
+messages = sorted([
+    note(100, 0, 'note_on', 60), note(2000, 1, 'note_on', 64, 1), note(5000, 0, 'note_on', 67),
+    note(9000, 1, 'note_on', 60, 1), note(11000, 0, 'note_off', 60), note(12000, 0, 'note_off', 67),
+    note(14000, 1, 'note_off', 60, 1), note(15000, 1, 'note_off', 64, 1), note(17001, 0, 'note_on', 72),
+    note(20000, 0, 'note_off', 72),
+], key=lambda timed: timed.sample)
+
+
+@pytest.mark.parametrize('engine', ['streams', 'voicebank'])
+@pytest.mark.parametrize('split', ['track', 'time'])
+def test_split_render_matches_unsplit(engine, split):
+    settings = RenderSettings(timbre, SAMPLE_RATE, CHUNK_SIZE, engine)
+    unsplit = render_midi(messages, settings)
+    rendered = render_midi(messages, settings, split=split, window_seconds=.5)
+    assert rendered.shape == unsplit.shape
+    np.testing.assert_allclose(rendered, unsplit, rtol=0, atol=SPLIT_TOLERANCE)
+
+
+@pytest.mark.parametrize('engine, control_period', [('streams', 1), ('voicebank', 1), ('voicebank', 32)])
+def test_time_split_render_carries_lfos_on(engine, control_period):
+    settings = RenderSettings(lfo_timbre, SAMPLE_RATE, CHUNK_SIZE, engine, control_period=control_period)
+    unsplit = render_midi(messages, settings)
+    np.testing.assert_allclose(render_midi(messages, settings, split='time', window_seconds=.5), unsplit, rtol=0,
+                               atol=SPLIT_TOLERANCE)
+
+
+def test_time_split_render_carries_lfos_on_per_channel():
+    channels = (ChannelConfig(0, lfo_timbre), ChannelConfig(1, lfo_timbre, volume=.5))
+    settings = RenderSettings(timbre, SAMPLE_RATE, CHUNK_SIZE, 'voicebank', channels=channels)
+    unsplit = render_midi(messages, settings)
+    np.testing.assert_allclose(render_midi(messages, settings, split='time', window_seconds=.5), unsplit, rtol=0,
+                               atol=SPLIT_TOLERANCE)
+
+
+def test_track_split_render_refuses_spread_lfos():
+    free = replace(lfo_timbre, lfos=lfo_timbre.lfos[:2])
+    settings = RenderSettings(free, SAMPLE_RATE, CHUNK_SIZE)
+    np.testing.assert_allclose(render_midi(messages, settings, split='track'), render_midi(messages, settings),
+                               rtol=0, atol=SPLIT_TOLERANCE)
+    with pytest.raises(ValueError):
+        render_midi(messages, replace(settings, timbre=lfo_timbre), split='track')
+
+
+def test_split_render_does_not_depend_on_workers():
+    settings = RenderSettings(timbre, SAMPLE_RATE, CHUNK_SIZE)
+    np.testing.assert_array_equal(render_midi(messages, settings, split='time', window_seconds=.5, workers=2),
+                                  render_midi(messages, settings, split='time', window_seconds=.5))
+
+
+def test_plan_leaves_out_note_on_of_held_note():
+    segments = plan_segments(messages, 'track', window=4096)
+    # Track 1's note 60 starts while track 0 holds it, and track 0's note_off releases it, leaving track 1's unheard
+    assert [len(segment.messages) for segment in segments] == [6, 2]
+    assert not any(timed.message.note == 60 for timed in segments[1].messages)
+
+
+def test_split_render_refuses_voice_limit():
+    settings = RenderSettings(timbre, SAMPLE_RATE, CHUNK_SIZE, polyphony=Polyphony(max_voices=2))
+    with pytest.raises(ValueError):
+        render_midi(messages, settings, split='track')
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from src.dataclasses import ADSRProfile, Harmonic, Timbre, Tremolo
+from src.samplebank import NOTES, SampleBank, SamplePlaybackBank, build_sample_bank
+from src.services import midi_note_to_frequency
+from src.synth import create_synthesizer
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 256
+
+timbre = Timbre(ADSRProfile(attack=.01, decay=.05, sustain_amplitude=.7, release=.1, sustain_till_close=True),
+                tremolo=Tremolo(rate=5., depth=.1), harmonics=(Harmonic(1, 1., None), Harmonic(2, .4, .03)))
+
+
+@pytest.fixture(scope='module')
+def bank(tmp_path_factory) -> SampleBank:
+    filename = str(tmp_path_factory.mktemp('bank') / 'bank.synb')
+    return build_sample_bank(timbre, filename, SAMPLE_RATE, velocities=(127, 64), loop_seconds=.05)
+
+
+def test_sample_bank_reads_its_notes_and_wraps_their_loops(bank):
+    assert bank.sample_rate == SAMPLE_RATE and bank.velocities == (64, 127)
+    assert len(bank.offsets) == 2 * NOTES
+
+    # Notes a bit louder than the soft layer come from the loud one, made up for by the gain
+    region, gain = bank.region(midi_note_to_frequency(69), 80 / 127)
+    assert region == NOTES + 69 and gain == pytest.approx(80 / 127)
+    offset, loop_start, loop_end = bank.offsets[region], bank.loop_starts[region], bank.loop_ends[region]
+    # The harmonic with its own sustain time has faded out before the loop, which holds whole periods of A4
+    assert loop_start >= (.03 + timbre.envelope.release) * SAMPLE_RATE
+    assert (loop_end - loop_start) * 440 / SAMPLE_RATE == pytest.approx(round(.05 * 440), abs=.01)
+
+    out = np.empty(3 * loop_end, dtype=np.float32)
+    bank.read(region, -100, out)
+    assert not out[:100].any()
+    np.testing.assert_array_equal(out[100:100 + loop_end], bank.samples[offset:offset + loop_end])
+    loop = bank.samples[offset + loop_start:offset + loop_end]
+    np.testing.assert_array_equal(out[100 + loop_end:100 + 2 * loop_end - loop_start], loop)
+    np.testing.assert_array_equal(out[100 + 2 * loop_end - loop_start:100 + 3 * loop_end - 2 * loop_start], loop)
+
+
+def test_sample_bank_is_refused_for_another_timbre_or_sample_rate(bank):
+    other = Timbre(timbre.envelope, harmonics=timbre.harmonics)
+    assert bank.matches(timbre) and not bank.matches(other)
+    with pytest.raises(ValueError, match='another timbre'):
+        SamplePlaybackBank(other, bank, CHUNK_SIZE)
+    with pytest.raises(ValueError, match='sample bank rendered at'):
+        create_synthesizer(timbre, 2 * SAMPLE_RATE, CHUNK_SIZE, engine='sampler', sample_bank=bank)
+
+
+def test_sampler_sounds_like_the_voice_bank_until_its_loop(bank):
+    # Up to where the loop's end starts fading into what precedes its start, 10 ms (the default crossfade) before it
+    length = bank.loop_ends[NOTES + 69] - SAMPLE_RATE // 100
+
+    def render(engine: str) -> np.ndarray:
+        synth = create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE, engine=engine, sample_bank=bank)
+        synth.note_on(69, 127)
+        return np.concatenate([next(synth).copy() for _ in range(-(-length // CHUNK_SIZE))])[:length]
+
+    np.testing.assert_allclose(render('sampler'), render('voicebank'), rtol=0, atol=2e-5)
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pytest
+from mido import Message
+
+from src.dataclasses import ADSRProfile, Timbre, Tremolo
+from src.effects import MultiplyAudioStreamDecorator
+from src.outputs import AudioFileOutputDecorator
+from src.synth import create_synthesizer
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 256
+CHUNKS = 400  # Long stretches of silence on both sides of one note
+
+timbre = Timbre(ADSRProfile(attack=.01, decay=.05, sustain_amplitude=.7, release=.1, sustain_till_close=True),
+                tremolo=Tremolo(rate=4., depth=.1))
+LAST_SOUNDING = 213  # The chunk the release ends in
+
+
+def render(engine: str, filename: str, sparse: bool) -> tuple[np.ndarray, list[bool]]:
+    synth = create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE, engine=engine)
+    synth.schedule(Message('note_on', note=69, velocity=100), 200 * CHUNK_SIZE + 17)
+    synth.schedule(Message('note_off', note=69), 210 * CHUNK_SIZE)
+    stream = AudioFileOutputDecorator(MultiplyAudioStreamDecorator(synth, multiplier=.5), filename, file_format='raw',
+                                      sparse=sparse)
+    chunks, flags = [], []
+    for _ in range(CHUNKS):
+        chunks.append(next(stream).copy())
+        flags.append(stream.silent)
+    stream.close()
+    return np.concatenate(chunks), flags
+
+
+@pytest.mark.parametrize('engine', ('streams', 'voicebank'))
+def test_silent_chunks_are_flagged_and_skipped_in_sparse_files(engine, tmp_path):
+    sparse, dense = tmp_path / 'sparse.raw', tmp_path / 'dense.raw'
+    samples, flags = render(engine, str(sparse), sparse=True)
+    render(engine, str(dense), sparse=False)
+
+    # Chunks flagged silent are all zeros, and every chunk is flagged but the ones the note sounds in; the streams
+    # engine notices the note has finished one chunk later
+    chunks = samples.reshape(CHUNKS, CHUNK_SIZE)
+    assert not chunks[np.array(flags)].any()
+    assert all(chunks[200:LAST_SOUNDING + 1].any(axis=1))
+    unflagged = [index for index, silent in enumerate(flags) if not silent]
+    assert unflagged in (list(range(200, LAST_SOUNDING + 1)), list(range(200, LAST_SOUNDING + 2)))
+
+    # Both files read back as what was rendered; the silence of the sparse one takes no space on disk
+    for filename in (sparse, dense):
+        np.testing.assert_array_equal(np.fromfile(filename, dtype='<f4'), samples)
+    assert os.stat(sparse).st_blocks < os.stat(dense).st_blocks / 4
@@ -0,0 +1,76 @@
+import sys
+
+import pytest
+
+import synthon
+from src.dataclasses import LFO
+
+
+def parse(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['synthon.py', *args])
+    return synthon.parse_args()
+
+
+@pytest.mark.parametrize('engine', ['streams', 'fused', 'additive'])
+def test_adaptive_latency_refuses_engines_rendering_whole_chunks(monkeypatch, capsys, engine):
+    with pytest.raises(SystemExit):
+        parse(monkeypatch, '--engine', engine, '--adaptive-latency')
+    assert '--adaptive-latency' in capsys.readouterr().err
+
+
+def test_adaptive_latency_refuses_timbres_the_additive_engine_takes_over(monkeypatch, capsys):
+    harmonics = [f'{multiple},{1 / multiple},None' for multiple in range(1, 13)]
+    with pytest.raises(SystemExit):
+        parse(monkeypatch, '--engine', 'voicebank', '--adaptive-latency', '--additive-threshold', '8',
+              *[arg for harmonic in harmonics for arg in ('--harmonic', harmonic)])
+    assert 'additive engine' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('engine', ['voicebank', 'sampler'])
+def test_adaptive_latency_takes_variable_block_engines(monkeypatch, engine):
+    assert parse(monkeypatch, '--engine', engine, '--adaptive-latency').adaptive_latency
+
+
+@pytest.mark.parametrize('engine', ['streams', 'fused'])
+def test_modulation_quality_refuses_full_rate_engines(monkeypatch, capsys, engine):
+    with pytest.raises(SystemExit):
+        parse(monkeypatch, '--engine', engine, '--modulation-quality', 'medium')
+    assert '--modulation-quality' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('engine', ['voicebank', 'additive', 'sampler'])
+def test_modulation_quality_takes_control_rate_engines(monkeypatch, engine):
+    assert parse(monkeypatch, '--engine', engine, '--modulation-quality', 'medium').modulation_quality == 'medium'
+
+
+@pytest.mark.parametrize('engine, scaled', (('fused', False), ('streams', True), ('voicebank', True)))
+def test_volume_is_applied_once(monkeypatch, engine, scaled):
+    args = parse(monkeypatch, '--engine', engine, '--volume', '.5')
+    synth = synthon.create_stream(args, midi_handler=None)
+    stream = synthon.apply_volume(args, synth, synth)
+    assert (stream is not synth) == scaled
+    if scaled:
+        assert stream.multiplier == .5
+
+
+@pytest.mark.parametrize('value, lfo', (
+    ('2,.1,pitch', LFO(rate=2., depth=.1, target='pitch')),
+    ('2,.1,pitch,free', LFO(rate=2., depth=.1, target='pitch', sync='free')),
+    ('2,.1,pitch,free,.25', LFO(rate=2., depth=.1, target='pitch', sync='free', phase=.25)),
+    ('2,.1,pitch,key,.25,.5', LFO(rate=2., depth=.1, target='pitch', phase=.25, spread=.5)),
+))
+def test_lfo_optional_fields_default(monkeypatch, value, lfo):
+    assert synthon.create_timbre(parse(monkeypatch, '--lfo', value)).lfos == (lfo,)
+
+
+@pytest.mark.parametrize('value', ('2,.1', '2,.1,pitch,key,0,0,0', '2,.1,pulse', '2,.1,pitch,sometimes'))
+def test_lfo_refuses_malformed_values(monkeypatch, value):
+    with pytest.raises(ValueError, match='Invalid LFO'):
+        synthon.create_timbre(parse(monkeypatch, '--lfo', value))
+
+
+@pytest.mark.parametrize('offline', (('--render-midi', 'song.mid'), ('--build-sample-bank',)))
+def test_patch_cache_refuses_offline_renders(monkeypatch, capsys, offline):
+    with pytest.raises(SystemExit):
+        parse(monkeypatch, '--patch-cache', 'patches', *offline)
+    assert '--patch-cache only serves live starts' in capsys.readouterr().err
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from mido import Message
+
+from src.dataclasses import ADSRProfile, Harmonic, Timbre, Tremolo, Vibrato
+from src.synth import create_synthesizer
+
+SAMPLE_RATE = 8000
+CHUNK_SIZE = 256
+TOLERANCE = 1e-5  # float32 rounding, the voice bank summing voices and partials in another order
+
+TIMBRES = {
+    'sine': Timbre(ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3, sustain_till_close=True),
+                   vibrato=Vibrato(rate=5.5, depth=.06), tremolo=Tremolo(rate=4., depth=.1)),
+    'harmonics': Timbre(ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3, sustain=.5),
+                        vibrato=Vibrato(rate=5.5, depth=.06), tremolo=Tremolo(rate=4., depth=.1),
+                        harmonics=(Harmonic(1, 1., None), Harmonic(2, .5, None), Harmonic(3, .3, .4))),
+    'saw': Timbre(ADSRProfile(attack=.05, decay=.2, sustain_amplitude=.7, release=.3, sustain_till_close=True),
+                  tremolo=Tremolo(rate=4., depth=.1), oscillator='saw'),
+}
+
+
+def render(engine: str, timbre: Timbre) -> np.ndarray:
+    """Overlapping notes that start and end mid-chunk, until they have all rung out"""
+    synth = create_synthesizer(timbre, SAMPLE_RATE, CHUNK_SIZE, engine=engine)
+    for note in range(4):
+        synth.schedule(Message('note_on', note=48 + 5 * note, velocity=100 - 10 * note), 37 * note)
+        synth.schedule(Message('note_off', note=48 + 5 * note), SAMPLE_RATE // 2 + 101 * note)
+    chunks = []
+    while synth.pending_events or synth.voice_count:
+        chunks.append(next(synth).copy())
+        if not synth.pending_events and not synth.is_closing:
+            synth.start_closing()
+    return np.concatenate(chunks)
+
+
+@pytest.mark.parametrize('timbre', TIMBRES.values(), ids=TIMBRES.keys())
+def test_voicebank_sounds_like_streams(timbre):
+    streams, voicebank = render('streams', timbre), render('voicebank', timbre)
+    # The streams engine may yield silent chunks after the last note has rung out, which the voice bank does not
+    length = min(len(streams), len(voicebank))
+    assert not streams[length:].any() and not voicebank[length:].any()
+    np.testing.assert_allclose(voicebank[:length], streams[:length], rtol=0, atol=TOLERANCE)
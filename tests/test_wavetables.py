@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from src.services import generate_wavetable_wave
+from src.wavetables import MIPMAP_HARMONICS, mipmap, oscillator_table
+
+SAMPLE_RATE = 44100
+NYQUIST = SAMPLE_RATE / 2
+
+
+@pytest.mark.parametrize('frequency', (20., 86.1, 86.2, 440., 1000., 5000., 11025., 15000.))
+def test_mipmap_picks_the_fullest_level_below_nyquist(frequency):
+    table = mipmap('saw', ((1, 1.),), SAMPLE_RATE)
+    level = table.level(frequency)
+    # Level k keeps the first MIPMAP_HARMONICS >> k harmonics; the level below it would put one past Nyquist
+    assert (MIPMAP_HARMONICS >> level) * frequency <= NYQUIST
+    if level:
+        assert (MIPMAP_HARMONICS >> (level - 1)) * frequency > NYQUIST
+    assert np.array_equal(table.table(frequency), table.tables[level])
+
+
+def alias_level(table: np.ndarray, frequency: float) -> float:
+    """The loudest component that isn't a harmonic of 'frequency', in dB below the loudest one"""
+    size = 1 << 15
+    samples = next(generate_wavetable_wave(table, frequency, size, SAMPLE_RATE, 1.))
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(size)))
+    frequencies = np.fft.rfftfreq(size, 1 / SAMPLE_RATE)
+    harmonics = np.abs((frequencies + frequency / 2) % frequency - frequency / 2) < 30  # Hz around each harmonic
+    return 20 * np.log10(spectrum[~harmonics].max() / spectrum.max())
+
+
+@pytest.mark.parametrize('oscillator', ('saw', 'square'))
+@pytest.mark.parametrize('frequency', (3000., 7040., 15000.))
+def test_mipmap_suppresses_aliasing_near_nyquist(oscillator, frequency):
+    band_limited = oscillator_table(((1, 1.),), frequency, SAMPLE_RATE, oscillator)
+    assert alias_level(band_limited, frequency) < -80
+    # Reading the fullest level instead folds harmonics past Nyquist back into the audible band
+    assert alias_level(mipmap(oscillator, ((1, 1.),), SAMPLE_RATE).tables[0], frequency) > -30